@@ -0,0 +1,103 @@
+"""
+The per record cost of building and serialising CourseList/CourseData, the way the code used to do it against the bulk
+paths in scraper/models.py. The records are the saved pages in benchmarks/fixtures run through the providers' parsers,
+repeated up to --records, so the strings are the size real ones are.
+
+Usage: python -m benchmarks.models [--records 2000] [--repeat 20]
+"""
+from benchmarks.parsers import FIXTURES_DIR, load_fixtures
+from scraper.models import CourseData, CourseList, course_list_page, course_data_list, record_fields
+from scraper.providers import get_provider_class
+from rich.console import Console
+from rich.table import Table
+from collections.abc import Callable
+import argparse, orjson, os, sys, time
+
+
+def load_records(count: int) -> tuple[list[dict], list[dict]]:
+    """
+    `count` search rows and `count` parsed course records, both as plain dicts.
+    """
+    rows, records = [], []
+    for university_name in sorted(os.listdir(FIXTURES_DIR)):
+        ProviderClass = get_provider_class(university_name)
+        if ProviderClass is None:
+            continue
+        provider = ProviderClass(fast_parse=True)
+        for _, html_content, course_info in load_fixtures(university_name):
+            rows.append(course_info.model_dump())
+            records.append(provider.parse_courses(html_content, course_info).model_dump())
+    return [rows[number % len(rows)] for number in range(count)], [records[number % len(records)] for number in range(count)]
+
+
+def per_record(function: Callable[[], object], count: int, repeat: int) -> float:
+    """
+    Microseconds per record, the best of `repeat` runs over all `count` records.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best / count * 1_000_000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=2000, help="how many records every case handles per run")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per case, the best one is kept")
+    args = parser.parse_args()
+
+    rows, records = load_records(args.records)
+    course_lists = course_list_page(rows)
+    course_datas = course_data_list(records)
+
+    # The new serialisation has to write exactly the same bytes as the old one, otherwise it isn't a drop in replacement
+    identical = all(orjson.dumps(record.model_dump()) == orjson.dumps(record_fields(record)) for record in course_datas)
+
+    # (what, before, after), every pair does the same job
+    cases = [
+        (
+            "CourseList from a search page",
+            ("one CourseList(**row) at a time", lambda: [CourseList(**row) for row in rows]),
+            ("course_list_page(rows)", lambda: course_list_page(rows)),
+        ),
+        (
+            "CourseList, skipping validation",
+            ("one CourseList(**row) at a time", lambda: [CourseList(**row) for row in rows]),
+            ("CourseList.model_construct(**row)", lambda: [CourseList.model_construct(**row) for row in rows]),
+        ),
+        (
+            "CourseData read back from disk",
+            ("one CourseData(**record) at a time", lambda: [CourseData(**record) for record in records]),
+            ("course_data_list(records)", lambda: course_data_list(records)),
+        ),
+        (
+            "CourseData to a JSON line",
+            ("orjson.dumps(record.model_dump())", lambda: [orjson.dumps(record.model_dump()) for record in course_datas]),
+            ("orjson.dumps(record_fields(record))", lambda: [orjson.dumps(record_fields(record)) for record in course_datas]),
+        ),
+        (
+            "CourseList to a JSON line",
+            ("orjson.dumps(course.model_dump())", lambda: [orjson.dumps(course.model_dump()) for course in course_lists]),
+            ("orjson.dumps(record_fields(course))", lambda: [orjson.dumps(record_fields(course)) for course in course_lists]),
+        ),
+    ]
+
+    console = Console()
+    table = Table(title=f"Per record cost over {args.records} records (best of {args.repeat})")
+    for column in ("Case", "Before", "µs", "After", "µs", "Speedup"):
+        table.add_column(column)
+    for name, (before_name, before), (after_name, after) in cases:
+        before_cost = per_record(before, args.records, args.repeat)
+        after_cost = per_record(after, args.records, args.repeat)
+        table.add_row(name, before_name, f"{before_cost:.2f}", after_name, f"{after_cost:.2f}", f"{before_cost / after_cost:.1f}x")
+    console.print(table)
+
+    style = "green" if identical else "bold red"
+    console.print(f"[{style}]record_fields output identical to model_dump output: {'yes' if identical else 'no'}[/]")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Benchmarks the BeautifulSoup and lxml parse_courses paths of every provider against the saved pages in benchmarks/fixtures,
+and checks both paths produce exactly the same CourseData.
+
+Usage: python -m benchmarks.parsers [--repeat 200]
+"""
+from scraper.providers import get_provider_class
+from scraper.providers.base_provider import BaseProvider
+from scraper.models import CourseData, CourseList
+from rich.console import Console
+from rich.table import Table
+import argparse, os, sys, time, orjson
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+def load_fixtures(university_name: str) -> list[tuple[str, str, CourseList]]:
+    """
+    Every fixture directory has an index.json of file name -> the CourseList the page was found through.
+    """
+    directory = os.path.join(FIXTURES_DIR, university_name)
+    with open(os.path.join(directory, "index.json"), "rb") as fh:
+        index = orjson.loads(fh.read())
+
+    fixtures = []
+    for filename, course_info in index.items():
+        with open(os.path.join(directory, filename), encoding="utf-8") as fh:
+            fixtures.append((filename, fh.read(), CourseList(**course_info)))
+    return fixtures
+
+
+def time_parser(provider: BaseProvider, fixtures: list[tuple[str, str, CourseList]], repeat: int) -> tuple[float, list[CourseData]]:
+    """
+    Returns pages/sec for the provider's current parse path and the output of the first pass.
+    """
+    outputs = [provider.parse_courses(html_content, course_info) for _, html_content, course_info in fixtures]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html_content, course_info in fixtures:
+            provider.parse_courses(html_content, course_info)
+    elapsed = time.perf_counter() - start
+    return (repeat * len(fixtures)) / elapsed, outputs
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="how many times every fixture is parsed per path")
+    args = parser.parse_args()
+
+    console = Console()
+    table = Table(title="parse_courses throughput")
+    for column in ("Provider", "Pages", "BeautifulSoup (pages/s)", "lxml (pages/s)", "Speedup", "Identical"):
+        table.add_column(column)
+
+    mismatches = 0
+    for university_name in sorted(os.listdir(FIXTURES_DIR)):
+        ProviderClass = get_provider_class(university_name)
+        if ProviderClass is None:
+            console.print(f"No provider registered for fixtures '{university_name}', skipping", style="yellow")
+            continue
+        fixtures = load_fixtures(university_name)
+
+        soup_rate, soup_outputs = time_parser(ProviderClass(fast_parse=False), fixtures, args.repeat)
+        lxml_rate, lxml_outputs = time_parser(ProviderClass(fast_parse=True), fixtures, args.repeat)
+
+        identical = True
+        for (filename, _, _), soup_output, lxml_output in zip(fixtures, soup_outputs, lxml_outputs):
+            if soup_output != lxml_output:
+                identical = False
+                mismatches += 1
+                console.print(f"[bold red]{university_name}/{filename} differs[/]\n  soup: {soup_output!r}\n  lxml: {lxml_output!r}")
+
+        table.add_row(
+            university_name, str(len(fixtures)), f"{soup_rate:,.0f}", f"{lxml_rate:,.0f}",
+            f"{lxml_rate / soup_rate:.1f}x", "[green]yes[/]" if identical else "[red]no[/]",
+        )
+
+    console.print(table)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+A local stand-in for the university sites, so the scraper can be benchmarked flat out without getting us banned.
+It answers the same requests the providers make with responses shaped like the real ones:
+- Keio: the search page, the language POST, the per-day `result` JSON and the `detail` pages
+- Glasgow: `searchresults` with its session-style pagination and the `course` pages
+The detail pages are the saved pages in benchmarks/fixtures, handed out round robin so any number of courses can be served.
+The search responses are generated from them since they only need to list the courses.
+
+Latency, jitter and a share of failed (503) responses can be injected to see how the engine copes with a slow or flaky site.
+Keio's search page hands out a session cookie like the real one, with a session lifetime set its POSTs answer with the
+HTML search page once the session has expired (or without one), which is how a provider finds out its saved session is stale.
+Point a provider at it with base_url, i.e KeioProvider(base_url=server.base_url("keio_university")).
+
+Usage: python -m benchmarks.replay_server [--courses 200] [--latency 0.05] [--jitter 0.02] [--error-rate 0.01] [--session-lifetime 60]
+"""
+from benchmarks.parsers import load_fixtures, FIXTURES_DIR
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, parse_qs
+import argparse, itertools, orjson, os, random, threading, time
+
+# Where each provider's pages live on the replay server, base_url is http://host:port + this
+PROVIDER_PATHS = {
+    "keio_university": "/pub-syllabus/",
+    "university_of_glasgow": "/coursecatalogue/",
+}
+# The real Glasgow search shows 10 results per page
+GLASGOW_PAGE_SIZE = 10
+# Keio splits its results by day, same codes as keio_university.DAY_CODES
+KEIO_DAY_CODES = ("1", "2", "3", "4", "5", "6", "9")
+KEIO_SESSION_COOKIE = "JSESSIONID"
+KEIO_SEARCH_PAGE = b"<html><body><form id='search'></form></body></html>"
+
+
+def replayable_providers() -> list[str]:
+    """
+    The providers the replay server can stand in for, the ones with saved pages in benchmarks/fixtures.
+    """
+    return [university_name for university_name in PROVIDER_PATHS if os.path.isdir(os.path.join(FIXTURES_DIR, university_name))]
+
+
+class ReplayServer:
+    """
+    Serves `courses` courses per provider on 127.0.0.1, on a free port unless one is given.
+    latency/jitter are seconds added to every response (uniformly +/- jitter), error_rate is the share of requests
+    answered with a 503 instead. The random numbers are seeded so runs can be compared with each other.
+    session_lifetime is how many seconds a Keio session lasts, None for sessions that are never checked.
+    """
+    def __init__(self, courses: int = 200, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, port: int = 0, seed: int = 0, session_lifetime: float | None = None) -> None:
+        self.courses = courses
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.session_lifetime = session_lifetime
+        # Keio session id -> when it was handed out, and how many sessions were handed out (i.e how many setups were done)
+        self._sessions: dict[str, float] = {}
+        self._session_ids = itertools.count(1)
+        self.sessions_started = 0
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.pages = {university_name: [html_content for _, html_content, _ in load_fixtures(university_name)] for university_name in replayable_providers()}
+        self.requests = 0
+        self.errors = 0
+
+        replay = self
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so the providers' sessions keep their connections open like they would against the real sites
+            protocol_version = "HTTP/1.1"
+            # The headers and body go out in separate writes, with Nagle on every response then waits on a delayed ACK (~40ms)
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                replay._handle(self, "GET")
+
+            def do_POST(self) -> None:
+                replay._handle(self, "POST")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def base_url(self, university_name: str) -> str:
+        return f"http://127.0.0.1:{self.port}{PROVIDER_PATHS[university_name]}"
+
+    def start(self) -> "ReplayServer":
+        """
+        Serves from a background thread, for use from inside the process being benchmarked.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="replay-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "ReplayServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _delay_and_fail(self) -> bool:
+        """
+        Sleeps for the injected latency, returns True if this request should fail.
+        """
+        with self._random_lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            self.requests += 1
+            self.errors += fail
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        body = b""
+        length = int(handler.headers.get("Content-Length") or 0)
+        if length:
+            body = handler.rfile.read(length)
+
+        if self._delay_and_fail():
+            self._send(handler, 503, b"Service Unavailable", "text/plain")
+            return
+
+        url = urlsplit(handler.path)
+        query = parse_qs(url.query)
+        form = parse_qs(body.decode("utf-8"))
+
+        if url.path == PROVIDER_PATHS["keio_university"] + "search" and method == "GET":
+            self._send(handler, 200, KEIO_SEARCH_PAGE, "text/html", {"Set-Cookie": f"{KEIO_SESSION_COOKIE}={self._start_session()}; Path=/"})
+            return
+        if url.path.startswith(PROVIDER_PATHS["keio_university"]) and method == "POST" and not self._session_alive(handler.headers.get("Cookie")):
+            self._send(handler, 200, KEIO_SEARCH_PAGE, "text/html")
+            return
+
+        if url.path.startswith(PROVIDER_PATHS["keio_university"]):
+            status, content, content_type = self._keio(method, url.path.removeprefix(PROVIDER_PATHS["keio_university"]), query, form)
+        elif url.path.startswith(PROVIDER_PATHS["university_of_glasgow"]):
+            status, content, content_type = self._glasgow(url.path.removeprefix(PROVIDER_PATHS["university_of_glasgow"]).strip("/"), query)
+        else:
+            status, content, content_type = 404, b"Not Found", "text/plain"
+        self._send(handler, status, content, content_type)
+
+    def _start_session(self) -> str:
+        with self._random_lock:
+            session_id = f"replay{next(self._session_ids)}"
+            self._sessions[session_id] = time.monotonic()
+            self.sessions_started += 1
+        return session_id
+
+    def _session_alive(self, cookie_header: str | None) -> bool:
+        if self.session_lifetime is None:
+            return True
+        cookie = SimpleCookie(cookie_header or "").get(KEIO_SESSION_COOKIE)
+        with self._random_lock:
+            started = self._sessions.get(cookie.value) if cookie is not None else None
+        return started is not None and time.monotonic() - started < self.session_lifetime
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, content: bytes, content_type: str, headers: dict[str, str] | None = None) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def _page(self, university_name: str, number: int) -> bytes:
+        pages = self.pages[university_name]
+        return pages[number % len(pages)].encode("utf-8")
+
+    def _keio(self, method: str, path: str, query: dict, form: dict) -> tuple[int, bytes, str]:
+        if path == "search":
+            # The GET (with its session cookie) is answered in _handle, the page has no course administrator table on
+            # purpose so the provider leaves its cached K-Number tables alone
+            return 200, b'{"msgType": "error"}', "application/json"
+
+        if path == "result" and method == "POST":
+            # Every course is held on exactly one day, so the provider's per-day searches add up to `courses`
+            day = KEIO_DAY_CODES.index(form.get("SELECTED_TT_DWCD", ["1"])[0])
+            entries = [
+                {
+                    "KNUMBER": f"BEN-CH-{number:05d}-211-00",
+                    "SYLLABUS_DETAIL_URL": f"detail?ttblyr=2025&entno={number}&lang=en",
+                    "SBJTNM": f"Benchmark Course {number}",
+                }
+                for number in range(day, self.courses, len(KEIO_DAY_CODES))
+            ]
+            return 200, orjson.dumps({"searchResultDs": [{"sbjtDs": entries}]}), "application/json"
+
+        if path == "detail":
+            return 200, self._page("keio_university", int(query.get("entno", ["0"])[0])), "text/html"
+        return 404, b"Not Found", "text/plain"
+
+    def _glasgow(self, path: str, query: dict) -> tuple[int, bytes, str]:
+        if path == "searchresults":
+            # The first page has the query, the rest only a page number (the real site keeps the query in the session)
+            page = int(query.get("p", ["1"])[0])
+            first = (page - 1) * GLASGOW_PAGE_SIZE
+            results = "".join(
+                f'<div class="catSearchResult">BENCH{number:04d}<a href="{PROVIDER_PATHS["university_of_glasgow"]}course/?code=BENCH{number:04d}">Benchmark Course {number}</a></div>'
+                for number in range(first, min(first + GLASGOW_PAGE_SIZE, self.courses))
+            )
+            navigation = '<a class="catSearchNavLink" href="#">Next</a>' if first + GLASGOW_PAGE_SIZE < self.courses else ""
+            return 200, f"<html><body><div id='results'>{results}</div>{navigation}</body></html>".encode("utf-8"), "text/html"
+
+        if path == "course":
+            code = query.get("code", ["BENCH0000"])[0]
+            return 200, self._page("university_of_glasgow", int(code.removeprefix("BENCH") or 0)), "text/html"
+        return 404, b"Not Found", "text/plain"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", type=int, default=200, help="how many courses every provider's search returns")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency varies by up to this many seconds either way")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--session-lifetime", type=float, default=None, help="seconds a Keio session lasts, by default they never expire")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = ReplayServer(args.courses, args.latency, args.jitter, args.error_rate, port=args.port, session_lifetime=args.session_lifetime)
+    for university_name in server.pages:
+        print(f"{university_name}: {server.base_url(university_name)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures how long the CLI takes to start, every scenario runs in a fresh interpreter since that is what a user pays for.
+The number that matters is "first prompt", importing main.py plus questionary, which is everything that happens before
+the first question shows. It is checked against STARTUP_TARGET_MS (on top of the bare interpreter's own start up).
+
+Usage: python -m benchmarks.startup [--repeat 10] [--check]
+"""
+from rich.console import Console
+from rich.table import Table
+import argparse, os, statistics, subprocess, sys, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds on top of `python -c pass` before the first prompt shows
+STARTUP_TARGET_MS = 250
+
+SCENARIOS = {
+    "interpreter": "pass",
+    "list providers": "from scraper.providers import PROVIDER_REGISTRY; list(PROVIDER_REGISTRY)",
+    "first prompt": "import main, questionary",
+    "select a provider": "import main; main.get_provider_class('keio_university')",
+    "import engine": "import scraper.engine",
+}
+
+
+def time_scenario(code: str, repeat: int) -> list[float]:
+    """
+    Wall clock milliseconds of every run, the first (cold file cache) run is thrown away.
+    """
+    timings = []
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings[1:]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="how many times every scenario is run")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if the first prompt is over the target")
+    args = parser.parse_args()
+
+    console = Console()
+    table = Table(title="CLI start up time (fresh interpreter per run)")
+    for column in ("Scenario", "Median (ms)", "Min (ms)", "Over interpreter (ms)"):
+        table.add_column(column)
+
+    medians = {}
+    for name, code in SCENARIOS.items():
+        timings = time_scenario(code, args.repeat)
+        medians[name] = statistics.median(timings)
+        overhead = medians[name] - medians["interpreter"]
+        table.add_row(name, f"{medians[name]:.1f}", f"{min(timings):.1f}", "" if name == "interpreter" else f"{overhead:.1f}")
+    console.print(table)
+
+    first_prompt = medians["first prompt"] - medians["interpreter"]
+    within_target = first_prompt <= STARTUP_TARGET_MS
+    style = "green" if within_target else "bold red"
+    console.print(f"[{style}]First prompt in {first_prompt:.1f}ms over the interpreter, target is {STARTUP_TARGET_MS}ms[/]")
+    return 1 if args.check and not within_target else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
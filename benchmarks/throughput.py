@@ -0,0 +1,142 @@
+"""
+End to end throughput of ScraperEngine.run against the local replay server (benchmarks/replay_server.py), for every
+provider with fixtures and every worker count asked for. It reports courses/sec, request latency p50/p99 (as seen by the
+provider, so including time waiting on the rate limiter and server side latency) and the peak traced memory of the run.
+
+The providers' max_requests_per_second is lifted for the benchmark, otherwise all it would measure is the politeness limit.
+Memory is measured with tracemalloc, which slows everything down a bit, it slows every run down the same way though.
+
+Save a run with --save and check a later one against it with --compare, any configuration that got more than
+--tolerance slower counts as a regression and the exit code is 1.
+
+Usage: python -m benchmarks.throughput [--courses 200] [--workers 1,2,4,8] [--latency 0.02] [--save results.json] [--compare results.json]
+"""
+from benchmarks.replay_server import ReplayServer, replayable_providers
+from scraper.engine import ScraperEngine
+from scraper.providers import get_provider_class
+from scraper.store import CourseStore
+from rich.console import Console
+from rich.table import Table
+import argparse, orjson, os, sys, tempfile, tracemalloc
+
+
+def run_once(university_name: str, workers: int, args: argparse.Namespace, store_path: str) -> dict:
+    """
+    One ScraperEngine.run against a fresh replay server, a new port means a new host so no rate limiter state carries over.
+    """
+    ProviderClass = get_provider_class(university_name)
+    assert ProviderClass is not None
+    with ReplayServer(args.courses, args.latency, args.jitter, args.error_rate) as server:
+        provider = ProviderClass(base_url=server.base_url(university_name), max_concurrency=workers, fast_parse=args.fast_parse)
+        provider.max_requests_per_second = args.max_rate
+        store = CourseStore(store_path)
+        engine = ScraperEngine(provider, max_workers=workers, output_format="store", store=store, resume=False, update_index=False, quiet=True)
+
+        tracemalloc.start()
+        try:
+            engine.run("keyword", "benchmark")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            store.close()
+
+    assert engine.metrics is not None
+    summary = engine.metrics.summary()
+    return {
+        "provider": university_name,
+        "workers": workers,
+        "written": engine.written,
+        "failed": len(engine.errors),
+        "wall_time": summary["wall_time"],
+        "courses_per_second": engine.written / summary["wall_time"] if summary["wall_time"] else 0.0,
+        "p50": summary["requests"]["latency"]["p50"],
+        "p99": summary["requests"]["latency"]["p99"],
+        "peak_memory": peak,
+        "requests": summary["requests"]["total"],
+        "injected_errors": server.errors,
+    }
+
+
+def find_regressions(results: list[dict], baseline: list[dict], tolerance: float) -> dict[tuple[str, int], float]:
+    """
+    (provider, workers) -> how much slower than the baseline it was, for every configuration over the tolerance.
+    """
+    baseline_rates = {(result["provider"], result["workers"]): result["courses_per_second"] for result in baseline}
+    regressions = {}
+    for result in results:
+        baseline_rate = baseline_rates.get((result["provider"], result["workers"]))
+        if not baseline_rate:
+            continue
+        slowdown = 1 - result["courses_per_second"] / baseline_rate
+        if slowdown > tolerance:
+            regressions[(result["provider"], result["workers"])] = slowdown
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", type=int, default=200, help="how many courses every provider's search returns")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts to run every provider with")
+    parser.add_argument("--providers", default=None, help="comma separated providers, defaults to every provider with fixtures")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the replay server adds to every response")
+    parser.add_argument("--jitter", type=float, default=0.01, help="latency varies by up to this many seconds either way")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests the replay server answers with a 503")
+    parser.add_argument("--max-rate", type=float, default=10_000.0, help="requests per second the providers are allowed for the benchmark")
+    parser.add_argument("--fast-parse", action="store_true", help="use the lxml parse path")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="compare against results saved with --save, exit with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="how much slower (0.2 = 20%%) counts as a regression")
+    args = parser.parse_args()
+
+    console = Console()
+    worker_counts = [int(workers) for workers in args.workers.split(",")]
+    university_names = args.providers.split(",") if args.providers else replayable_providers()
+
+    results = []
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        for university_name in university_names:
+            for workers in worker_counts:
+                console.print(f"{university_name} with {workers} workers...", style="dim")
+                results.append(run_once(university_name, workers, args, os.path.join(temporary_dir, f"{university_name}_{workers}.sqlite3")))
+
+    baseline: list[dict] = []
+    if args.compare:
+        with open(args.compare, "rb") as fh:
+            baseline = orjson.loads(fh.read())["results"]
+    regressions = find_regressions(results, baseline, args.tolerance)
+    baseline_rates = {(result["provider"], result["workers"]): result["courses_per_second"] for result in baseline}
+
+    table = Table(title=f"ScraperEngine.run throughput ({args.courses} courses, {args.latency * 1000:.0f}±{args.jitter * 1000:.0f}ms latency, {args.error_rate:.0%} errors)")
+    columns = ["Provider", "Workers", "Written", "Failed", "Courses/s", "p50 (ms)", "p99 (ms)", "Peak memory (MiB)"]
+    if baseline:
+        columns.append("vs baseline")
+    for column in columns:
+        table.add_column(column)
+    for result in results:
+        key = (result["provider"], result["workers"])
+        row = [
+            result["provider"], str(result["workers"]), str(result["written"]), str(result["failed"]),
+            f"{result['courses_per_second']:.1f}", f"{result['p50'] * 1000:.1f}", f"{result['p99'] * 1000:.1f}",
+            f"{result['peak_memory'] / 1024 / 1024:.1f}",
+        ]
+        if baseline:
+            baseline_rate = baseline_rates.get(key)
+            change = f"{result['courses_per_second'] / baseline_rate - 1:+.0%}" if baseline_rate else "-"
+            row.append(f"[bold red]{change}[/]" if key in regressions else change)
+        table.add_row(*row)
+    console.print(table)
+
+    if args.save:
+        with open(args.save, "wb") as fh:
+            fh.write(orjson.dumps({"settings": vars(args), "results": results}, option=orjson.OPT_INDENT_2))
+        console.print(f"Results saved to {args.save}")
+
+    if regressions:
+        for (university_name, workers), slowdown in regressions.items():
+            console.print(f"[bold red]{university_name} with {workers} workers is {slowdown:.0%} slower than the baseline[/]")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
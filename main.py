@@ -1,4 +1,5 @@
-from scraper.engine import ScraperEngine
+# Only the light imports go up here so the first prompt shows straight away, everything heavy (requests, bs4, lxml,
+# pydantic, sqlite, rich and questionary itself) is imported where it is first needed. See benchmarks/startup.py
 from scraper.providers import get_provider_class, PROVIDER_REGISTRY
 from scraper.errors import (
     ScraperError,
@@ -8,11 +9,24 @@ from scraper.errors import (
     HTTPStatusError,
     ParseError
 )
-import questionary
-from rich.console import Console
+from typing import TYPE_CHECKING
+import argparse
+import functools
+import os
+import subprocess
+import sys
+import time
+
+if TYPE_CHECKING:
+    from rich.console import Console
+    from scraper.models import CourseData
+    from scraper.store import CourseStore
 
 # Use console for later extensability if needed
-console = Console()
+@functools.cache
+def get_console() -> "Console":
+    from rich.console import Console
+    return Console()
 
 # TODO: Language mapping could work by having languages map to a value and then each provider would have their own internal global -> local language mapping
 # print("Available universities:")
@@ -27,77 +41,279 @@ choices = list(display_to_key.keys())
 option_map = {
     "Search by keyword": "keyword",
     "Search by course identifier": "course_identifier",
+    "Search offline": "offline",
+    "Search all universities": "all",
     "Exit": "exit"
 }
 
-while True:
-    # ? If for now we force every provider to provide search for both keyword and course identifier since most if not all universities list course codes on their website then later if we stumble along one that doesnt we can either consider making them optional or implement a check here to check which search methods are available
-    search_method = questionary.select(
-        "Do you want to search by keyword or course identifier?",
-        choices=["Search by keyword", "Search by course identifier", "Exit"],
-    ).ask()
-
-    # Map display text back to provider key
-    search_method = option_map[search_method]
-
-    if search_method == "exit":
-        print("Exiting...")
-        raise SystemExit()
-
-    selection = questionary.select(
-        "Select a university",
-        choices=choices,
-        use_arrow_keys=True,
-        use_jk_keys=False,
-        use_emacs_keys=False,
-        use_search_filter=True
-    ).ask()
-
-    # Map display text back to provider key
-    provider_key = display_to_key[selection]
-
-    if search_method == "keyword":
-        keyword = questionary.text(f"Enter the keyword to search {selection} for: ").ask()
-        while keyword.isascii() is False:
-            console.print("Please enter a valid ASCII keyword.", style="bold red")
-            keyword = questionary.text(f"Enter the keyword to search {selection} for: ").ask()
+def print_courses(courses: "list[CourseData]", title: str) -> None:
+    from rich.table import Table
+    table = Table(title=title)
+    for column in ("Course code", "Name", "Semester"):
+        table.add_column(column)
+    for course in courses:
+        table.add_row(course.course_code, course.name, course.semester)
+    get_console().print(table)
 
-    elif search_method == "course_identifier":
-        identifier = questionary.text(f"Enter the course identifier to search {selection} for: ").ask()
-        while identifier.isascii() is False:
-            console.print("Please enter a valid ASCII course identifier.", style="bold red")
-            identifier = questionary.text(f"Enter the course identifier to search {selection} for: ").ask()
+def search_offline(provider_key: str, query: str) -> bool:
+    """
+    Answers a search from the local index, course codes are looked up exactly and anything else is a keyword search.
+    Returns False if the index is missing or stale, in which case the caller should search the provider instead.
+    """
+    from scraper.index import CourseIndex
+    index = CourseIndex(provider_key)
+    if index.is_stale():
+        return False
 
-    ProviderClass = get_provider_class(provider_key)
-    if not ProviderClass:
-        raise ScraperError(f"Provider {provider_key} not found.")
+    start = time.perf_counter()
+    courses = index.lookup_code(query) or index.search(query)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if not courses:
+        get_console().print(f"No offline results for '{query}'.", style="yellow")
+    else:
+        print_courses(courses, f"{len(courses)} offline results for '{query}' ({elapsed:.1f}ms)")
+    return True
+
+def batch(job_file: str, jobs_per_provider: int, max_processes: int | None, output_dir: str | None, fast_parse: bool = False, parse_workers: int = 0) -> None:
+    """
+    Runs every job in the job file without any prompts, see scraper/batch.py for the job file format.
+    """
+    from scraper.batch import load_jobs, run_batch, report_table, JobResult
+    jobs = load_jobs(job_file)
+    get_console().print(f"Running {len(jobs)} jobs across {len({job.provider for job in jobs})} providers...")
+
+    def on_result(results: "list[JobResult]") -> None:
+        done = sum(result.status in ("ok", "partial") for result in results)
+        get_console().print(f"{results[0].job.provider}: {done}/{len(results)} jobs succeeded")
+
+    report = run_batch(jobs, jobs_per_provider=jobs_per_provider, max_processes=max_processes, output_dir=output_dir, on_result=on_result, fast_parse=fast_parse, parse_workers=parse_workers)
+    get_console().print(report_table(report))
+    get_console().print(f"Wrote {report.course_count} courses to {report.courses_path}")
+
+SHARD_STYLES = {"done": "green", "pending": "yellow", "failed": "bold red"}
+
+def crawl_catalogue(provider_key: str, workers: int, fresh: bool, retry_failed: bool, fast_parse: bool = False, parse_workers: int = 0) -> None:
+    """
+    Crawls a university's whole catalogue into the course store, run it again to carry on after it was stopped.
+    """
+    from scraper.crawl import crawl, ShardResult
 
-    provider = ProviderClass()
-    engine = ScraperEngine(provider)
+    def on_shard(result: "ShardResult") -> None:
+        style = SHARD_STYLES.get(result.status, "")
+        get_console().print(f"[{style}]{result.label}[/]: {result.status}, {result.written} courses in {result.elapsed:.1f}s" + (f" ({result.message})" if result.message else ""))
 
+    report = crawl(provider_key, workers=workers, fresh=fresh, retry_failed=retry_failed, on_shard=on_shard, fast_parse=fast_parse, parse_workers=parse_workers)
+    counts = ", ".join(f"{count} {status}" for status, count in report.counts.items() if count)
+    get_console().print(f"Crawl of {provider_key}: {counts} shards, {report.written} courses in the store after {report.elapsed:.1f}s")
+    for shard in report.failed_shards:
+        get_console().print(f"  {shard['label']} failed after {shard['attempts']} attempts: {shard['error']}", style="red")
+    if report.failed_shards:
+        get_console().print("Run it again with --retry-failed to give the failed shards another go.")
+
+OUTCOME_STYLES = {"ok": "green", "partial": "yellow", "timed_out": "yellow", "not_found": "yellow", "failed": "bold red"}
+
+def search_everywhere(keyword: str, store: "CourseStore") -> None:
+    """
+    Runs the keyword against every university at once, each one is reported as soon as it is done.
+    """
+    from scraper.fanout import search_all, ProviderOutcome
+
+    def on_outcome(outcome: "ProviderOutcome") -> None:
+        style = OUTCOME_STYLES.get(outcome.status, "")
+        get_console().print(f"[{style}]{outcome.provider}[/]: {outcome.status}, {outcome.written} courses in {outcome.elapsed:.1f}s" + (f" ({outcome.message})" if outcome.message else ""))
+
+    result = search_all(keyword, store=store, on_outcome=on_outcome)
+    get_console().print(f"Wrote {result.written} courses from {len(result.outcomes)} universities to {result.output_path} in {result.elapsed:.1f}s")
+
+def validate_budget(text: str) -> bool | str:
+    text = text.strip()
+    if not text:
+        return True
     try:
+        return float(text) > 0 or "The time budget has to be more than 0 seconds."
+    except ValueError:
+        return "Enter a number of seconds, or leave it empty."
+
+def finish_in_background(pending_path: str, fast_parse: bool = False, parse_workers: int = 0) -> None:
+    """
+    Starts `main.py --finish` in its own process so the rest of a budgeted search is scraped while the user carries on,
+    it parses the same way this run does.
+    """
+    log_path = pending_path.removesuffix(".json") + ".log"
+    with open(log_path, "ab") as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--finish", pending_path, "--parse-workers", str(parse_workers)] + (["--fast-parse"] if fast_parse else []),
+            stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True,
+        )
+    get_console().print(f"Finishing the rest in the background, its output goes to {log_path}")
+
+def finish_pending(pending_path: str, fast_parse: bool = False, parse_workers: int = 0) -> None:
+    """
+    Finishes a search a time budget cut short, see scraper/deadline.py. It is the same search run again without a budget,
+    everything the budgeted run already did comes out of its checkpoint instead of being fetched again.
+    """
+    from scraper.deadline import load_completeness
+    from scraper.engine import ScraperEngine
+    from scraper.cache import ResponseCache
+    from scraper.sessions import SessionStore
+    completeness = load_completeness(pending_path)
+    ProviderClass = get_provider_class(completeness.provider)
+    if not ProviderClass:
+        raise ScraperError(f"Provider {completeness.provider} not found.")
+    engine = ScraperEngine(ProviderClass(cache=ResponseCache(), sessions=SessionStore(), fast_parse=fast_parse), store=get_store(), quiet=True, parse_workers=parse_workers)
+    engine.run(completeness.search_method, completeness.value)
+    get_console().print(f"Finished {completeness.provider} '{completeness.value}', {engine.written} courses written to {engine.output_path}")
+    for course, error in engine.errors:
+        get_console().print(f"  {course.course_code} ({course.url}): {error}", style="red")
+
+@functools.cache
+def get_store() -> "CourseStore":
+    # Every scrape is upserted into the one course store, so courses found by several searches are only kept once
+    from scraper.store import CourseStore
+    return CourseStore()
+
+def main(profile: bool = False, refresh: bool = False, fast_parse: bool = False, parse_workers: int = 0) -> None:
+    import questionary
+    while True:
+        # ? If for now we force every provider to provide search for both keyword and course identifier since most if not all universities list course codes on their website then later if we stumble along one that doesnt we can either consider making them optional or implement a check here to check which search methods are available
+        search_method = questionary.select(
+            "Do you want to search by keyword or course identifier?",
+            choices=list(option_map.keys()),
+        ).ask()
+
+        # Map display text back to provider key
+        search_method = option_map[search_method]
+
+        if search_method == "exit":
+            print("Exiting...")
+            raise SystemExit()
+
+        if search_method == "all":
+            keyword = questionary.text("Enter the keyword to search every university for: ").ask()
+            while keyword.isascii() is False:
+                get_console().print("Please enter a valid ASCII keyword.", style="bold red")
+                keyword = questionary.text("Enter the keyword to search every university for: ").ask()
+            search_everywhere(keyword, get_store())
+            continue
+
+        selection = questionary.select(
+            "Select a university",
+            choices=choices,
+            use_arrow_keys=True,
+            use_jk_keys=False,
+            use_emacs_keys=False,
+            use_search_filter=True
+        ).ask()
+
+        # Map display text back to provider key
+        provider_key = display_to_key[selection]
+
         if search_method == "keyword":
-            engine.run(search_method, keyword)
+            keyword = questionary.text(f"Enter the keyword to search {selection} for: ").ask()
+            while keyword.isascii() is False:
+                get_console().print("Please enter a valid ASCII keyword.", style="bold red")
+                keyword = questionary.text(f"Enter the keyword to search {selection} for: ").ask()
+
         elif search_method == "course_identifier":
-            engine.run(search_method, identifier)
-
-    # The identifier the user input is invalid in some way
-    except ValidationError as error:
-        console.print(f"Validation error: {error}", style="bold red")
-        continue
-    # We get a valid resposne from the provider but its contents are malformed/unexpected
-    except ParseError as error:
-        console.print(f"Parse error: {error}", style="bold red")
-        continue
-    # The course is not found, either the identifier is 'valid' but no such course exists, or the keyword search returned no results
-    except CourseNotFoundError as error:
-        console.print(f"No results: {error}", style="yellow")
-        continue
-    # Either Timeout or Connection error or HTTP error
-    except (NetworkError, HTTPStatusError) as error:
-        console.print(f"Network/HTTP error: {error}", style="bold yellow")
-        continue
-    # Catch all other scraper related errors
-    except ScraperError as error:
-        console.print(f"Scraper error: {error}", style="bold red")
-        continue
\ No newline at end of file
+            identifier = questionary.text(f"Enter the course identifier to search {selection} for: ").ask()
+            while identifier.isascii() is False:
+                get_console().print("Please enter a valid ASCII course identifier.", style="bold red")
+                identifier = questionary.text(f"Enter the course identifier to search {selection} for: ").ask()
+
+        elif search_method == "offline":
+            keyword = questionary.text(f"Enter the keyword or course identifier to search {selection} for offline: ").ask()
+            if search_offline(provider_key, keyword):
+                continue
+            # Nothing recent enough in the index, so do it live, this also adds the results to the index for next time
+            get_console().print(f"The offline index for {selection} is missing or out of date, searching online instead.", style="yellow")
+            ProviderClass = get_provider_class(provider_key)
+            if ProviderClass is not None and ProviderClass.is_identifier(keyword):
+                search_method, identifier = "course_identifier", keyword
+            else:
+                search_method = "keyword"
+
+        # A course code finds a course or two, a budget is only worth asking for when a keyword might find hundreds
+        time_budget = None
+        if search_method == "keyword":
+            budget = questionary.text("Time budget in seconds (leave empty to get everything): ", validate=validate_budget).ask()
+            time_budget = float(budget) if budget and budget.strip() else None
+
+        ProviderClass = get_provider_class(provider_key)
+        if not ProviderClass:
+            raise ScraperError(f"Provider {provider_key} not found.")
+
+        from scraper.engine import ScraperEngine
+        from scraper.cache import ResponseCache
+        from scraper.sessions import SessionStore
+        # The cache makes re-running the same search almost free, course pages only change about once a term, and a
+        # saved session skips the provider's setup requests
+        provider = ProviderClass(cache=ResponseCache(), sessions=SessionStore(), fast_parse=fast_parse)
+        engine = ScraperEngine(provider, store=get_store(), profile=profile, refresh=refresh, time_budget=time_budget, parse_workers=parse_workers)
+
+        try:
+            if search_method == "keyword":
+                engine.run(search_method, keyword)
+            elif search_method == "course_identifier":
+                engine.run(search_method, identifier)
+
+        # The identifier the user input is invalid in some way
+        except ValidationError as error:
+            get_console().print(f"Validation error: {error}", style="bold red")
+            continue
+        # We get a valid resposne from the provider but its contents are malformed/unexpected
+        except ParseError as error:
+            get_console().print(f"Parse error: {error}", style="bold red")
+            continue
+        # The course is not found, either the identifier is 'valid' but no such course exists, or the keyword search returned no results
+        except CourseNotFoundError as error:
+            get_console().print(f"No results: {error}", style="yellow")
+            continue
+        # Either Timeout or Connection error or HTTP error
+        except (NetworkError, HTTPStatusError) as error:
+            get_console().print(f"Network/HTTP error: {error}", style="bold yellow")
+            continue
+        # Catch all other scraper related errors
+        except ScraperError as error:
+            get_console().print(f"Scraper error: {error}", style="bold red")
+            continue
+
+        # The time budget ran out before everything was done, what was finished has been written already
+        completeness = engine.completeness
+        if completeness is not None and not completeness.complete:
+            from scraper.deadline import pending_path
+            get_console().print(
+                f"Got {completeness.written} of {completeness.found} courses in {completeness.elapsed:.1f}s"
+                + ("" if completeness.search_complete else ", the search itself wasn't finished"),
+                style="yellow",
+            )
+            if questionary.confirm("Finish the rest in the background?", default=True).ask():
+                finish_in_background(pending_path(completeness.provider, completeness.search_method, completeness.value), fast_parse=fast_parse, parse_workers=parse_workers)
+
+
+# The guard matters, the parse processes (ScraperEngine parse_workers) re-import this module on platforms that spawn them
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find matching courses at universities abroad, interactively, from a job file or by crawling a whole catalogue.")
+    parser.add_argument("--batch", metavar="JOB_FILE", help="run every job in this file (.json, .ndjson or .csv of provider, method, value) unattended")
+    parser.add_argument("--jobs-per-provider", type=int, default=1, help="how many of a provider's jobs run at once, they share its max_concurrency through its rate limiter")
+    parser.add_argument("--processes", type=int, default=None, help="at most this many provider processes at once, defaults to one per provider")
+    parser.add_argument("--output", default=None, help="directory for the batch's courses.json and report.json, defaults to data/batch/<timestamp>")
+    parser.add_argument("--profile", action="store_true", help="cProfile and tracemalloc every scrape, written next to its metrics in data/metrics")
+    parser.add_argument("--crawl", metavar="PROVIDER", help="crawl this university's whole catalogue into the course store, picks up where the last crawl stopped")
+    parser.add_argument("--crawl-workers", type=int, default=2, help="how many shards of the crawl are scraped at once, they share the provider's max_concurrency through its rate limiter")
+    parser.add_argument("--fresh", action="store_true", help="start the crawl over and fetch every course again instead of carrying on")
+    parser.add_argument("--retry-failed", action="store_true", help="give shards that failed on an earlier crawl another go")
+    parser.add_argument("--refresh", action="store_true", help="fetch every course again instead of reusing ones finished by an earlier run of the same search")
+    parser.add_argument("--fast-parse", action="store_true", help="parse course pages with lxml instead of BeautifulSoup, same output a lot faster (see benchmarks/parsers.py)")
+    parser.add_argument("--parse-workers", type=int, default=0, help="parse course pages in this many processes alongside the fetching, worth it for big searches, 0 parses in the fetch threads")
+    parser.add_argument("--finish", metavar="PENDING_FILE", help="finish a search a time budget cut short, from its file in data/pending")
+    args = parser.parse_args()
+
+    if args.batch:
+        batch(args.batch, args.jobs_per_provider, args.processes, args.output, fast_parse=args.fast_parse, parse_workers=args.parse_workers)
+    elif args.crawl:
+        crawl_catalogue(args.crawl, args.crawl_workers, args.fresh, args.retry_failed, fast_parse=args.fast_parse, parse_workers=args.parse_workers)
+    elif args.finish:
+        finish_pending(args.finish, fast_parse=args.fast_parse, parse_workers=args.parse_workers)
+    else:
+        main(profile=args.profile, refresh=args.refresh, fast_parse=args.fast_parse, parse_workers=args.parse_workers)
@@ -0,0 +1,3 @@
+"""
+The matching side of the project, takes the courses the scraper wrote out and finds the abroad courses that best match each home course.
+"""
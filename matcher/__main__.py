@@ -0,0 +1,109 @@
+"""
+Finds the best abroad matches for every home course.
+
+Usage: python -m matcher HOME_COURSES CATALOGUE [CATALOGUE ...] [--top-k 5] [--weighting tfidf|bm25] [--output matches.json]
+       python -m matcher HOME_COURSES CATALOGUE [CATALOGUE ...] --assign [--capacity 1] [--credits credits.json]
+Every catalogue is a file written by the scraper, optionally given a name with 'name=path', or 'db:university_name'
+to read it from the course store. The home courses can come from the store the same way.
+--assign gives every home course its own abroad course instead, so the matching as a whole scores best (see matcher/assignment.py).
+"""
+from matcher.catalogue import load_courses, load_catalogue
+from matcher.similarity import match_courses, WEIGHTINGS
+from matcher.assignment import AssignmentResult, assign_courses, load_credits
+from rich.console import Console
+from rich.table import Table
+import argparse, orjson, time
+
+
+def print_assignment(console: Console, result: AssignmentResult) -> None:
+    table = Table(title="Assignment")
+    for column in ("Home course", "Assigned", "Catalogue", "Score", "Rank"):
+        table.add_column(column)
+    for assignment in result.assignments:
+        home, match = assignment.home_course, assignment.match
+        table.add_row(f"{home.course_code} {home.name}", f"{match.course.course_code} {match.course.name}", match.catalogue, f"{match.score:.3f}", str(assignment.rank))
+    console.print(table)
+
+    if result.unmatched:
+        table = Table(title="Unmatched")
+        for column in ("Home course", "Reason", "Best candidate", "Score"):
+            table.add_column(column)
+        for unmatched in result.unmatched:
+            best = unmatched.best_candidate
+            table.add_row(
+                f"{unmatched.home_course.course_code} {unmatched.home_course.name}", unmatched.reason,
+                f"{best.course.course_code} {best.course.name}" if best else "", f"{best.score:.3f}" if best else "",
+            )
+        console.print(table)
+
+    first_choices = sum(1 for assignment in result.assignments if assignment.rank == 1)
+    console.print(
+        f"Objective {result.objective:.3f} (greedy would get {result.greedy_objective:.3f}), mean score {result.mean_score:.3f}, "
+        f"{len(result.assignments)} assigned ({first_choices} to their best candidate), {len(result.unmatched)} unmatched"
+    )
+    if not result.exact:
+        console.print(f"[yellow]Only {result.candidates} candidates per home course were kept, the assignment may not be optimal[/]")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("home", help="the home courses to find matches for")
+    parser.add_argument("catalogues", nargs="+", help="scraped catalogues to match against, 'name=path', 'path' or 'db:university_name'")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--weighting", choices=WEIGHTINGS, default="tfidf")
+    parser.add_argument("--min-score", type=float, default=0.0)
+    parser.add_argument("--output", help="write the matches to this JSON file as well")
+    parser.add_argument("--assign", action="store_true", help="give every home course its own abroad course rather than listing the top k")
+    parser.add_argument("--capacity", type=int, default=1, help="with --assign, how many home courses one abroad course can be given to")
+    parser.add_argument("--candidates", type=int, default=None, help="with --assign, abroad courses kept per home course, defaults to enough for an exact answer")
+    parser.add_argument("--any-semester", action="store_true", help="with --assign, allow pairs that run in different semesters")
+    parser.add_argument("--credits", help="with --assign, a JSON file of course code -> credits, pairs too far apart in credits aren't allowed")
+    parser.add_argument("--credit-rate", type=float, default=1.0, help="what one abroad credit is worth in home credits")
+    parser.add_argument("--credit-tolerance", type=float, default=0.25, help="how far apart (0.25 = 25%%) the credits of a pair may be")
+    args = parser.parse_args()
+
+    console = Console()
+    home_courses = load_catalogue(args.home).courses if args.home.startswith("db:") else load_courses(args.home)
+    catalogues = [load_catalogue(spec) for spec in args.catalogues]
+
+    abroad_count = sum(len(catalogue.courses) for catalogue in catalogues)
+    if args.assign:
+        start = time.perf_counter()
+        result = assign_courses(
+            home_courses, catalogues, candidates=args.candidates, capacity=args.capacity, weighting=args.weighting,
+            min_score=args.min_score, match_semesters=not args.any_semester, credits=load_credits(args.credits) if args.credits else None,
+            credit_rate=args.credit_rate, credit_tolerance=args.credit_tolerance,
+        )
+        elapsed = time.perf_counter() - start
+        print_assignment(console, result)
+        console.print(f"Assigned {len(home_courses)} home courses against {abroad_count} abroad courses ({result.candidate_edges} candidate pairs) in {elapsed:.3f}s")
+        if args.output:
+            with open(args.output, "wb") as fh:
+                fh.write(orjson.dumps(result.model_dump(), option=orjson.OPT_INDENT_2))
+            console.print(f"Wrote the assignment to {args.output}")
+        return
+
+    start = time.perf_counter()
+    matches = match_courses(home_courses, catalogues, k=args.top_k, weighting=args.weighting, min_score=args.min_score)
+    elapsed = time.perf_counter() - start
+
+    table = Table(title="Best matches")
+    for column in ("Home course", "Candidate", "Catalogue", "Score"):
+        table.add_column(column)
+    for course_matches in matches:
+        home = f"{course_matches.home_course.course_code} {course_matches.home_course.name}"
+        if not course_matches.candidates:
+            table.add_row(home, "[yellow]no match[/]", "", "")
+        for position, candidate in enumerate(course_matches.candidates):
+            table.add_row(home if position == 0 else "", f"{candidate.course.course_code} {candidate.course.name}", candidate.catalogue, f"{candidate.score:.3f}")
+    console.print(table)
+    console.print(f"Matched {len(home_courses)} home courses against {abroad_count} abroad courses in {elapsed:.3f}s")
+
+    if args.output:
+        with open(args.output, "wb") as fh:
+            fh.write(orjson.dumps([course_matches.model_dump() for course_matches in matches], option=orjson.OPT_INDENT_2))
+        console.print(f"Wrote matches to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Picks one abroad course for every home course so the matching as a whole scores best, rather than every home course
+taking its own top candidate and several of them ending up on the same abroad course.
+
+Only each home course's best `candidates` abroad courses (that pass the semester/credit constraints) go into the graph,
+which is then solved as a min cost bipartite matching on the sparse graph (scipy's LAPJVsp). An abroad course can be
+given to up to `capacity` home courses by repeating its column, and every home course has a column of its own that
+stands for "unmatched" so the matching always exists. With candidates * capacity >= the number of home courses the
+pruning can't change the answer (a home course's optimal match can only fall outside its top candidates if every one
+of those is taken, and there aren't enough other home courses for that), so that is the default.
+"""
+from scraper.models import CourseData
+from matcher.catalogue import Catalogue
+from matcher.similarity import MatchCandidate, similarity_matrix, top_k_indices
+from pydantic import BaseModel
+from collections.abc import Mapping, Sequence
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+import numpy as np
+import scipy.sparse as sp
+import math, orjson, re
+
+# Terms as bit flags so "Spring/Fall" or "Semester 1 and 2" is just both bits, 0 means the semester isn't known
+AUTUMN, SPRING, SUMMER = 1, 2, 4
+
+TERM_PATTERNS = (
+    (re.compile(r"fall|autumn|秋"), AUTUMN),
+    (re.compile(r"spring|春"), SPRING),
+    (re.compile(r"summer|夏"), SUMMER),
+    (re.compile(r"full[ -]?year|whole year|通年"), AUTUMN | SPRING),
+)
+# Numbered semesters go by the UK academic year (Glasgow's), semester 1 is the autumn one
+NUMBERED_SEMESTER = re.compile(r"\b(?:semesters?|sem)\s*([123])(?:\s*(?:and|&|/|,|-)\s*([123]))?")
+SEMESTER_TERMS = {"1": AUTUMN, "2": SPRING, "3": SUMMER}
+
+
+def semester_terms(semester: str) -> int:
+    """
+    The terms a course runs in as AUTUMN/SPRING/SUMMER flags, i.e '2025 Spring/Fall' or 'Typically Offered: Semester 1'.
+    Anything it can't make sense of (empty, 'N/A') is 0.
+    """
+    text = semester.lower()
+    terms = 0
+    for pattern, flag in TERM_PATTERNS:
+        if pattern.search(text):
+            terms |= flag
+    for match in NUMBERED_SEMESTER.finditer(text):
+        for number in match.groups():
+            if number:
+                terms |= SEMESTER_TERMS[number]
+    return terms
+
+
+def load_credits(path: str) -> dict[str, float]:
+    """
+    Reads a JSON object of course code -> credits, for the home and abroad courses alike.
+    """
+    with open(path, "rb") as fh:
+        return {str(code): float(credits) for code, credits in orjson.loads(fh.read()).items()}
+
+
+class Assignment(BaseModel):
+    """
+    A home course and the abroad course it was given. rank is where that course was in the home course's own
+    candidate list, 1 means it got its best candidate.
+    """
+    home_course: CourseData
+    match: MatchCandidate
+    rank: int
+
+
+class UnmatchedCourse(BaseModel):
+    """
+    A home course that was left without an abroad course, either because nothing passed the constraints/min score
+    ("no candidates") or because every candidate it had was better used by other home courses ("candidates taken").
+    """
+    home_course: CourseData
+    reason: str
+    best_candidate: MatchCandidate | None = None
+
+
+class AssignmentResult(BaseModel):
+    """
+    objective is the sum of the scores of every assignment, greedy_objective what handing out the best scoring pairs
+    first would have got on the same candidate graph. exact is True when the pruning can't have changed the answer.
+    """
+    assignments: list[Assignment]
+    unmatched: list[UnmatchedCourse]
+    objective: float
+    greedy_objective: float
+    candidates: int
+    capacity: int
+    candidate_edges: int
+    exact: bool
+
+    @property
+    def mean_score(self) -> float:
+        return self.objective / len(self.assignments) if self.assignments else 0.0
+
+
+def _apply_constraints(
+    scores: sp.csr_matrix,
+    home_courses: Sequence[CourseData],
+    abroad_courses: Sequence[CourseData],
+    min_score: float,
+    match_semesters: bool,
+    credits: Mapping[str, float] | None,
+    credit_rate: float,
+    credit_tolerance: float,
+) -> sp.csr_matrix:
+    """
+    Drops every home x abroad pair that isn't allowed, worked out over the stored scores in one go.
+    Pairs where either side's semester or credits aren't known are let through, there's nothing to hold against them.
+    """
+    pairs = scores.tocoo()
+    keep = pairs.data > min_score
+
+    if match_semesters:
+        home_terms = np.fromiter((semester_terms(course.semester) for course in home_courses), dtype=np.int64, count=len(home_courses))
+        abroad_terms = np.fromiter((semester_terms(course.semester) for course in abroad_courses), dtype=np.int64, count=len(abroad_courses))
+        row_terms, column_terms = home_terms[pairs.row], abroad_terms[pairs.col]
+        keep &= (row_terms == 0) | (column_terms == 0) | ((row_terms & column_terms) != 0)
+
+    if credits:
+        home_credits = np.array([credits.get(course.course_code, np.nan) for course in home_courses], dtype=np.float64)
+        # The abroad credits in home credits, i.e 0.5 when two abroad credits are worth one at home
+        abroad_credits = np.array([credits.get(course.course_code, np.nan) for course in abroad_courses], dtype=np.float64) * credit_rate
+        row_credits, column_credits = home_credits[pairs.row], abroad_credits[pairs.col]
+        known = ~np.isnan(row_credits) & ~np.isnan(column_credits)
+        keep &= ~known | (np.abs(column_credits - row_credits) <= credit_tolerance * row_credits)
+
+    return sp.csr_matrix((pairs.data[keep], (pairs.row[keep], pairs.col[keep])), shape=scores.shape)
+
+
+def _greedy_objective(rows: np.ndarray, columns: np.ndarray, edge_scores: np.ndarray, capacity: int) -> float:
+    """
+    What picking the best scoring remaining pair over and over would get, to show what the optimal matching gains over it.
+    """
+    taken_rows: set[int] = set()
+    column_use: dict[int, int] = {}
+    objective = 0.0
+    for edge in np.argsort(-edge_scores, kind="stable"):
+        row, column = int(rows[edge]), int(columns[edge])
+        if row in taken_rows or column_use.get(column, 0) >= capacity:
+            continue
+        taken_rows.add(row)
+        column_use[column] = column_use.get(column, 0) + 1
+        objective += float(edge_scores[edge])
+    return objective
+
+
+def assign_courses(
+    home_courses: Sequence[CourseData],
+    catalogues: Sequence[Catalogue],
+    candidates: int | None = None,
+    capacity: int = 1,
+    weighting: str = "tfidf",
+    min_score: float = 0.0,
+    match_semesters: bool = True,
+    credits: Mapping[str, float] | None = None,
+    credit_rate: float = 1.0,
+    credit_tolerance: float = 0.25,
+) -> AssignmentResult:
+    """
+    Gives every home course at most one abroad course, across every catalogue, so the total score is as high as it can be.
+    Every abroad course is given to at most `capacity` home courses.
+    match_semesters only pairs courses running in the same term (see semester_terms), with `credits` (course code ->
+    credits, see load_credits) a pair is only allowed if the abroad course's credits times credit_rate are within
+    credit_tolerance (0.25 = 25%) of the home course's.
+    candidates is how many abroad courses every home course keeps, None for as many as keeps the answer exact.
+    """
+    if capacity < 1:
+        raise ValueError("capacity has to be at least 1")
+
+    abroad_courses: list[CourseData] = []
+    abroad_catalogues: list[str] = []
+    for catalogue in catalogues:
+        abroad_courses.extend(catalogue.courses)
+        abroad_catalogues.extend([catalogue.name] * len(catalogue.courses))
+
+    home_count = len(home_courses)
+    exact_candidates = max(1, math.ceil(home_count / capacity))
+    candidates = exact_candidates if candidates is None else max(1, candidates)
+
+    # ? Scores of 0 are pairs with nothing in common and are never stored, so they can't be matched whatever min_score says
+    min_score = max(min_score, 0.0)
+    scores = similarity_matrix(home_courses, abroad_courses, weighting=weighting)
+    scores = _apply_constraints(scores, home_courses, abroad_courses, min_score, match_semesters, credits, credit_rate, credit_tolerance)
+    best_columns, best_scores = top_k_indices(scores, candidates)
+
+    # The candidate graph, one edge per (home course, candidate) with the candidate's rank kept for the report
+    rows, ranks = np.nonzero(best_scores > min_score)
+    columns = best_columns[rows, ranks]
+    edge_scores = best_scores[rows, ranks]
+
+    # Only abroad courses that are someone's candidate get columns, `capacity` of them each, then one "unmatched" per home course
+    used_columns, local_columns = np.unique(columns, return_inverse=True)
+    slot_count = len(used_columns) * capacity
+    slot_rows = np.concatenate([np.tile(rows, capacity), np.arange(home_count)])
+    slot_columns = np.concatenate([
+        (local_columns[np.newaxis, :] + len(used_columns) * np.arange(capacity)[:, np.newaxis]).ravel(),
+        slot_count + np.arange(home_count),
+    ])
+    # ! LAPJVsp needs non zero weights, every home course is matched to exactly one column so adding 1 to every edge
+    # (the "unmatched" ones included) doesn't change which matching is best
+    slot_weights = np.concatenate([np.tile(edge_scores, capacity), np.zeros(home_count)]) + 1.0
+    graph = sp.csr_matrix((slot_weights, (slot_rows, slot_columns)), shape=(home_count, slot_count + home_count))
+
+    assigned_rows, assigned_slots = min_weight_full_bipartite_matching(graph, maximize=True) if home_count else (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def candidate(row: int, rank: int) -> MatchCandidate:
+        column = int(best_columns[row, rank])
+        return MatchCandidate(catalogue=abroad_catalogues[column], course=abroad_courses[column], score=float(best_scores[row, rank]))
+
+    assignments: list[Assignment] = []
+    unmatched: list[UnmatchedCourse] = []
+    for row, slot in zip(assigned_rows.tolist(), assigned_slots.tolist()):
+        home_course = home_courses[row]
+        if slot >= slot_count:
+            has_candidates = bool(best_scores[row, 0] > min_score) if best_scores.shape[1] else False
+            unmatched.append(UnmatchedCourse(
+                home_course=home_course,
+                reason="candidates taken" if has_candidates else "no candidates",
+                best_candidate=candidate(row, 0) if has_candidates else None,
+            ))
+            continue
+        column = int(used_columns[slot % len(used_columns)])
+        rank = int(np.flatnonzero(best_columns[row] == column)[0])
+        assignments.append(Assignment(home_course=home_course, match=candidate(row, rank), rank=rank + 1))
+
+    return AssignmentResult(
+        assignments=assignments,
+        unmatched=unmatched,
+        objective=sum(assignment.match.score for assignment in assignments),
+        greedy_objective=_greedy_objective(rows, columns, edge_scores, capacity),
+        candidates=candidates,
+        capacity=capacity,
+        candidate_edges=len(edge_scores),
+        exact=candidates >= exact_candidates,
+    )
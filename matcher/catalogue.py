@@ -0,0 +1,49 @@
+"""
+Loading scraped courses back in for matching, a catalogue is just a named list of CourseData.
+"""
+from scraper.models import CourseData, course_data_list
+from scraper.sinks import iter_ndjson
+from scraper.store import CourseStore
+from dataclasses import dataclass
+import orjson, os
+
+@dataclass
+class Catalogue:
+    """
+    A set of courses from one university (or one search of it), the name is carried through into the match results.
+    """
+    name: str
+    courses: list[CourseData]
+
+
+def load_courses(path: str) -> list[CourseData]:
+    """
+    Reads any of the engine's output formats (.json, .ndjson, .ndjson.gz) back into CourseData.
+    """
+    if path.endswith(".json"):
+        with open(path, "rb") as fh:
+            return course_data_list(orjson.loads(fh.read()))
+    return course_data_list(list(iter_ndjson(path)))
+
+
+def load_store_catalogue(university_name: str, year: str | None = None, store: CourseStore | None = None) -> Catalogue:
+    """
+    Loads every stored course of a university straight out of the course store, no JSON involved.
+    """
+    store = store or CourseStore()
+    return Catalogue(name=university_name, courses=list(store.iter_courses(university_name, year)))
+
+
+def load_catalogue(spec: str) -> Catalogue:
+    """
+    Loads a catalogue from either 'name=path' or just 'path', in which case the file name is used as the name.
+    'db:university_name' (or 'db:university_name:year') reads it from the course store instead.
+    """
+    if spec.startswith("db:"):
+        university_name, _, year = spec.removeprefix("db:").partition(":")
+        return load_store_catalogue(university_name, year or None)
+    name, separator, path = spec.partition("=")
+    if not separator:
+        path = spec
+        name = os.path.basename(spec).split(".")[0]
+    return Catalogue(name=name, courses=load_courses(path))
@@ -0,0 +1,200 @@
+"""
+Course similarity over the aims and ILOs of each course. Every course becomes a sparse TF-IDF (or BM25) vector and
+all the home x abroad similarities are worked out as one sparse matrix product, never with a Python loop over pairs.
+"""
+from scraper.models import CourseData
+from matcher.catalogue import Catalogue
+from pydantic import BaseModel
+from collections.abc import Sequence
+import numpy as np
+import scipy.sparse as sp
+import re
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Common English words plus the boilerplate nearly every course description has, they would make every course look alike
+STOP_WORDS = frozenset("""
+a about above after all also an and any are as at be been being both but by can course courses do does each either for
+from has have how however i if in into is it its may more most must no not of on or other our over per such than that
+the their them then there these they this those through to under up upon use used using was we well were what when
+where which while who will with within would you your students student able aim aims intended learning outcomes
+outcome end successful successfully completion include including introduce introduces provide provides understand
+understanding demonstrate knowledge class classes week weeks
+""".split())
+
+WEIGHTINGS = ("tfidf", "bm25")
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+
+def course_text(course: CourseData) -> str:
+    """
+    The text a course is matched on. Some providers (i.e Keio) put the same text in both aims and ilos, it is only counted once.
+    """
+    if course.ilos == course.aims or course.ilos == "N/A":
+        return course.aims
+    if course.aims == "N/A":
+        return course.ilos
+    return f"{course.aims} {course.ilos}"
+
+
+class CourseVectorizer:
+    """
+    Turns course texts into L2 normalised sparse vectors so a dot product is the cosine similarity.
+    The vocabulary and document frequencies come from `fit`, usually every course on both sides of the matching.
+    """
+    def __init__(self, weighting: str = "tfidf", k1: float = 1.2, b: float = 0.75) -> None:
+        if weighting not in WEIGHTINGS:
+            raise ValueError(f"Unknown weighting '{weighting}', expected one of {WEIGHTINGS}")
+        self.weighting = weighting
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: dict[str, int] = {}
+        self.idf: np.ndarray = np.zeros(0)
+        self.average_length = 0.0
+
+    def _counts(self, texts: Sequence[str], grow: bool) -> sp.csr_matrix:
+        """
+        Raw term counts as a CSR matrix. Every token is mapped to its column in one pass and the per document counting is
+        left to scipy, which sums the duplicate (row, column) entries when converting to CSR.
+        """
+        token_lists = [tokenize(text) for text in texts]
+        if grow:
+            vocabulary = self.vocabulary
+            columns = [vocabulary.setdefault(token, len(vocabulary)) for tokens in token_lists for token in tokens]
+            lengths = [len(tokens) for tokens in token_lists]
+        else:
+            # Tokens that weren't seen in fit have no column, they are dropped
+            token_lists = [[token for token in tokens if token in self.vocabulary] for tokens in token_lists]
+            columns = [self.vocabulary[token] for tokens in token_lists for token in tokens]
+            lengths = [len(tokens) for tokens in token_lists]
+
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        counts = sp.coo_matrix(
+            (np.ones(len(columns), dtype=np.float64), (rows, np.asarray(columns, dtype=np.int64))),
+            shape=(len(texts), len(self.vocabulary)),
+        )
+        return counts.tocsr()
+
+    def _fit_counts(self, counts: sp.csr_matrix) -> None:
+        document_count = counts.shape[0]
+        # How many documents every term appears in, counted from the CSR column indices in one go
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1]).astype(np.float64)
+        if self.weighting == "bm25":
+            self.idf = np.log(1.0 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        else:
+            # Smoothed idf, the same as scikit-learn's default
+            self.idf = np.log((1.0 + document_count) / (1.0 + document_frequency)) + 1.0
+        self.average_length = float(counts.sum() / document_count) if document_count else 0.0
+
+    def _weigh(self, counts: sp.csr_matrix) -> sp.csr_matrix:
+        weights = counts.copy()
+        term_frequency = weights.data
+        if self.weighting == "bm25":
+            # Every stored value needs its row's document length, np.repeat lines them up with the CSR data array
+            lengths = np.repeat(np.asarray(counts.sum(axis=1)).ravel(), np.diff(counts.indptr))
+            normaliser = self.k1 * (1.0 - self.b + self.b * lengths / (self.average_length or 1.0))
+            term_frequency = term_frequency * (self.k1 + 1.0) / (term_frequency + normaliser)
+        else:
+            term_frequency = 1.0 + np.log(term_frequency)
+        weights.data = term_frequency * self.idf[weights.indices]
+
+        # L2 normalise every row, empty rows are left as zeros so they just never match anything
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+        norms[norms == 0.0] = 1.0
+        return sp.csr_matrix(sp.diags(1.0 / norms) @ weights)
+
+    def fit(self, texts: Sequence[str]) -> "CourseVectorizer":
+        self.vocabulary = {}
+        self._fit_counts(self._counts(texts, grow=True))
+        return self
+
+    def transform(self, texts: Sequence[str]) -> sp.csr_matrix:
+        return self._weigh(self._counts(texts, grow=False))
+
+    def fit_transform(self, texts: Sequence[str]) -> sp.csr_matrix:
+        """
+        The same as fit(texts).transform(texts) but only tokenizes everything once.
+        """
+        self.vocabulary = {}
+        counts = self._counts(texts, grow=True)
+        self._fit_counts(counts)
+        return self._weigh(counts)
+
+
+class MatchCandidate(BaseModel):
+    """
+    One possible abroad equivalent for a home course.
+    """
+    catalogue: str
+    course: CourseData
+    score: float
+
+
+class CourseMatches(BaseModel):
+    """
+    The best candidates for a single home course, best first.
+    """
+    home_course: CourseData
+    candidates: list[MatchCandidate]
+
+
+def similarity_matrix(home_courses: Sequence[CourseData], abroad_courses: Sequence[CourseData], weighting: str = "tfidf") -> sp.csr_matrix:
+    """
+    The cosine similarity of every home course (rows) against every abroad course (columns), as a sparse matrix.
+    """
+    home_texts = [course_text(course) for course in home_courses]
+    abroad_texts = [course_text(course) for course in abroad_courses]
+    vectors = CourseVectorizer(weighting=weighting).fit_transform(home_texts + abroad_texts)
+    home_vectors, abroad_vectors = vectors[:len(home_texts)], vectors[len(home_texts):]
+    return sp.csr_matrix(home_vectors @ abroad_vectors.T)
+
+
+def top_k_indices(scores: sp.csr_matrix, k: int, batch_size: int = 256) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The column indices and scores of the k best columns of every row, best first.
+    Rows are made dense a batch at a time so a big catalogue never needs the whole dense matrix in memory.
+    """
+    row_count, column_count = scores.shape
+    k = min(k, column_count)
+    best_columns = np.zeros((row_count, k), dtype=np.int64)
+    best_scores = np.zeros((row_count, k), dtype=np.float64)
+    if k == 0:
+        return best_columns, best_scores
+
+    for start in range(0, row_count, batch_size):
+        dense = scores[start:start + batch_size].toarray()
+        # argpartition gets the top k unordered in linear time, only those k then get sorted
+        partitioned = np.argpartition(-dense, k - 1, axis=1)[:, :k]
+        partitioned_scores = np.take_along_axis(dense, partitioned, axis=1)
+        order = np.argsort(-partitioned_scores, axis=1, kind="stable")
+        best_columns[start:start + batch_size] = np.take_along_axis(partitioned, order, axis=1)
+        best_scores[start:start + batch_size] = np.take_along_axis(partitioned_scores, order, axis=1)
+    return best_columns, best_scores
+
+
+def match_courses(home_courses: Sequence[CourseData], catalogues: Sequence[Catalogue], k: int = 5, weighting: str = "tfidf", min_score: float = 0.0) -> list[CourseMatches]:
+    """
+    Finds the k best abroad courses, across every catalogue, for each home course. Candidates scoring at or below
+    `min_score` are dropped, so a home course can end up with fewer than k (or no) candidates.
+    """
+    abroad_courses: list[CourseData] = []
+    abroad_catalogues: list[str] = []
+    for catalogue in catalogues:
+        abroad_courses.extend(catalogue.courses)
+        abroad_catalogues.extend([catalogue.name] * len(catalogue.courses))
+
+    scores = similarity_matrix(home_courses, abroad_courses, weighting=weighting)
+    best_columns, best_scores = top_k_indices(scores, k)
+
+    matches = []
+    for row, home_course in enumerate(home_courses):
+        candidates = [
+            MatchCandidate(catalogue=abroad_catalogues[column], course=abroad_courses[column], score=float(score))
+            for column, score in zip(best_columns[row], best_scores[row])
+            if score > min_score
+        ]
+        matches.append(CourseMatches(home_course=home_course, candidates=candidates))
+    return matches
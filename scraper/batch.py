@@ -0,0 +1,245 @@
+"""
+Runs a whole file of searches unattended instead of one questionary prompt at a time.
+Jobs are grouped by provider and every provider gets its own process, so a slow university never holds up the others
+and parsing in one doesn't stall the fetching in another. Inside a process a provider runs a few jobs at once, they all
+go through the same host limiter (scraper/ratelimit.py) so the site never sees more than the provider's max_concurrency
+requests at once, the same as from a single run.
+At the end everything scraped is merged into one result set alongside a report of how every job went.
+"""
+from scraper.engine import ScraperEngine
+from scraper.cache import ResponseCache
+from scraper.sessions import SessionStore
+from scraper.index import CourseIndex
+from scraper.store import CourseStore
+from scraper.models import CourseData
+from scraper.paths import DATA_DIR
+from scraper.providers import get_provider_class
+from scraper.sinks import iter_ndjson, write_json_array
+from scraper.errors import CourseNotFoundError, ValidationError
+from pydantic import BaseModel
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections.abc import Iterator
+from typing import Literal
+from rich.table import Table
+import csv, datetime, orjson, os, time
+
+BATCH_DIR = os.path.join(DATA_DIR, "batch")
+
+
+class Job(BaseModel):
+    """
+    One search, the same three things the interactive prompts ask for.
+    """
+    provider: str
+    method: Literal["keyword", "course_identifier"]
+    value: str
+
+
+class JobResult(BaseModel):
+    """
+    How a single job went. status is one of:
+    - ok: every course found was scraped
+    - partial: the search worked but some courses failed, `failed` says how many
+    - not_found: the search returned nothing
+    - invalid: the job itself is wrong, i.e an unknown provider or a malformed course identifier
+    - failed: the search itself failed, `message` says why
+    """
+    index: int
+    job: Job
+    status: str
+    found: int = 0
+    written: int = 0
+    failed: int = 0
+    output_path: str | None = None
+    message: str | None = None
+    elapsed: float = 0.0
+
+
+class BatchReport(BaseModel):
+    """
+    Everything a batch run produced, this is also what gets written to report.json.
+    """
+    started_at: str
+    elapsed: float
+    courses_path: str
+    course_count: int
+    results: list[JobResult]
+
+
+def load_jobs(path: str) -> list[Job]:
+    """
+    Reads a job file, either a JSON list, NDJSON (.ndjson/.jsonl) or a CSV with a provider,method,value header.
+    Exact duplicate jobs are only kept once, running them twice would just scrape the same courses twice.
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as fh:
+            rows: list[dict] | Iterator[dict] = list(csv.DictReader(fh))
+    elif path.endswith((".ndjson", ".jsonl")):
+        rows = iter_ndjson(path)
+    else:
+        with open(path, "rb") as fh:
+            rows = orjson.loads(fh.read())
+
+    jobs: list[Job] = []
+    seen: set[tuple[str, str, str]] = set()
+    for row in rows:
+        job = Job(**row)
+        key = (job.provider, job.method, job.value)
+        if key not in seen:
+            seen.add(key)
+            jobs.append(job)
+    return jobs
+
+
+def _run_job(provider_class, index: int, job: Job, cache: ResponseCache, sessions: SessionStore, store: CourseStore, fast_parse: bool = False, parse_workers: int = 0) -> JobResult:
+    # Each job gets its own provider, they only share a session (and so cookies) if the provider saves them (session_ttl)
+    provider = provider_class(cache=cache, sessions=sessions, fast_parse=fast_parse)
+    # The index is updated once per provider at the end, see run_provider_jobs
+    engine = ScraperEngine(provider, output_format="ndjson", store=store, update_index=False, quiet=True, parse_workers=parse_workers)
+    start = time.perf_counter()
+    status, message = "ok", None
+    try:
+        engine.run(job.method, job.value)
+    except CourseNotFoundError as error:
+        status, message = "not_found", str(error)
+    except ValidationError as error:
+        status, message = "invalid", str(error)
+    # ! Unattended, so nothing is allowed to take down the other jobs, anything unexpected is reported like any other failure
+    except Exception as error:
+        status, message = "failed", f"{type(error).__name__}: {error}"
+    else:
+        if engine.errors:
+            status = "partial"
+            message = "; ".join(f"{course.course_code}: {error}" for course, error in engine.errors[:3])
+
+    return JobResult(
+        index=index,
+        job=job,
+        status=status,
+        found=engine.found,
+        written=engine.written,
+        failed=len(engine.errors),
+        output_path=engine.output_path,
+        message=message,
+        elapsed=time.perf_counter() - start,
+    )
+
+
+def run_provider_jobs(provider_key: str, jobs: list[tuple[int, Job]], jobs_per_provider: int = 1, store_path: str | None = None, fast_parse: bool = False, parse_workers: int = 0) -> list[JobResult]:
+    """
+    Runs every job for one provider, this is what each batch process does.
+    """
+    provider_class = get_provider_class(provider_key)
+    if provider_class is None:
+        return [JobResult(index=index, job=job, status="invalid", message=f"Provider {provider_key} not found.") for index, job in jobs]
+
+    jobs_per_provider = max(1, min(jobs_per_provider, len(jobs)))
+    cache = ResponseCache()
+    sessions = SessionStore()
+    store = CourseStore(store_path)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs_per_provider, thread_name_prefix=f"{provider_key}-job") as executor:
+            results = list(executor.map(lambda item: _run_job(provider_class, item[0], item[1], cache, sessions, store, fast_parse, parse_workers), jobs))
+    finally:
+        store.close()
+
+    # One segment for the whole batch rather than one per job, so a big batch doesn't immediately need compacting
+    output_paths = [result.output_path for result in results if result.written and result.output_path]
+    if output_paths:
+        CourseIndex(provider_key).add(CourseData(**record) for path in output_paths for record in iter_ndjson(path))
+    return results
+
+
+def _consolidate(results: list[JobResult], path: str) -> int:
+    """
+    Merges the output of every job into one JSON file in job order. Each course gets its university_name added and a
+    course found by more than one job is only written once.
+    """
+    seen: set[tuple[str, str]] = set()
+
+    def records() -> Iterator[dict]:
+        for result in results:
+            if not result.written or not result.output_path:
+                continue
+            for record in iter_ndjson(result.output_path):
+                key = (result.job.provider, record["course_code"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield {"university_name": result.job.provider, **record}
+
+    return write_json_array(path, records())
+
+
+def run_batch(jobs: list[Job], jobs_per_provider: int = 1, max_processes: int | None = None, output_dir: str | None = None, store_path: str | None = None, on_result=None, fast_parse: bool = False, parse_workers: int = 0) -> BatchReport:
+    """
+    Runs every job and writes courses.json (the consolidated result set) and report.json (the per job status) to
+    `output_dir`, by default a new timestamped directory under data/batch. `on_result` is called with each provider's
+    results as soon as that provider is done. fast_parse parses every job with the providers' lxml fast path, parse_workers gives every job that many parse processes
+    of its own (see ScraperEngine), so jobs_per_provider jobs at once use jobs_per_provider * parse_workers of them.
+    """
+    started_at = datetime.datetime.now()
+    start = time.perf_counter()
+    output_dir = output_dir or os.path.join(BATCH_DIR, started_at.strftime("%Y-%m-%dT%H-%M-%S"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    by_provider: dict[str, list[tuple[int, Job]]] = {}
+    for index, job in enumerate(jobs):
+        by_provider.setdefault(job.provider, []).append((index, job))
+
+    results: list[JobResult] = []
+    if by_provider:
+        with ProcessPoolExecutor(max_workers=max_processes or len(by_provider)) as executor:
+            futures = {
+                executor.submit(run_provider_jobs, provider_key, provider_jobs, jobs_per_provider, store_path, fast_parse, parse_workers): provider_jobs
+                for provider_key, provider_jobs in by_provider.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    provider_results = future.result()
+                except Exception as error:
+                    # The whole process died (i.e killed for memory, a BrokenProcessPool), every job it had counts as failed
+                    provider_results = [
+                        JobResult(index=index, job=job, status="failed", message=f"{type(error).__name__}: {error}")
+                        for index, job in futures[future]
+                    ]
+                results.extend(provider_results)
+                if on_result is not None:
+                    on_result(provider_results)
+
+    results.sort(key=lambda result: result.index)
+    courses_path = os.path.join(output_dir, "courses.json")
+    course_count = _consolidate(results, courses_path)
+
+    report = BatchReport(
+        started_at=started_at.isoformat(timespec="seconds"),
+        elapsed=time.perf_counter() - start,
+        courses_path=courses_path,
+        course_count=course_count,
+        results=results,
+    )
+    with open(os.path.join(output_dir, "report.json"), "wb") as fh:
+        fh.write(orjson.dumps(report.model_dump(), option=orjson.OPT_INDENT_2))
+    return report
+
+
+STATUS_STYLES = {"ok": "green", "partial": "yellow", "not_found": "yellow", "invalid": "red", "failed": "bold red"}
+
+def report_table(report: BatchReport) -> Table:
+    table = Table(title=f"Batch of {len(report.results)} jobs, {report.course_count} unique courses in {report.elapsed:.1f}s")
+    for column in ("#", "Provider", "Search", "Status", "Found", "Written", "Failed", "Time", "Message"):
+        table.add_column(column)
+    for result in report.results:
+        style = STATUS_STYLES.get(result.status, "")
+        table.add_row(
+            str(result.index + 1),
+            result.job.provider,
+            f"{result.job.method}: {result.job.value}",
+            f"[{style}]{result.status}[/]",
+            str(result.found),
+            str(result.written),
+            str(result.failed),
+            f"{result.elapsed:.1f}s",
+            result.message or "",
+        )
+    return table
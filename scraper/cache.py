@@ -0,0 +1,265 @@
+"""
+This module implements the on-disk HTTP response cache used by BaseProvider._request.
+requests_cache does not play nicely with our sessions, so this is a small purpose built one.
+"""
+from scraper.paths import CACHE_DIR
+from requests.structures import CaseInsensitiveDict
+import requests
+import os, time, hashlib, threading, orjson
+from dataclasses import dataclass
+
+# Status codes that are safe to replay later, anything else always goes to the network
+CACHEABLE_STATUS_CODES = {200, 203}
+
+@dataclass
+class CachedResponse:
+    """
+    A response as it was stored on disk, along with when it was stored so we can tell if it is still fresh.
+    """
+    url: str
+    status_code: int
+    headers: dict[str, str]
+    encoding: str | None
+    content: bytes
+    stored_at: float
+
+    def is_fresh(self, ttl: float) -> bool:
+        return (time.time() - self.stored_at) < ttl
+
+    def conditional_headers(self) -> dict[str, str]:
+        """
+        The headers needed to ask the server whether our copy is still valid, empty if the server gave us nothing to revalidate with.
+        """
+        headers = {}
+        if etag := self.headers.get("ETag"):
+            headers["If-None-Match"] = etag
+        if last_modified := self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def to_response(self) -> requests.Response:
+        """
+        Rebuilds a requests.Response so providers can't tell the difference between a cached and a live response.
+        """
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.url = self.url
+        response.encoding = self.encoding
+        response.reason = "OK"
+        response._content = self.content
+        # Lets anything downstream (i.e metrics) know this never touched the network
+        response.from_cache = True  # type: ignore[attr-defined]
+        return response
+
+
+class ResponseCache:
+    """
+    A persistent response cache, every entry is a single file named after the hash of the request.
+    Entries are fresh for `ttl` seconds, after that they are revalidated with ETag/Last-Modified when the
+    server supports it. Once the cache grows past `max_bytes` the least recently used entries are evicted.
+    """
+    def __init__(self, directory: str | None = None, ttl: float = 7 * 24 * 60 * 60, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.directory = directory or os.path.join(CACHE_DIR, "http")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        # Worker threads share one cache, the lock keeps the size bookkeeping and eviction consistent
+        self._lock = threading.Lock()
+        self._total_bytes: int | None = None
+
+    @staticmethod
+    def make_key(method: str, url: str, *, params: dict | None = None, data: dict | None = None, json: dict | None = None, headers: dict | None = None, vary: dict | None = None) -> str:
+        """
+        Builds the cache key from everything that can change the response, the body is included so different POST searches don't collide.
+        `vary` holds any session state (i.e cookie values) the provider says the response depends on.
+        """
+        key_material = orjson.dumps(
+            [method.upper(), url, params, data, json, headers, vary],
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+        return hashlib.sha256(key_material).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # Fan out into sub directories so we don't end up with one directory with tens of thousands of files in it
+        return os.path.join(self.directory, key[:2], key + ".bin")
+
+    def get(self, key: str) -> CachedResponse | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                header, _, content = fh.read().partition(b"\n")
+            metadata = orjson.loads(header)
+        except FileNotFoundError:
+            return None
+        except (orjson.JSONDecodeError, OSError):
+            # A half written or corrupted entry is just a miss, get rid of it so it gets replaced
+            self.delete(key)
+            return None
+
+        # Bump the modification time, this is what the LRU eviction goes off
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return CachedResponse(content=content, **metadata)
+
+    def put(self, key: str, response: requests.Response) -> None:
+        metadata = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "encoding": response.encoding,
+            "stored_at": time.time(),
+        }
+        self._write(key, orjson.dumps(metadata) + b"\n" + response.content)
+
+    def refresh(self, key: str, entry: CachedResponse, response: requests.Response) -> CachedResponse:
+        """
+        Called when the server answers a conditional request with 304, the stored body is still valid so only the timestamp
+        and any updated validators are saved.
+        """
+        entry.stored_at = time.time()
+        for header in ("ETag", "Last-Modified", "Cache-Control", "Expires"):
+            if header in response.headers:
+                entry.headers[header] = response.headers[header]
+        metadata = {
+            "url": entry.url,
+            "status_code": entry.status_code,
+            "headers": entry.headers,
+            "encoding": entry.encoding,
+            "stored_at": entry.stored_at,
+        }
+        self._write(key, orjson.dumps(metadata) + b"\n" + entry.content)
+        return entry
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            for path, _, _ in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes = 0
+
+    def _write(self, key: str, payload: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and swap it in so another thread or process (or a crash) never sees half an entry, thread
+        # ids are only unique within a process so the name needs the pid as well
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as fh:
+            fh.write(payload)
+
+        with self._lock:
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            os.replace(temporary_path, path)
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += len(payload) - previous_size
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[str, int, float]]:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries until we are back under 90% of the cap, the headroom
+        stops us from walking the whole cache again on the very next write. Must be called with the lock held.
+        """
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._total_bytes = total
+
+
+class ExpiringStore:
+    """
+    A small JSON file of key -> value where every value expires after `ttl` seconds. This is for lookup tables that are
+    expensive to fetch but rarely change (i.e Keio's K-Number codes), the whole file is loaded into memory once and
+    rewritten whenever something changes.
+    """
+    def __init__(self, path: str, ttl: float) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] | None = None
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            try:
+                with open(self.path, "rb") as fh:
+                    self._entries = orjson.loads(fh.read())
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None or (time.time() - entry["stored_at"]) >= self.ttl:
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            entries = self._load()
+            entries[key] = {"value": value, "stored_at": time.time()}
+            self._write(entries)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+    def reload(self) -> None:
+        """
+        Forgets what was loaded so the next read comes from disk again, for files another process may have written to.
+        """
+        with self._lock:
+            self._entries = None
+
+    def _write(self, entries: dict[str, dict]) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as fh:
+            fh.write(orjson.dumps(entries))
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,200 @@
+"""
+This module keeps track of what has already been scraped so runs can be resumed and refreshed incrementally.
+Every search (university, search method, value) gets a manifest of the courses fetched for it, with a hash of the
+raw HTML and the parser version that produced the record. The raw HTML itself is kept (content addressed) so a
+parser change can be applied again without fetching anything. The HTML store is shared by every manifest in the same
+directory, a page is deleted when a manifest is compacted and no manifest there refers to it any more.
+Only the URL, hash, parser version, time and where the line is in the log are kept in memory, the records themselves
+stay on disk until they are needed, so a big catalogue doesn't mean a big manifest in memory.
+"""
+from scraper.models import CourseData, CourseList, record_fields
+from scraper.paths import DATA_DIR
+from typing import NamedTuple
+import gzip, hashlib, orjson, os, threading, time
+
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints")
+
+# How long a finished course is trusted for, after that it is fetched again (and only parsed again if its HTML changed)
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+class ManifestEntry(NamedTuple):
+    html_sha256: str
+    parse_version: int
+    fetched_at: float
+    # Where the course's line starts in the manifest file, its record is read from there by load_record
+    offset: int
+
+def hash_html(html_content: str) -> str:
+    return hashlib.sha256(html_content.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """
+    An append only NDJSON log of finished courses keyed by their URL, the last line for a URL wins.
+    Every line is flushed as soon as it is written so an interrupted run keeps everything it finished.
+    """
+    def __init__(self, path: str, html_dir: str | None = None, max_age: float | None = MAX_AGE) -> None:
+        self.path = path
+        self.html_dir = html_dir or os.path.join(CHECKPOINT_DIR, "html")
+        # None trusts finished courses forever
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.entries: dict[str, ManifestEntry] = {}
+        # Pages an older line referred to but the latest line for the URL doesn't, candidates for deleting at compaction
+        self._superseded: set[str] = set()
+        self._size = 0
+        if os.path.exists(path):
+            with open(path, "rb") as fh:
+                for line in fh:
+                    offset = self._size
+                    self._size += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # A line cut short by a crash, everything before it is still good
+                        continue
+                    self._replace_entry(entry["url"], ManifestEntry(entry["html_sha256"], entry["parse_version"], entry["fetched_at"], offset))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fh = open(path, "ab")
+        self._reader = open(path, "rb")
+
+    @staticmethod
+    def search_path(university_name: str, search_method: str, value: str) -> str:
+        safe_value = value.replace(" ", "_").replace(os.sep, "_")
+        return os.path.join(CHECKPOINT_DIR, f"{university_name}_{search_method}_{safe_value}.manifest.ndjson")
+
+    @classmethod
+    def for_search(cls, university_name: str, search_method: str, value: str, max_age: float | None = MAX_AGE) -> "Manifest":
+        return cls(cls.search_path(university_name, search_method, value), max_age=max_age)
+
+    def _replace_entry(self, url: str, entry: ManifestEntry) -> None:
+        previous = self.entries.get(url)
+        if previous is not None and previous.html_sha256 != entry.html_sha256:
+            self._superseded.add(previous.html_sha256)
+        self.entries[url] = entry
+
+    def get(self, url: str) -> ManifestEntry | None:
+        with self._lock:
+            return self.entries.get(url)
+
+    def is_fresh(self, entry: ManifestEntry) -> bool:
+        return self.max_age is None or (time.time() - entry.fetched_at) < self.max_age
+
+    def _read_line(self, offset: int) -> bytes:
+        # Callers hold the lock, the reader is shared
+        self._reader.seek(offset)
+        return self._reader.readline()
+
+    def load_record(self, entry: ManifestEntry) -> dict:
+        with self._lock:
+            return orjson.loads(self._read_line(entry.offset))["record"]
+
+    def _html_path(self, html_sha256: str) -> str:
+        return os.path.join(self.html_dir, html_sha256[:2], html_sha256 + ".html.gz")
+
+    def load_html(self, html_sha256: str) -> str | None:
+        try:
+            with gzip.open(self._html_path(html_sha256), "rb") as fh:
+                return fh.read().decode("utf-8")
+        except (OSError, EOFError):
+            return None
+
+    def save_html(self, html_content: str, html_sha256: str) -> None:
+        path = self._html_path(html_sha256)
+        # Content addressed, if it's already there it is the exact same page
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(temporary_path, "wb") as fh:
+            fh.write(html_content.encode("utf-8"))
+        os.replace(temporary_path, path)
+
+    def record(self, course: CourseList, html_sha256: str, parse_version: int, course_data: CourseData) -> None:
+        fetched_at = time.time()
+        entry = {
+            "url": course.url,
+            "course_code": course.course_code,
+            "html_sha256": html_sha256,
+            "parse_version": parse_version,
+            "fetched_at": fetched_at,
+            "record": dict(record_fields(course_data)),
+        }
+        line = orjson.dumps(entry) + b"\n"
+        with self._lock:
+            self._replace_entry(course.url, ManifestEntry(html_sha256, parse_version, fetched_at, self._size))
+            self._fh.write(line)
+            self._fh.flush()
+            self._size += len(line)
+
+    def _unreferenced(self, candidates: set[str]) -> set[str]:
+        """
+        The candidate pages no other manifest in this directory refers to. Only the candidates are looked for, so the
+        other logs are just scanned for the hashes rather than parsed.
+        """
+        directory = os.path.dirname(self.path)
+        remaining = {html_sha256.encode(): html_sha256 for html_sha256 in candidates}
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not remaining or not name.endswith(".manifest.ndjson") or os.path.abspath(path) == os.path.abspath(self.path):
+                continue
+            try:
+                with open(path, "rb") as fh:
+                    for line in fh:
+                        for needle in [needle for needle in remaining if needle in line]:
+                            del remaining[needle]
+                        if not remaining:
+                            break
+            except OSError:
+                continue
+        return set(remaining.values())
+
+    def _collect_html(self) -> int:
+        """
+        Deletes the pages this log has stopped referring to, unless another manifest still does. Returns how many went.
+        A run of another search saving the same page at this very moment just finds it gone later and fetches it again.
+        """
+        current = {entry.html_sha256 for entry in self.entries.values()}
+        deleted = 0
+        for html_sha256 in self._unreferenced(self._superseded - current):
+            try:
+                os.remove(self._html_path(html_sha256))
+                deleted += 1
+            except FileNotFoundError:
+                pass
+        self._superseded.clear()
+        return deleted
+
+    def compact(self) -> None:
+        """
+        Rewrites the log with only the latest line per URL so it doesn't grow forever across refreshes, and deletes the
+        stored pages only the dropped lines referred to.
+        """
+        with self._lock:
+            self._fh.close()
+            temporary_path = self.path + ".tmp"
+            size = 0
+            # The latest lines are copied over one at a time rather than loading the log
+            with open(temporary_path, "wb") as fh:
+                for url, entry in self.entries.items():
+                    line = self._read_line(entry.offset)
+                    fh.write(line)
+                    self.entries[url] = entry._replace(offset=size)
+                    size += len(line)
+            self._reader.close()
+            os.replace(temporary_path, self.path)
+            self._size = size
+            self._fh = open(self.path, "ab")
+            self._reader = open(self.path, "rb")
+            self._collect_html()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+            if not self._reader.closed:
+                self._reader.close()
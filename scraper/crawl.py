@@ -0,0 +1,301 @@
+"""
+Crawls a provider's whole catalogue rather than one keyword's worth of it.
+The provider splits its catalogue into shards (list_shards, i.e Keio's faculty x department or Glasgow's schools and
+subjects) and every shard is searched like any other search, with its courses upserted into the course store.
+The shards live in a SQLite work queue on disk, so a crawl that is stopped (or crashes) carries on from where it was when
+it is started again, only the shards that weren't finished are done again and every finished course is checkpointed
+(the engine's per search manifest) so not even those start from scratch. A shard that fails goes back on the queue until
+it has been tried max_attempts times.
+The same course often shows up in several shards, the first shard to find it claims it and the others skip it.
+"""
+from scraper.engine import ScraperEngine
+from scraper.cache import ResponseCache
+from scraper.sessions import SessionStore
+from scraper.checkpoint import Manifest
+from scraper.store import CourseStore
+from scraper.models import CourseList
+from scraper.paths import DATA_DIR
+from scraper.providers import get_provider_class
+from scraper.providers.base_provider import BaseProvider
+from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Callable
+import os, sqlite3, threading, time
+
+CRAWL_DIR = os.path.join(DATA_DIR, "crawl")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    label TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    found INTEGER NOT NULL DEFAULT 0,
+    written INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, attempts, id);
+
+-- Which shard a course (by URL) belongs to, the first shard to find it gets it
+CREATE TABLE IF NOT EXISTS claims (
+    url TEXT PRIMARY KEY,
+    shard TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# pending -> running -> done, or back to pending on a failure until max_attempts is reached, then failed
+SHARD_STATUSES = ("pending", "running", "done", "failed")
+
+
+class WorkQueue:
+    """
+    The on disk queue of shards for one provider's crawl. Like CourseStore one connection is shared by every worker
+    thread behind a lock, taking a shard is a single transaction so two workers can never get the same one.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_provider(cls, university_name: str) -> "WorkQueue":
+        return cls(os.path.join(CRAWL_DIR, f"{university_name}.sqlite3"))
+
+    def get_state(self, name: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name: str, value: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)", (name, value))
+
+    def enqueue(self, shards: dict[str, str]) -> int:
+        """
+        Adds shard key -> label pairs, shards already in the queue are left as they are. Returns how many were new.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO shards (key, label, updated_at) VALUES (?, ?, ?)",
+                [(key, label, now) for key, label in shards.items()],
+            )
+            return self._connection.total_changes - before
+
+    def take(self) -> tuple[str, str, int] | None:
+        """
+        Marks the next pending shard as running and returns (key, label, attempt), None once nothing is pending.
+        Shards that have failed before go to the back so one broken shard doesn't keep holding up the rest.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT id, key, label, attempts FROM shards WHERE status = 'pending' ORDER BY attempts, id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE shards SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (time.time(), row[0]),
+            )
+        return row[1], row[2], row[3] + 1
+
+    def finish(self, key: str, found: int, written: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE shards SET status = 'done', found = ?, written = ?, error = NULL, updated_at = ? WHERE key = ?",
+                (found, written, time.time(), key),
+            )
+
+    def fail(self, key: str, error: str, max_attempts: int) -> str:
+        """
+        Puts a failed shard back on the queue, or marks it failed for good once it has had max_attempts. Returns the new status.
+        """
+        with self._lock, self._connection:
+            attempts = self._connection.execute("SELECT attempts FROM shards WHERE key = ?", (key,)).fetchone()[0]
+            status = "pending" if attempts < max_attempts else "failed"
+            self._connection.execute(
+                "UPDATE shards SET status = ?, error = ?, updated_at = ? WHERE key = ?",
+                (status, error, time.time(), key),
+            )
+        return status
+
+    def recover(self) -> int:
+        """
+        Shards still marked running were being worked on when the last crawl stopped, they go back on the queue.
+        Only call this when no other crawl of this provider is running. Returns how many were put back.
+        """
+        with self._lock, self._connection:
+            return self._connection.execute("UPDATE shards SET status = 'pending' WHERE status = 'running'").rowcount
+
+    def requeue_failed(self) -> int:
+        with self._lock, self._connection:
+            return self._connection.execute("UPDATE shards SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+
+    def claim(self, url: str, shard: str) -> bool:
+        """
+        Claims a course for a shard, True if this shard should scrape it. A shard that is tried again still owns the
+        courses it claimed the first time, otherwise a course it failed on would never be scraped by anyone.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR IGNORE INTO claims (url, shard) VALUES (?, ?)", (url, shard))
+            owner = self._connection.execute("SELECT shard FROM claims WHERE url = ?", (url,)).fetchone()[0]
+        return owner == shard
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return {status: 0 for status in SHARD_STATUSES} | dict(rows)
+
+    def shards(self, status: str | None = None) -> list[dict]:
+        query = "SELECT key, label, status, attempts, found, written, error FROM shards"
+        parameters: tuple = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters = (status,)
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY id", parameters).fetchall()
+        return [dict(zip(("key", "label", "status", "attempts", "found", "written", "error"), row)) for row in rows]
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM shards")
+            self._connection.execute("DELETE FROM claims")
+            self._connection.execute("DELETE FROM state")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class ShardResult(BaseModel):
+    """
+    How one attempt at a shard went, status is the shard's status afterwards (done, pending to be tried again, or failed).
+    """
+    key: str
+    label: str
+    attempt: int
+    status: str
+    found: int = 0
+    written: int = 0
+    message: str | None = None
+    elapsed: float = 0.0
+
+
+class CrawlReport(BaseModel):
+    provider: str
+    queue_path: str
+    elapsed: float
+    written: int
+    counts: dict[str, int]
+    failed_shards: list[dict]
+
+
+def _crawl_shard(provider: BaseProvider, queue: WorkQueue, store: CourseStore, key: str, label: str, attempt: int, max_attempts: int, parse_workers: int = 0) -> ShardResult:
+    start = time.perf_counter()
+
+    def claim(course: CourseList) -> bool:
+        return queue.claim(course.url, key)
+
+    engine = ScraperEngine(provider, output_format="store", store=store, update_index=False, quiet=True, course_filter=claim, parse_workers=parse_workers)
+    try:
+        engine.run("shard", key)
+    # ! Running unattended, one bad shard must never stop the crawl, it is tried again later instead
+    except Exception as error:
+        message = f"{type(error).__name__}: {error}"
+    else:
+        if not engine.errors:
+            queue.finish(key, engine.found, engine.written)
+            return ShardResult(key=key, label=label, attempt=attempt, status="done", found=engine.found, written=engine.written, elapsed=time.perf_counter() - start)
+        message = f"{len(engine.errors)} courses failed, i.e " + "; ".join(f"{course.course_code}: {error}" for course, error in engine.errors[:3])
+
+    status = queue.fail(key, message, max_attempts)
+    return ShardResult(key=key, label=label, attempt=attempt, status=status, found=engine.found, written=engine.written, message=message, elapsed=time.perf_counter() - start)
+
+
+def crawl(
+    provider_key: str,
+    workers: int = 2,
+    fresh: bool = False,
+    retry_failed: bool = False,
+    max_attempts: int = 3,
+    store_path: str | None = None,
+    queue_path: str | None = None,
+    on_shard: Callable[[ShardResult], None] | None = None,
+    fast_parse: bool = False,
+    parse_workers: int = 0,
+) -> CrawlReport:
+    """
+    Crawls every shard of a provider's catalogue that isn't done yet, `workers` shards at a time.
+    The first crawl (or one with fresh=True) asks the provider for its shards, after that the queue on disk is picked up
+    where it was left. fresh also throws away the shards' checkpoints so every course really is fetched again.
+    retry_failed gives shards that ran out of attempts on an earlier crawl another go.
+    `on_shard` is called from the worker threads after every attempt at a shard.
+    fast_parse parses every course with the provider's lxml fast path, parse_workers gives every worker's shards that many parse processes.
+    """
+    provider_class = get_provider_class(provider_key)
+    if provider_class is None:
+        raise ValueError(f"Provider {provider_key} not found.")
+
+    start = time.perf_counter()
+    queue = WorkQueue(queue_path) if queue_path else WorkQueue.for_provider(provider_key)
+    store = CourseStore(store_path)
+    cache = ResponseCache()
+    sessions = SessionStore()
+    try:
+        if fresh:
+            for shard in queue.shards():
+                manifest_path = Manifest.search_path(provider_key, "shard", shard["key"])
+                if os.path.exists(manifest_path):
+                    os.remove(manifest_path)
+            queue.clear()
+        queue.recover()
+        if retry_failed:
+            queue.requeue_failed()
+
+        if queue.get_state("listed_at") is None:
+            provider = provider_class(cache=cache, sessions=sessions)
+            provider.setup_session()
+            queue.enqueue(provider.list_shards())
+            queue.set_state("listed_at", str(time.time()))
+
+        # Every worker has its own provider (and so its own session), Glasgow keeps the current search in the session so
+        # two shards can't share one. Providers whose sessions can be shared (session_ttl) set theirs up once and the
+        # other workers pick it up from the SessionStore. They all go through the one host limiter, which keeps them
+        # under the provider's max_concurrency between them whether or not this crawl listed the shards, like a batch does
+        workers = max(1, workers)
+
+        def work() -> None:
+            provider = provider_class(cache=cache, sessions=sessions, fast_parse=fast_parse)
+            while (item := queue.take()) is not None:
+                result = _crawl_shard(provider, queue, store, *item, max_attempts=max_attempts, parse_workers=parse_workers)
+                if on_shard is not None:
+                    on_shard(result)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{provider_key}-crawl") as executor:
+            for future in [executor.submit(work) for _ in range(workers)]:
+                future.result()
+
+        shards = queue.shards()
+        return CrawlReport(
+            provider=provider_key,
+            queue_path=queue.path,
+            elapsed=time.perf_counter() - start,
+            written=sum(shard["written"] for shard in shards),
+            counts=queue.counts(),
+            failed_shards=[shard for shard in shards if shard["status"] == "failed"],
+        )
+    finally:
+        store.close()
+        queue.close()
@@ -0,0 +1,78 @@
+"""
+Scraping to a time budget ("whatever you can get in 10 seconds", ScraperEngine time_budget).
+The search gets first go at the budget (up to SEARCH_SHARE of it) so we know what there is to fetch, then the details are
+fetched most relevant first so the courses the user most likely wanted are the ones done when the time runs out.
+A run that runs out of time writes what it finished as normal plus a Completeness file in data/pending listing the
+courses it didn't get to, `python main.py --finish <file>` (or just running the same search again) finishes them off,
+the search's checkpoint means nothing that was already done is fetched again.
+"""
+from scraper.models import CourseList
+from scraper.paths import DATA_DIR
+from pydantic import BaseModel
+from collections.abc import Iterable
+import orjson, os
+
+PENDING_DIR = os.path.join(DATA_DIR, "pending")
+
+# The most of the budget the search may use, whatever it has found by then is fetched in the rest
+SEARCH_SHARE = 0.5
+
+
+class Completeness(BaseModel):
+    """
+    How much of a search a time budgeted run got done. complete is True only if the whole search was read and every
+    course it found was scraped (or failed for a reason other than running out of time).
+    """
+    provider: str
+    search_method: str
+    value: str
+    time_budget: float
+    elapsed: float
+    complete: bool
+    search_complete: bool
+    found: int
+    written: int
+    failed: int
+    pending: list[CourseList]
+
+
+def pending_path(university_name: str, search_method: str, value: str) -> str:
+    safe_value = value.replace(" ", "_").replace(os.sep, "_")
+    return os.path.join(PENDING_DIR, f"{university_name}_{search_method}_{safe_value}.json")
+
+
+def write_completeness(completeness: Completeness, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(orjson.dumps(completeness.model_dump(), option=orjson.OPT_INDENT_2))
+
+
+def load_completeness(path: str) -> Completeness:
+    with open(path, "rb") as fh:
+        return Completeness.model_validate(orjson.loads(fh.read()))
+
+
+def relevance(course: CourseList, search_method: str, value: str) -> int:
+    """
+    A rough score of how well a search result fits what was searched for, higher is better.
+    Identifier searches rank the exact code first, keyword searches the courses with the whole phrase in their name
+    and then the ones with the most of its words. It is only used to decide what to fetch first.
+    """
+    query = value.lower().strip()
+    name, code = course.name.lower(), course.course_code.lower()
+    if search_method == "course_identifier":
+        return 3 if code == query else 2 if code.startswith(query) else 1 if query in code else 0
+    terms = query.split()
+    score = sum(term in name for term in terms)
+    if query and query in name:
+        score += len(terms) + 1
+    if query and query in code:
+        score += 1
+    return score
+
+
+def prioritise(courses: Iterable[CourseList], search_method: str, value: str) -> list[CourseList]:
+    """
+    The courses most relevant first, ties keep the order the search found them in.
+    """
+    return sorted(courses, key=lambda course: -relevance(course, search_method, value))
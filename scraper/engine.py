@@ -1,69 +1,613 @@
 # The ScraperEngine class is the main orchestrator of the scraping process.
 # It is responsible for coordinating with the provider to scrape the data.
 from scraper.providers.base_provider import BaseProvider
-from scraper.models import CourseData
-import os, orjson, datetime
-from dataclasses import is_dataclass, asdict
+from scraper.models import CourseData, CourseList, SearchResults
+from scraper.sinks import OutputSink, NdjsonSink, TeeSink, compact_to_json
+from scraper.store import CourseStore, StoreSink
+from scraper.checkpoint import Manifest, hash_html, MAX_AGE
+from scraper.index import CourseIndex
+from scraper.metrics import Metrics, Profiler, METRICS_DIR
+from scraper.ratelimit import deferred_retries, backoff_delay
+from scraper.errors import RetryableError, DeadlineExceededError
+from scraper.deadline import Completeness, SEARCH_SHARE, pending_path, write_completeness, prioritise
+from scraper.paths import DATA_DIR
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections.abc import Callable, Sequence
+import os, datetime, heapq, itertools, queue, threading, time
 from rich.progress import Progress, MofNCompleteColumn
 
+# How many search results can be waiting per worker before the search stage has to wait for the fetch stage to catch up
+QUEUE_DEPTH_PER_WORKER = 4
+
+# json: streamed as NDJSON while scraping then compacted into one indented JSON file at the end (the original format)
+# ndjson/ndjson.gz: left as (compressed) NDJSON, best for big catalogues
+# store: no per-run file at all, courses only go into the course store (scraper/store.py)
+OUTPUT_FORMATS = ("json", "ndjson", "ndjson.gz", "store")
+
+# Every parse process gets its own provider instance, parse_courses only needs the raw HTML and the CourseList so nothing else is shared
+_parse_worker_provider: BaseProvider | None = None
+
+def _init_parse_worker(provider_class: type[BaseProvider], fast_parse: bool) -> None:
+    global _parse_worker_provider
+    _parse_worker_provider = provider_class(fast_parse=fast_parse)
+
+def _parse_in_worker(html_content: str, course: CourseList) -> tuple[CourseData, float]:
+    assert _parse_worker_provider is not None, "Parse worker was not initialised"
+    # The time is taken in the worker, timing it from the engine's side would count the time spent waiting for a free process
+    start = time.perf_counter()
+    course_data = _parse_worker_provider.parse_courses(html_content, course)
+    return course_data, time.perf_counter() - start
+
 class ScraperEngine:
     """
     The ScraperEngine is responsible for orchestrating the scraping process.
     It takes a provider as input and uses it to scrape the data.
     """
-    def __init__(self, provider: BaseProvider):
+    def __init__(self, provider: BaseProvider, max_workers: int | None = None, output_format: str = "json", flush_every: int = 25, resume: bool = True, refresh: bool = False, parse_workers: int = 0, update_index: bool = True, store: CourseStore | None = None, quiet: bool = False, extra_sinks: Sequence[OutputSink] = (), profile: bool = False, course_filter: Callable[[CourseList], bool] | None = None, time_budget: float | None = None, max_age: float | None = MAX_AGE, time_limit: float | None = None):
         # This allows the engine to hold the *specific* provider it was given, i.e if it was given a keio provider it will hold and use a keio provider
         self.provider = provider
-        self.progress = Progress(    
+        # Never go above the provider's own limit, its connection pool is sized for exactly that many workers
+        self.max_workers = min(max_workers, provider.max_concurrency) if max_workers else provider.max_concurrency
+        # Courses that failed to scrape during the last run, kept so one broken page doesn't throw away the rest of the run
+        self.errors: list[tuple[CourseList, Exception]] = []
+        self._errors_lock = threading.Lock()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+        self.output_format = output_format
+        # Every scraped course is upserted into the store as well as (or, with output_format="store", instead of) the output file
+        if output_format == "store" and store is None:
+            store = CourseStore()
+        self.store = store
+        # Anything else that wants every course as it is scraped, i.e the merged output of a search across every provider
+        self.extra_sinks = tuple(extra_sinks)
+        # Courses the search finds that this returns False for are skipped, i.e ones another shard of a crawl already has (scraper/crawl.py)
+        self.course_filter = course_filter
+        self.flush_every = flush_every
+        # Set by run(), where the results of the last run ended up
+        self.output_path: str | None = None
+        # resume: courses already in the manifest from an earlier (or interrupted) run are not fetched again
+        # refresh: everything is fetched again, but only pages whose HTML actually changed get parsed again
+        self.resume = resume
+        self.refresh = refresh
+        # max_age: finished courses older than this (seconds) are fetched again like refresh does, None trusts them forever
+        self.max_age = max_age
+        self.manifest: Manifest | None = None
+        self.stats: dict[str, int] = {}
+        # Parsing holds the GIL and stalls every fetch thread, with parse_workers > 0 it is moved out to that many processes
+        # 0 keeps parsing on the fetch threads, which is quicker for small searches as starting the processes isn't free
+        self.parse_workers = parse_workers
+        self._parse_pool: ProcessPoolExecutor | None = None
+        self._parse_slots: threading.BoundedSemaphore | None = None
+        # Every finished run is added to the offline index so the same search can be answered locally next time
+        self.update_index = update_index
+        # quiet: no progress bar or summary, for unattended runs (scraper/batch.py) where several engines share one terminal
+        self.quiet = quiet
+        # Every run records its requests and how long each phase took, see scraper/metrics.py. The last run's are kept here
+        self.metrics: Metrics | None = None
+        self.metrics_path: str | None = None
+        self._profiler: Profiler | None = None
+        self.written = 0
+        self.found = 0
+        # profile: cProfile and tracemalloc the whole run and keep a log of every request as well, it makes the run a lot slower so it is off by default
+        self.profile = profile
+        # Set by cancel(), the run stops searching, drops whatever hasn't been fetched yet and finishes with what it has
+        self._cancelled = threading.Event()
+        # time_budget: seconds the whole run may take, the search goes first, the details most relevant first and the
+        # run is cancelled when the time is up (see scraper/deadline.py). None runs until everything is done
+        self.time_budget = time_budget
+        # time_limit: seconds the run may take without changing how it runs, the search and the details still run side
+        # by side and nothing is left in data/pending, the run is just cancelled when the time is up and no request runs
+        # past it (i.e the fan-out's per provider timeout). Ignored with a time_budget, which has its own deadline
+        self.time_limit = time_limit
+        # The courses the last run dropped (cancelled or out of time) and, for a budgeted run, how much of it got done
+        self.pending: list[CourseList] = []
+        self.search_complete = True
+        self.completeness: Completeness | None = None
+        self.progress = Progress(
             *Progress.get_default_columns(),
-            MofNCompleteColumn()
+            MofNCompleteColumn(),
+            disable=quiet
         )
-    
+
+    def cancel(self) -> None:
+        """
+        Asks a running scrape to stop early, it is safe to call from any thread i.e a timer.
+        Courses already being fetched are finished and everything finished is written as normal, so the output is partial
+        rather than lost. A request that is already in flight still runs until it completes or times out.
+        Every run starts uncancelled, so cancelling only ever stops the run in progress and the engine can be run again.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def _log(self, message: str) -> None:
+        if not self.quiet:
+            print(message)
+
+    def _store_year(self) -> str:
+        return self.provider.academic_year or str(datetime.date.today().year)
+
+    def _open_sink(self, search_method: str, value: str) -> OutputSink:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        sinks: list[OutputSink] = []
+        self.file_sink: NdjsonSink | None = None
+
+        if self.output_format != "store":
+            uni_name = self.provider.university_name
+            today = datetime.date.today().isoformat()
+            safe_value = value.replace(" ", "_")
+            # The method is in the name so a keyword and an identifier search for the same text don't overwrite each other
+            filename = f"{uni_name}_{search_method}_{safe_value}_{today}_courses.ndjson"
+            self.file_sink = NdjsonSink(os.path.join(DATA_DIR, filename), compress=self.output_format == "ndjson.gz", flush_every=self.flush_every)
+            sinks.append(self.file_sink)
+
+        if self.store is not None:
+            sinks.append(StoreSink(self.store, str(self.provider.university_name), self._store_year()))
+        sinks.extend(self.extra_sinks)
+
+        return sinks[0] if len(sinks) == 1 else TeeSink(*sinks)
+
+    def _complete(self, index: int, course_data: CourseData | None) -> None:
+        """
+        Hands a finished course to the sink. Workers finish out of order, so anything that finishes early waits here until
+        everything before it is done, that way the output keeps the search order while only holding the out of order courses in memory.
+        Failed courses are passed in as None so they don't hold up the rest.
+        """
+        with self._output_lock:
+            self._pending[index] = course_data
+            while self._next_index in self._pending:
+                record = self._pending.pop(self._next_index)
+                self._next_index += 1
+                if record is not None:
+                    with self.metrics.phase("write"):  # type: ignore[union-attr]
+                        self.sink.write(record)
+                    self.written += 1
+
+    def _count(self, stat: str) -> None:
+        with self._errors_lock:
+            self.stats[stat] = self.stats.get(stat, 0) + 1
+
+    def _prepare_course(self, course: CourseList) -> tuple[CourseData | None, str | None, str | None, str]:
+        """
+        Does as much of a course as the manifest allows without parsing, returns (record, html, html hash, what happened):
+        - skipped: fetched and parsed by the current parser before, the stored record is reused
+        - reparsed: fetched before but the parser changed since, the stored HTML still needs parsing
+        - unchanged: fetched again (refresh, or it was older than the manifest's max_age) but the HTML is identical, the stored record is reused
+        - fetched: new or changed, the fetched HTML still needs parsing
+        """
+        if self.manifest is None:
+            return None, self.provider.fetch_course_html(course), None, "fetched"
+
+        parse_version = self.provider.parse_version
+        entry = self.manifest.get(course.url)
+
+        if entry is not None and not self.refresh and self.manifest.is_fresh(entry):
+            if entry.parse_version == parse_version:
+                return CourseData.model_validate(self.manifest.load_record(entry)), None, None, "skipped"
+            html_content = self.manifest.load_html(entry.html_sha256)
+            if html_content is not None:
+                return None, html_content, entry.html_sha256, "reparsed"
+
+        html_content = self.provider.fetch_course_html(course)
+        html_sha256 = hash_html(html_content)
+        if entry is not None and entry.html_sha256 == html_sha256 and entry.parse_version == parse_version:
+            course_data = CourseData.model_validate(self.manifest.load_record(entry))
+            # Checked again just now, so it counts as fresh from here
+            self.manifest.record(course, html_sha256, parse_version, course_data)
+            return course_data, None, None, "unchanged"
+
+        return None, html_content, html_sha256, "fetched"
+
+    def _finish_course(self, index: int, course: CourseList, course_data: CourseData | None, html_content: str | None, html_sha256: str | None, stat: str, task_id) -> None:
+        """
+        Records a finished course in the manifest and hands it on to the sink, course_data is None if it failed.
+        """
+        if course_data is not None:
+            if self.manifest is not None and html_content is not None and html_sha256 is not None:
+                if stat == "fetched":
+                    self.manifest.save_html(html_content, html_sha256)
+                self.manifest.record(course, html_sha256, self.provider.parse_version, course_data)
+            self._count(stat)
+        self._complete(index, course_data)
+        self.progress.update(task_id, advance=1)
+
+    def _record_error(self, course: CourseList, error: Exception) -> None:
+        with self._errors_lock:
+            self.errors.append((course, error))
+
+    def _drop_course(self, index: int, course: CourseList, task_id) -> None:
+        """
+        A course the run stopped before getting to, it is kept in pending (to be finished later) rather than counted as failed.
+        """
+        with self._errors_lock:
+            self._dropped.append((index, course))
+        self._count("pending")
+        self._complete(index, None)
+        self.progress.update(task_id, advance=1)
+
+    def _submit_parse(self, index: int, course: CourseList, html_content: str, html_sha256: str | None, stat: str, task_id) -> None:
+        """
+        Sends the HTML to the parse processes, the fetch thread carries on with the next course straight away and the
+        course is finished off whenever its parse comes back (the output is put back in order by _complete).
+        """
+        assert self._parse_pool is not None and self._parse_slots is not None
+        # Only let so many pages wait for a parse process, otherwise fast fetching would pile up HTML in memory
+        self._parse_slots.acquire()
+        future = self._parse_pool.submit(_parse_in_worker, html_content, course)
+
+        def on_parsed(future: Future) -> None:
+            self._parse_slots.release()  # type: ignore[union-attr]
+            # Cancelled by a stopped run's shutdown before it was parsed, CancelledError isn't an Exception so it is
+            # checked for here rather than recorded as a failure
+            if future.cancelled():
+                self._drop_course(index, course, task_id)
+                return
+            course_data = None
+            try:
+                course_data, parse_seconds = future.result()
+                self.metrics.add_phase("parse", parse_seconds)  # type: ignore[union-attr]
+            except Exception as error:
+                self._record_error(course, error)
+            self._finish_course(index, course, course_data, html_content, html_sha256, stat, task_id)
+
+        future.add_done_callback(on_parsed)
+
+    def _fetch_worker(self, work_queue: queue.Queue, task_id, stop: threading.Event) -> None:
+        """
+        The consumer side of the pipeline, takes courses off the queue until it gets the None sentinel.
+        Requests made from here raise RetryableError instead of sleeping on a retry, see _schedule_retry.
+        """
+        with deferred_retries():
+            if self._profiler is not None:
+                with self._profiler.thread():
+                    self._fetch_loop(work_queue, task_id, stop)
+            else:
+                self._fetch_loop(work_queue, task_id, stop)
+
+    def _schedule_retry(self, index: int, course: CourseList, attempt: int, retry_after: float | None) -> None:
+        """
+        Puts a course that failed with a RetryableError aside until it is due again. The worker goes straight back to
+        the queue instead of sleeping through the backoff, so one struggling page doesn't take a worker out of the run.
+        """
+        due = time.monotonic() + (retry_after if retry_after is not None else backoff_delay(attempt))
+        with self._retries_lock:
+            heapq.heappush(self._retries, (due, next(self._retry_sequence), index, course, attempt))
+        self._count("retried")
+
+    def _next_retry(self, force: bool) -> tuple[tuple[int, CourseList, int] | None, float | None]:
+        """
+        Returns (a retry that is due, None) or (None, seconds until the next one is due), (None, None) if there are none.
+        force hands them out whether they are due or not, for draining them after a cancel or failure.
+        """
+        with self._retries_lock:
+            if not self._retries:
+                return None, None
+            wait = self._retries[0][0] - time.monotonic()
+            if wait > 0 and not force:
+                return None, wait
+            _, _, index, course, attempt = heapq.heappop(self._retries)
+            return (index, course, attempt), None
+
+    def _fetch_loop(self, work_queue: queue.Queue, task_id, stop: threading.Event) -> None:
+        assert self.metrics is not None
+        search_done = False
+        while True:
+            finishing = stop.is_set() or self._cancelled.is_set()
+            item, wait = self._next_retry(force=finishing)
+            if item is None:
+                if search_done:
+                    # ! A worker may only leave once there are no retries left, any retry added after this is added by
+                    # a worker that hasn't left yet and so will still get to it
+                    if wait is None:
+                        return
+                    # Nothing left to do but retries that aren't due yet, the event wakes us early on a cancel
+                    self._cancelled.wait(timeout=min(wait, 1.0))
+                    continue
+                try:
+                    queued = work_queue.get(timeout=wait)
+                except queue.Empty:
+                    continue
+                if queued is None:
+                    search_done = True
+                    continue
+                item = (*queued, 0)
+
+            index, course, attempt = item
+            # The search failed part way through, just drain the queue so the search stage isn't left blocked
+            if stop.is_set():
+                continue
+            # Cancelled, the course is dropped but still has to be marked done or the courses after it would wait for it forever
+            if self._cancelled.is_set():
+                self._drop_course(index, course, task_id)
+                continue
+            try:
+                with self.metrics.phase("fetch"):
+                    course_data, html_content, html_sha256, stat = self._prepare_course(course)
+                if course_data is None and html_content is not None:
+                    if self._parse_pool is not None:
+                        self._submit_parse(index, course, html_content, html_sha256, stat, task_id)
+                        continue
+                    with self.metrics.phase("parse"):
+                        course_data = self.provider.parse_courses(html_content, course)
+            # Out of time before the course could be fetched, it waits for the next run like the cancelled ones
+            except DeadlineExceededError:
+                self._drop_course(index, course, task_id)
+                continue
+            except RetryableError as error:
+                if attempt < self.provider.max_retries:
+                    self._schedule_retry(index, course, attempt + 1, error.retry_after)
+                    continue
+                # Out of retries, report it as the HTTPStatusError/NetworkError it really was
+                self._record_error(course, error.cause or error)
+                self._finish_course(index, course, None, None, None, "failed", task_id)
+                continue
+            except Exception as error:
+                self._record_error(course, error)
+                self._finish_course(index, course, None, None, None, "failed", task_id)
+                continue
+            self._finish_course(index, course, course_data, html_content, html_sha256, stat, task_id)
+
+    def _search_first(self, search_method: str, value: str, search_deadline: float) -> SearchResults:
+        """
+        With a time budget the search is read before any details are fetched, so the details can be fetched most relevant
+        first and the search doesn't have to share the rate limit with them. It stops at search_deadline, what it found
+        by then is fetched and the search is marked incomplete (a provider that returns a list has found nothing by then).
+        """
+        found: list[CourseList] = []
+        try:
+            for course in self.provider.iter_search(search_method, value):
+                found.append(course)
+                if time.monotonic() >= search_deadline:
+                    self.search_complete = False
+                    break
+        except DeadlineExceededError:
+            self.search_complete = False
+        return SearchResults(prioritise(found, search_method, value), estimated_total=len(found))
+
+    def _record_completeness(self, search_method: str, value: str, elapsed: float) -> None:
+        """
+        Writes a budgeted run's Completeness to data/pending if it didn't get everything done. Any run that does get
+        everything done removes the file, the search has been finished off.
+        """
+        path = pending_path(str(self.provider.university_name), search_method, value)
+        complete = self.search_complete and not self.pending
+        if self.time_budget is not None:
+            self.completeness = Completeness(
+                provider=str(self.provider.university_name),
+                search_method=search_method,
+                value=value,
+                time_budget=self.time_budget,
+                elapsed=elapsed,
+                complete=complete,
+                search_complete=self.search_complete,
+                found=self.found,
+                written=self.written,
+                failed=len(self.errors),
+                pending=self.pending,
+            )
+            if not complete:
+                write_completeness(self.completeness, path)
+                self._log(f"Out of time after {elapsed:.1f}s, {len(self.pending)} courses were left for later" + ("" if self.search_complete else " and the search wasn't finished") + f", see {path}")
+        if complete and os.path.exists(path):
+            os.remove(path)
+
     def run(self, search_method: str, value: str) -> None:
         """
         The main method of the engine, it orchestrates the scraping process.
-        1. It gets the course list from the provider.
-        2. It iterates through the course list and gets the details for each course.
-        3. It parses the details and returns the data.
+        1. It gets the course list from the provider, providers can yield courses as each results page is parsed.
+        2. Every course is handed to a pool of worker threads as soon as it is found, so details are fetched while the search is still paging.
+        3. It parses the details and streams each course to the output file as it is done, in the same order as the search results.
+        The metrics (and profile) are written whether the run succeeds or not, a failing run is exactly when they are wanted.
         """
+        self.metrics = Metrics(keep_requests=self.profile)
+        self.provider.metrics = self.metrics
+        self._profiler = Profiler() if self.profile else None
+        if self._profiler is not None:
+            self._profiler.start()
+        started = time.perf_counter()
+        try:
+            if self._profiler is not None:
+                with self._profiler.thread():
+                    self._run(search_method, value)
+            else:
+                self._run(search_method, value)
+        finally:
+            self.provider.metrics = None
+            self._finish_metrics(search_method, value, time.perf_counter() - started)
+
+    def _finish_metrics(self, search_method: str, value: str, wall_time: float) -> None:
+        assert self.metrics is not None
+        self.metrics.wall_time = wall_time
+        self.metrics.counts = {"found": self.found, "written": self.written, "failed": len(self.errors), **self.stats}
+
+        safe_value = value.replace(" ", "_").replace(os.sep, "_")
+        path_prefix = os.path.join(METRICS_DIR, f"{self.provider.university_name}_{search_method}_{safe_value}_{datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S-%f')}")
+        self.metrics_path = path_prefix + ".metrics.json"
+        self.metrics.write_json(self.metrics_path)
+
+        if not self.quiet:
+            from rich.console import Console
+            Console().print(self.metrics.table(f"{self.provider.university_name} '{value}'"))
+        self._log(f"Metrics written to {self.metrics_path}")
+        if self._profiler is not None:
+            for path in self._profiler.stop(path_prefix):
+                self._log(f"Profile written to {path}")
+            self._profiler = None
+
+    def _run(self, search_method: str, value: str) -> None:
+        assert self.metrics is not None
+        self._cancelled.clear()
         self.progress.start()
+        self.errors = []
+        self.stats = {}
+        run_started = time.time()
+        self.sink = self._open_sink(search_method, value)
+        if self.resume or self.refresh:
+            self.manifest = Manifest.for_search(str(self.provider.university_name), search_method, value, max_age=self.max_age)
+        self._output_lock = threading.Lock()
+        self._pending: dict[int, CourseData | None] = {}
+        self._next_index = 0
+        self.written = 0
+        self.found = 0
+        self._retries: list[tuple[float, int, int, CourseList, int]] = []
+        self._retries_lock = threading.Lock()
+        self._retry_sequence = itertools.count()
+        self._dropped: list[tuple[int, CourseList]] = []
+        self.pending = []
+        self.search_complete = True
+        self.completeness = None
+        started = time.monotonic()
+        deadline = started + self.time_budget if self.time_budget is not None else None
+        timer: threading.Timer | None = None
+        # The setup and the search only get their share of the budget, the details need some of it too
+        if deadline is not None:
+            self.provider.deadline = started + self.time_budget * SEARCH_SHARE  # type: ignore[operator]
+        elif self.time_limit is not None:
+            self.provider.deadline = started + self.time_limit
+            timer = threading.Timer(self.time_limit, self.cancel)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            # Some providers may require a setup step, i.e getting cookies, or can pick up a session saved by an earlier run
+            with self.metrics.phase("setup"):
+                self.provider.setup_session()
+
+            # Providers that return a list do all of their searching here, generators do it while being iterated below
+            search_started = time.perf_counter()
+            if deadline is None:
+                course_list = self.provider.iter_search(search_method, value)
+            else:
+                course_list = self._search_first(search_method, value, self.provider.deadline)  # type: ignore[arg-type]
+                # ! Whatever is still going at the deadline is cancelled, the requests themselves can't run past it either
+                self.provider.deadline = deadline
+                timer = threading.Timer(max(0.0, deadline - time.monotonic()), self.cancel)
+                timer.daemon = True
+                timer.start()
+            search_seconds = time.perf_counter() - search_started
+
+            # The total is the provider's estimate if it has one, otherwise it isn't known until the search is done and grows as courses are found
+            getting_details = self.progress.add_task("[green]Getting course details...", total=None, start=True)
+
+            # Bounded so a fast search can't run miles ahead of the detail fetching and fill up memory, with a time budget
+            # the search is already all in memory so there's nothing to hold back
+            work_queue: queue.Queue = queue.Queue(maxsize=self.max_workers * QUEUE_DEPTH_PER_WORKER if deadline is None else 0)
+            stop = threading.Event()
+            if self.parse_workers > 0:
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    initializer=_init_parse_worker,
+                    initargs=(type(self.provider), self.provider.fast_parse),
+                )
+                self._parse_slots = threading.BoundedSemaphore(self.parse_workers * QUEUE_DEPTH_PER_WORKER)
+            workers = [
+                threading.Thread(target=self._fetch_worker, args=(work_queue, getting_details, stop), name=f"{self.provider.university_name}-fetch-{number}", daemon=True)
+                for number in range(self.max_workers)
+            ]
+            for worker in workers:
+                worker.start()
+
+            # The search runs on this thread so its errors (i.e CourseNotFoundError) reach the caller as they always have
+            course_list_length = 0
+            # Overlapping search pages (or days, or shards) can list the same course more than once, it is only fetched the first time
+            seen_urls: set[str] = set()
+            # queue_wait is how long the search was held up because the workers were behind, a lot of it means more workers would help
+            queue_wait_seconds = 0.0
+            try:
+                courses = iter(course_list)
+                while True:
+                    step_started = time.perf_counter()
+                    try:
+                        course = next(courses, None)
+                    # A time_limit ran out part way through the search, whatever it found so far is kept
+                    except DeadlineExceededError:
+                        self.search_complete = False
+                        course = None
+                    search_seconds += time.perf_counter() - step_started
+                    if course is None or self._cancelled.is_set():
+                        break
+                    if course.url in seen_urls:
+                        self._count("duplicate")
+                        continue
+                    seen_urls.add(course.url)
+                    if self.course_filter is not None and not self.course_filter(course):
+                        self._count("duplicate")
+                        continue
+                    index = course_list_length
+                    course_list_length += 1
+                    self.progress.update(getting_details, total=max(course_list_length, course_list.estimated_total or 0))
+                    step_started = time.perf_counter()
+                    work_queue.put((index, course))
+                    queue_wait_seconds += time.perf_counter() - step_started
+            except BaseException:
+                stop.set()
+                raise
+            finally:
+                self.metrics.add_phase("search", search_seconds)
+                self.metrics.add_phase("queue_wait", queue_wait_seconds)
+                for _ in workers:
+                    work_queue.put(None)
+                for worker in workers:
+                    worker.join()
+                # Waits for the last parses to come back, their callbacks have all run once this returns
+                if self._parse_pool is not None:
+                    self._parse_pool.shutdown(wait=True, cancel_futures=stop.is_set())
+                    self._parse_pool = None
+
+            self.found = course_list_length
+            self.pending = [course for _, course in sorted(self._dropped, key=lambda dropped: dropped[0])]
+            # The estimate counts duplicates and whatever the filter skipped, the bar should still end up full
+            self.progress.update(getting_details, total=course_list_length)
+            self._log(f"Found {course_list_length} courses.")
+            if self._cancelled.is_set() and deadline is None:
+                self._log("Cancelled, only the courses finished so far were kept.")
+        except BaseException:
+            self.sink.close()
+            if self.manifest is not None:
+                self.manifest.close()
+            # Whatever happens everything scraped before a failure stays on disk, but there's no point keeping an empty file around
+            if self.written == 0 and self.file_sink is not None:
+                os.remove(self.file_sink.path)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self.provider.deadline = None
+            self.progress.stop()
+
+        finalize_started = time.perf_counter()
+        self.sink.close()
+        if self.manifest is not None:
+            self.manifest.compact()
+            self.manifest.close()
+
+        if self.update_index and self.written:
+            course_index = CourseIndex(str(self.provider.university_name))
+            if self.file_sink is None and self.store is not None:
+                # Everything this run wrote was upserted after it started, so that is exactly this run's courses
+                course_index.add(self.store.iter_courses(str(self.provider.university_name), self._store_year(), scraped_since=run_started))
+            elif self.file_sink is not None:
+                # Indexed from the NDJSON stream one course at a time, before it is compacted away
+                course_index.add_file(self.file_sink.path)
+
+        self.output_path = self.sink.path
+        if self.output_format == "json" and self.file_sink is not None:
+            # Compact the stream into the pretty JSON file, only once it is written do we get rid of the NDJSON copy
+            json_path = self.file_sink.path.removesuffix(".ndjson") + ".json"
+            compact_to_json(self.file_sink.path, json_path)
+            os.remove(self.file_sink.path)
+            self.output_path = json_path
+
+        self._log(f"Wrote {self.written} courses to {self.output_path}")
+        self._record_completeness(search_method, value, time.monotonic() - started)
+        self.metrics.add_phase("finalize", time.perf_counter() - finalize_started)
+        self._log(f"Successfully scraped {self.written} courses.")
+        if self.manifest is not None:
+            self._log(", ".join(f"{count} {stat}" for stat, count in sorted(self.stats.items())))
 
-        # Some providers may require a setup step, i.e getting cookies
-        setup_method = getattr(self.provider, 'setup_provider', None)
-        if callable(setup_method):
-            setup_method()
-        
-        if search_method == "keyword":
-            course_list = self.provider.search_by_keyword(value)
-        elif search_method == "course_identifier":
-            course_list = self.provider.search_by_identifier(value)
-
-        all_courses_data : list[CourseData] = []
-        course_list_length = len(course_list)
-
-        print(f"Found {course_list_length} courses. Starting scrape...")
-
-        getting_details = self.progress.add_task("[green]Getting course details...", total=course_list_length, start=True)
-        for course in course_list:
-            course_data = self.provider.fetch_course_details(course)
-            all_courses_data.append(course_data)
-            self.progress.update(getting_details, advance=1)
-
-        self.progress.stop()
-
-        output_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-        os.makedirs(output_dir, exist_ok=True)
-
-        uni_name = self.provider.university_name
-        today = datetime.date.today().isoformat()
-        filename = f"{uni_name}_{value.replace(" ", "_")}_{today}_courses.json"
-        
-        output_path = os.path.join(output_dir, filename)
-
-        serializable = [c.model_dump() for c in all_courses_data]
-        
-        with open(output_path, "wb") as fh:
-            fh.write(orjson.dumps(serializable, option=orjson.OPT_INDENT_2))
-
-        print(f"Wrote {len(serializable)} courses to {output_path}")
-        print(f"Successfully scraped {len(all_courses_data)} courses.")
\ No newline at end of file
+        if self.errors:
+            self._log(f"Failed to scrape {len(self.errors)} courses:")
+            for course, error in self.errors:
+                self._log(f"  {course.course_code} ({course.url}): {error}")
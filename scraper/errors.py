@@ -34,4 +34,34 @@ class ParseError(ScraperError):
 
 class CourseNotFoundError(ScraperError):
     """Raised when a search returns no matching courses."""
-    pass
\ No newline at end of file
+    pass
+
+class RetryableError(NetworkError):
+    """Raised when a request failed in a way worth trying again later (429, 5xx, timeouts), `retry_after` is how long to wait first."""
+
+    def __init__(self, message: str, retry_after: float | None = None, cause: ScraperError | None = None):
+        self.retry_after = retry_after
+        # What to raise instead once the retries run out, so callers still see the HTTPStatusError/NetworkError they used to
+        self.cause = cause
+        super().__init__(message)
+
+
+class CircuitOpenError(RetryableError):
+    """Raised without sending anything when a host has failed too often in a row and is being given time to recover."""
+
+    def __init__(self, host: str, retry_after: float):
+        self.host = host
+        super().__init__(f"Too many failures from {host}, not sending anything for {retry_after:.0f}s", retry_after=retry_after)
+
+
+class DeadlineExceededError(ScraperError):
+    """Raised instead of sending (or waiting to send) a request once the run's time budget is used up, see ScraperEngine time_budget."""
+    pass
+
+
+class SessionRejectedError(ProviderError):
+    """Raised when the site answers as if the provider's session has expired, the provider sets up a new one and tries again."""
+
+    def __init__(self, url: str):
+        self.url = url
+        super().__init__(f"The session was rejected by {url}")
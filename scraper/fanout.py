@@ -0,0 +1,212 @@
+"""
+Runs the same keyword search against every provider at once and merges the results into one file as they come in.
+Every provider runs in its own thread with its own engine, so a slow site (i.e Keio and its search POST per weekday)
+never holds back the fast ones and the whole search takes as long as the slowest provider instead of all of them added up.
+Every provider also has a timeout (the engine's time_limit), once it is up the provider is cancelled, no request runs
+past it and whatever it had finished is kept.
+"""
+from scraper.engine import ScraperEngine
+from scraper.cache import ResponseCache
+from scraper.sessions import SessionStore
+from scraper.store import CourseStore
+from scraper.models import CourseData, record_fields
+from scraper.paths import DATA_DIR
+from scraper.providers import get_provider_class, PROVIDER_REGISTRY
+from scraper.sinks import OutputSink, NdjsonSink, compact_to_json
+from scraper.errors import CourseNotFoundError, DeadlineExceededError
+from pydantic import BaseModel
+from collections.abc import Callable
+import datetime, os, queue, threading, time
+
+# How long past its timeout a provider gets to wind down (parses and writes in progress) before it is given up on
+CANCEL_GRACE = 10.0
+
+
+class ProviderOutcome(BaseModel):
+    """
+    How one provider's part of the search went. status is one of:
+    - ok: finished in time
+    - partial: finished in time but some courses failed
+    - timed_out: ran out of time, `written` courses were kept
+    - not_found: the search returned nothing
+    - failed: the search itself failed, `message` says why
+    """
+    provider: str
+    status: str
+    found: int = 0
+    written: int = 0
+    elapsed: float = 0.0
+    message: str | None = None
+
+
+class FanoutResult(BaseModel):
+    keyword: str
+    output_path: str
+    written: int
+    elapsed: float
+    outcomes: list[ProviderOutcome]
+
+
+class MergedSink:
+    """
+    The one output every provider writes into, each course tagged with its university_name. Records from different
+    providers are interleaved in whatever order they finish.
+    """
+    def __init__(self, path: str, flush_every: int = 25) -> None:
+        self._sink = NdjsonSink(path, flush_every=flush_every)
+        self.path = self._sink.path
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def count(self) -> int:
+        return self._sink.count
+
+    def write(self, university_name: str, record: CourseData) -> None:
+        with self._lock:
+            if not self._closed:
+                self._sink.write_dict({"university_name": university_name, **record_fields(record)})
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._sink.close()
+
+
+class _ProviderSink(OutputSink):
+    """
+    One provider's view of the MergedSink. The engine closes its sinks when it is done, which must not close the merged
+    output the other providers are still writing to, so closing just detaches this provider. A provider that is given up
+    on is detached as well, so if it ever does finish it can't add anything to a result that has already been handed back.
+    """
+    def __init__(self, merged: MergedSink, university_name: str) -> None:
+        self.merged = merged
+        self.path = merged.path
+        self.university_name = university_name
+        self.written = 0
+        self.detached = False
+        self.on_course: Callable[[str, CourseData], None] | None = None
+
+    def write(self, record: CourseData) -> None:
+        if self.detached:
+            return
+        self.merged.write(self.university_name, record)
+        self.written += 1
+        if self.on_course is not None:
+            self.on_course(self.university_name, record)
+
+    def close(self) -> None:
+        self.detached = True
+
+
+def _search_provider(provider_key: str, keyword: str, sink: _ProviderSink, store: CourseStore, cache: ResponseCache, sessions: SessionStore, timeout: float, outcomes: queue.Queue) -> None:
+    start = time.perf_counter()
+    status, message, found = "ok", None, 0
+    try:
+        provider_class = get_provider_class(provider_key)
+        if provider_class is None:
+            raise ValueError(f"Provider {provider_key} not found.")
+        # A time_limit rather than a time_budget, the search and the details still overlap and nothing is left in
+        # data/pending for a search nobody asked to finish, but the requests in flight are cut off at the timeout too
+        engine = ScraperEngine(provider_class(cache=cache, sessions=sessions), output_format="store", store=store, quiet=True, extra_sinks=(sink,), time_limit=timeout)
+        try:
+            engine.run("keyword", keyword)
+        finally:
+            found = engine.found
+        if engine.cancelled or not engine.search_complete:
+            status, message = "timed_out", f"Out of time after {timeout:.0f}s"
+        elif engine.errors:
+            status, message = "partial", f"{len(engine.errors)} courses failed"
+    except CourseNotFoundError as error:
+        status, message = "not_found", str(error)
+    # The setup ran out of time before the search even started
+    except DeadlineExceededError:
+        status, message = "timed_out", f"Out of time after {timeout:.0f}s"
+    # ! One provider failing must never take the others down with it
+    except Exception as error:
+        status, message = "failed", f"{type(error).__name__}: {error}"
+    outcomes.put(ProviderOutcome(provider=provider_key, status=status, found=found, written=sink.written, elapsed=time.perf_counter() - start, message=message))
+
+
+def search_all(
+    keyword: str,
+    timeout: float = 120.0,
+    timeouts: dict[str, float] | None = None,
+    provider_keys: list[str] | None = None,
+    store: CourseStore | None = None,
+    on_course: Callable[[str, CourseData], None] | None = None,
+    on_outcome: Callable[[ProviderOutcome], None] | None = None,
+) -> FanoutResult:
+    """
+    Searches every provider (or just `provider_keys`) for the keyword at the same time.
+    `timeout` is how long each provider gets, `timeouts` overrides it per provider i.e {"keio_university": 300}.
+    `on_course` is called with every course as soon as it is written to the merged output and `on_outcome` as each
+    provider finishes, both from the provider's own thread.
+    The merged output is written as NDJSON while the search runs and compacted into one JSON file at the end.
+    """
+    provider_keys = provider_keys or list(PROVIDER_REGISTRY.keys())
+    timeouts = timeouts or {}
+    store = store or CourseStore()
+    cache = ResponseCache()
+    sessions = SessionStore()
+    start = time.perf_counter()
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    safe_keyword = keyword.replace(" ", "_").replace(os.sep, "_")
+    merged = MergedSink(os.path.join(DATA_DIR, f"all_universities_{safe_keyword}_{datetime.date.today().isoformat()}_courses.ndjson"))
+
+    outcomes: queue.Queue = queue.Queue()
+    sinks: dict[str, _ProviderSink] = {}
+    deadlines: dict[str, float] = {}
+    for provider_key in provider_keys:
+        sink = _ProviderSink(merged, provider_key)
+        sink.on_course = on_course
+        sinks[provider_key] = sink
+        provider_timeout = timeouts.get(provider_key, timeout)
+        deadlines[provider_key] = start + provider_timeout + CANCEL_GRACE
+        # Daemon threads, a provider stuck in a request past its grace period is abandoned rather than waited on
+        threading.Thread(
+            target=_search_provider,
+            args=(provider_key, keyword, sink, store, cache, sessions, provider_timeout, outcomes),
+            name=f"{provider_key}-search",
+            daemon=True,
+        ).start()
+
+    finished: dict[str, ProviderOutcome] = {}
+    while len(finished) < len(provider_keys):
+        remaining = max(deadlines[key] for key in provider_keys if key not in finished) - time.perf_counter()
+        try:
+            outcome = outcomes.get(timeout=max(remaining, 0.0))
+        except queue.Empty:
+            break
+        finished[outcome.provider] = outcome
+        if on_outcome is not None:
+            on_outcome(outcome)
+
+    for provider_key in provider_keys:
+        if provider_key not in finished:
+            sink = sinks[provider_key]
+            sink.detached = True
+            outcome = ProviderOutcome(
+                provider=provider_key,
+                status="timed_out",
+                written=sink.written,
+                elapsed=time.perf_counter() - start,
+                message="Did not stop at its timeout, gave up waiting",
+            )
+            finished[provider_key] = outcome
+            if on_outcome is not None:
+                on_outcome(outcome)
+
+    merged.close()
+    json_path = merged.path.removesuffix(".ndjson") + ".json"
+    written = compact_to_json(merged.path, json_path)
+    os.remove(merged.path)
+
+    return FanoutResult(
+        keyword=keyword,
+        output_path=json_path,
+        written=written,
+        elapsed=time.perf_counter() - start,
+        outcomes=[finished[provider_key] for provider_key in provider_keys],
+    )
@@ -0,0 +1,209 @@
+"""
+A local full text index over everything we have scraped, so searches can be answered without going to the university's site.
+Every university gets its own directory of immutable segments, each one an inverted index (term -> postings list) over the
+courses from one scrape. New scrapes add a segment and once there are too many they get merged into one.
+"""
+from scraper.models import CourseData, course_data_list, record_fields
+from scraper.paths import DATA_DIR
+from scraper.sinks import iter_ndjson
+from collections import Counter
+from collections.abc import Iterable
+import math, orjson, os, re, threading, time
+
+INDEX_DIR = os.path.join(DATA_DIR, "index")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Segments get merged once there are more than this many, searching has to look through every one of them
+MAX_SEGMENTS = 16
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class Segment:
+    """
+    One immutable piece of the index: the courses it holds, a postings list of [doc id, term frequency] per term and a course code lookup.
+    """
+    def __init__(self, path: str, created_at: float, docs: list[dict], postings: dict[str, list[list[int]]], codes: dict[str, list[int]]) -> None:
+        self.path = path
+        self.created_at = created_at
+        self.docs = docs
+        self.postings = postings
+        self.codes = codes
+
+    @classmethod
+    def build(cls, path: str, records: Iterable[CourseData]) -> "Segment":
+        docs: list[dict] = []
+        postings: dict[str, list[list[int]]] = {}
+        codes: dict[str, list[int]] = {}
+        for doc_id, record in enumerate(records):
+            docs.append(dict(record_fields(record)))
+            # The name counts for more than the description, it is what people search for
+            terms = Counter(tokenize(f"{record.name} {record.name} {record.course_code} {record.aims} {record.ilos}"))
+            for term, frequency in terms.items():
+                postings.setdefault(term, []).append([doc_id, frequency])
+            codes.setdefault(record.course_code.upper(), []).append(doc_id)
+        return cls(path, time.time(), docs, postings, codes)
+
+    @classmethod
+    def load(cls, path: str) -> "Segment":
+        with open(path, "rb") as fh:
+            data = orjson.loads(fh.read())
+        return cls(path, data["created_at"], data["docs"], data["postings"], data["codes"])
+
+    def save(self) -> None:
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as fh:
+            fh.write(orjson.dumps({"created_at": self.created_at, "docs": self.docs, "postings": self.postings, "codes": self.codes}))
+        os.replace(temporary_path, self.path)
+
+    def search(self, terms: list[str]) -> dict[int, float]:
+        """
+        Every doc containing all of the terms, scored by tf-idf. The shortest postings list goes first so the intersection stays small.
+        """
+        postings_lists: list[list[list[int]]] = []
+        for term in terms:
+            postings = self.postings.get(term)
+            # A term no doc has (or an empty postings list) means nothing can match every term
+            if not postings:
+                return {}
+            postings_lists.append(postings)
+        if not postings_lists:
+            return {}
+
+        scores: dict[int, float] | None = None
+        for postings in sorted(postings_lists, key=len):
+            idf = math.log(1 + len(self.docs) / len(postings))
+            term_scores = {doc_id: frequency * idf for doc_id, frequency in postings}
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id] for doc_id, score in scores.items() if doc_id in term_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+class CourseIndex:
+    """
+    The offline index for a single university. `max_age` is how old the newest segment can be before the index counts as
+    stale, at which point callers should go back to the provider.
+    """
+    def __init__(self, university_name: str, directory: str | None = None, max_age: float = 7 * 24 * 60 * 60) -> None:
+        self.university_name = university_name
+        self.directory = directory or os.path.join(INDEX_DIR, university_name)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._segments: dict[str, Segment] = {}
+
+    def _segment_paths(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        # Segment names start with the creation time so sorting them puts them oldest first
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".segment.json"))
+
+    def segments(self) -> list[Segment]:
+        """
+        Every segment oldest first, loaded from disk the first time they are needed and kept in memory after that.
+        """
+        with self._lock:
+            paths = self._segment_paths()
+            for path in paths:
+                if path not in self._segments:
+                    self._segments[path] = Segment.load(path)
+            for path in set(self._segments) - set(paths):
+                del self._segments[path]
+            return [self._segments[path] for path in paths]
+
+    def exists(self) -> bool:
+        return bool(self._segment_paths())
+
+    def is_stale(self) -> bool:
+        segments = self.segments()
+        if not segments:
+            return True
+        return (time.time() - segments[-1].created_at) > self.max_age
+
+    def add(self, records: Iterable[CourseData]) -> Segment | None:
+        """
+        Adds a new segment holding the given courses, returns None if there weren't any.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.time_ns()}.segment.json")
+        segment = Segment.build(path, records)
+        if not segment.docs:
+            return None
+        segment.save()
+        if len(self._segment_paths()) > MAX_SEGMENTS:
+            self.compact()
+        return segment
+
+    def add_file(self, path: str) -> Segment | None:
+        """
+        Adds one of the engine's output files (.json, .ndjson or .ndjson.gz) as a new segment. NDJSON is read one course at
+        a time, a .json array has to be read whole so the engine indexes its NDJSON before compacting it.
+        """
+        if path.endswith(".json"):
+            with open(path, "rb") as fh:
+                records = orjson.loads(fh.read())
+        else:
+            records = iter_ndjson(path)
+        return self.add(CourseData(**record) for record in records)
+
+    def _latest_courses(self) -> dict[str, tuple[float, dict]]:
+        # A course scraped in several searches lives in several segments, only the newest copy is kept
+        latest: dict[str, tuple[float, dict]] = {}
+        for segment in self.segments():
+            for doc in segment.docs:
+                latest[doc["course_code"]] = (segment.created_at, doc)
+        return latest
+
+    def compact(self) -> None:
+        """
+        Merges every segment into one, dropping the older copies of courses that were scraped more than once.
+        """
+        old_paths = self._segment_paths()
+        if len(old_paths) < 2:
+            return
+        latest = self._latest_courses()
+        path = os.path.join(self.directory, f"{time.time_ns()}.segment.json")
+        merged = Segment.build(path, (CourseData(**doc) for _, doc in latest.values()))
+        # Keep the newest segment's age, merging doesn't make the data any fresher
+        merged.created_at = max(created_at for created_at, _ in latest.values())
+        merged.save()
+        for old_path in old_paths:
+            os.remove(old_path)
+
+    def _deduplicate(self, hits: list[tuple[float, float, dict]], limit: int | None) -> list[CourseData]:
+        # hits are (score, segment created_at, doc). A hit from a segment older than the newest one holding its course is
+        # out of date even if the newest copy didn't match (i.e the course was renamed), so it is dropped rather than shown
+        latest = self._latest_courses()
+        newest: dict[str, tuple[float, float, dict]] = {}
+        for score, created_at, doc in hits:
+            if created_at < latest[doc["course_code"]][0]:
+                continue
+            newest[doc["course_code"]] = (score, created_at, doc)
+        ranked = sorted(newest.values(), key=lambda hit: hit[0], reverse=True)
+        return course_data_list([doc for _, _, doc in ranked[:limit]])
+
+    def search(self, query: str, limit: int | None = 50) -> list[CourseData]:
+        """
+        Courses matching every word of the query, best match first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        hits = []
+        for segment in self.segments():
+            for doc_id, score in segment.search(terms).items():
+                hits.append((score, segment.created_at, segment.docs[doc_id]))
+        return self._deduplicate(hits, limit)
+
+    def lookup_code(self, course_code: str) -> list[CourseData]:
+        """
+        Exact (case insensitive) course code lookup.
+        """
+        hits = []
+        for segment in self.segments():
+            for doc_id in segment.codes.get(course_code.strip().upper(), []):
+                hits.append((0.0, segment.created_at, segment.docs[doc_id]))
+        return self._deduplicate(hits, None)
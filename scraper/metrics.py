@@ -0,0 +1,262 @@
+"""
+Instrumentation for a scrape, so a slow run can be pinned on the network, retries, parsing or writing instead of guessed at.
+BaseProvider._request records every request (latency, bytes, status, retries, whether the cache answered it) and the
+engine times each phase of a run. At the end it all comes out as a rich table and a metrics JSON file.
+Requests are only kept as running totals and a latency histogram, so a run's metrics take the same memory whether it
+makes a hundred requests or a million, the per request log is only kept (and written) when profiling.
+Profiling (cProfile of every worker thread plus tracemalloc) is opt in since it slows the run down a lot.
+"""
+from scraper.paths import DATA_DIR
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+import bisect, cProfile, io, math, orjson, os, pstats, sys, threading, time, tracemalloc
+
+if TYPE_CHECKING:
+    from rich.table import Table
+
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+
+# hit: answered from the cache without asking the server
+# revalidated: stale, the server answered 304 so the cached copy was used
+# miss: cacheable but not cached, fetched from the server
+# bypass: not cacheable (no cache, or cache=False), fetched from the server
+# coalesced: the same GET was already in flight from another thread, its response was shared rather than asked for again
+CACHE_OUTCOMES = ("hit", "revalidated", "miss", "bypass", "coalesced")
+
+
+@dataclass
+class RequestRecord:
+    method: str
+    url: str
+    status: int | None
+    latency: float
+    bytes: int
+    retries: int
+    cache: str
+    error: str | None = None
+
+
+# Latency bucket upper bounds, 0.1ms to ~10 minutes 5% apart, so a percentile read off the histogram is within 5%
+LATENCY_BUCKETS = [0.0001 * 1.05 ** index for index in range(math.ceil(math.log(6_000_000, 1.05)) + 1)]
+
+
+class LatencyHistogram:
+    """
+    Latencies counted into LATENCY_BUCKETS instead of kept, the percentiles are the upper bound of the bucket the rank
+    falls in (never more than the largest latency seen). Not thread safe on its own, Metrics holds its lock around it.
+    """
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = min(self.count - 1, int(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                return min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+
+class Metrics:
+    """
+    Everything recorded during one run. Every method is safe to call from any of the engine's threads.
+    Phase times are summed over every thread, so with 4 workers 'fetch' can be up to 4x the wall time, what matters is
+    how the phases compare to each other.
+    keep_requests keeps every RequestRecord as well (for the request log in the metrics JSON), the engine only does so when profiling.
+    """
+    def __init__(self, keep_requests: bool = False) -> None:
+        self._lock = threading.Lock()
+        self.keep_requests = keep_requests
+        self.requests: list[RequestRecord] = []
+        self.request_count = 0
+        self.network_count = 0
+        self.cache_outcomes = dict.fromkeys(CACHE_OUTCOMES, 0)
+        self.statuses: dict[str, int] = {}
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+        self.bytes_from_cache = 0
+        self.latency = LatencyHistogram()
+        self.phases: dict[str, list[float]] = {}
+        self.started_at = time.time()
+        self.wall_time = 0.0
+        self.counts: dict[str, int] = {}
+
+    def record_request(self, record: RequestRecord) -> None:
+        status = str(record.status) if record.status is not None else "error"
+        with self._lock:
+            self.request_count += 1
+            self.cache_outcomes[record.cache] = self.cache_outcomes.get(record.cache, 0) + 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.retries += record.retries
+            self.errors += record.error is not None
+            if record.cache not in ("hit", "coalesced"):
+                self.network_count += 1
+                self.bytes += record.bytes
+                self.latency.add(record.latency)
+            if record.cache in ("hit", "revalidated"):
+                self.bytes_from_cache += record.bytes
+            if self.keep_requests:
+                self.requests.append(record)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            total_and_count = self.phases.setdefault(name, [0.0, 0])
+            total_and_count[0] += seconds
+            total_and_count[1] += 1
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        with self._lock:
+            phases = {name: {"seconds": total, "count": int(count), "mean": total / count if count else 0.0} for name, (total, count) in self.phases.items()}
+            return {
+                "started_at": self.started_at,
+                "wall_time": self.wall_time,
+                "counts": dict(self.counts),
+                "phases": phases,
+                "requests": {
+                    "total": self.request_count,
+                    "network": self.network_count,
+                    "cache": dict(self.cache_outcomes),
+                    "statuses": dict(self.statuses),
+                    "retries": self.retries,
+                    "errors": self.errors,
+                    "bytes": self.bytes,
+                    "bytes_from_cache": self.bytes_from_cache,
+                    "latency": {
+                        "p50": self.latency.percentile(0.50),
+                        "p95": self.latency.percentile(0.95),
+                        "p99": self.latency.percentile(0.99),
+                        "max": self.latency.max,
+                        "total": self.latency.total,
+                    },
+                },
+            }
+
+    def write_json(self, path: str) -> None:
+        """
+        The summary plus, with keep_requests, every request, so runs can be compared or plotted afterwards.
+        """
+        data = self.summary()
+        if self.keep_requests:
+            with self._lock:
+                data["request_log"] = [asdict(record) for record in self.requests]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as fh:
+            fh.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+    def table(self, title: str = "Scrape metrics") -> "Table":
+        from rich.table import Table
+
+        summary = self.summary()
+        requests = summary["requests"]
+        table = Table(title=f"{title} ({summary['wall_time']:.2f}s wall)")
+        table.add_column("Metric")
+        table.add_column("Value", justify="right")
+
+        for name, phase in sorted(summary["phases"].items(), key=lambda item: -item[1]["seconds"]):
+            table.add_row(f"{name} time", f"{phase['seconds']:.3f}s over {phase['count']} ({phase['mean'] * 1000:.1f}ms each)")
+        table.add_row("requests", f"{requests['total']} ({requests['network']} over the network)")
+        table.add_row("cache", ", ".join(f"{count} {outcome}" for outcome, count in requests["cache"].items() if count) or "-")
+        table.add_row("statuses", ", ".join(f"{count}x {status}" for status, count in sorted(requests["statuses"].items())) or "-")
+        table.add_row("retries", str(requests["retries"]))
+        table.add_row("errors", str(requests["errors"]))
+        table.add_row("downloaded", f"{requests['bytes'] / 1024:.1f} KiB ({requests['bytes_from_cache'] / 1024:.1f} KiB from cache)")
+        latency = requests["latency"]
+        table.add_row("latency p50/p95/p99/max", f"{latency['p50'] * 1000:.0f} / {latency['p95'] * 1000:.0f} / {latency['p99'] * 1000:.0f} / {latency['max'] * 1000:.0f} ms")
+        return table
+
+
+class Profiler:
+    """
+    Before 3.12 cProfile only sees the thread it was enabled on, so every worker thread profiles itself with `thread()`
+    and the profiles are merged at the end. From 3.12 cProfile is built on sys.monitoring, which covers every thread but
+    only allows one profiler at a time, so there is just the one started in `start()` and `thread()` does nothing.
+    tracemalloc covers every thread either way.
+    """
+    def __init__(self, top: int = 25) -> None:
+        self.top = top
+        self._lock = threading.Lock()
+        self._profiles: list[cProfile.Profile] = []
+        self._one_profile = sys.version_info >= (3, 12)
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        if self._one_profile:
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        if self._one_profile:
+            yield
+            return
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def stop(self, path_prefix: str) -> list[str]:
+        """
+        Writes <prefix>.prof (open it with pstats or snakeviz) and <prefix>.profile.txt with the top functions and the
+        biggest allocations, returns the paths written.
+        """
+        os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok=True)
+        report = io.StringIO()
+        written = []
+
+        if self._one_profile and self._profiles:
+            self._profiles[0].disable()
+        with self._lock:
+            profiles = [profile for profile in self._profiles if profile.getstats()]
+        if profiles:
+            stats = pstats.Stats(profiles[0], stream=report)
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path_prefix + ".prof")
+            written.append(path_prefix + ".prof")
+            report.write(f"cProfile ({len(profiles)} profiles merged), top {self.top} by cumulative time\n")
+            stats.sort_stats("cumulative").print_stats(self.top)
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            report.write(f"\ntracemalloc: {current / 1024 / 1024:.1f} MiB still allocated, {peak / 1024 / 1024:.1f} MiB peak\n")
+            for statistic in snapshot.statistics("lineno")[:self.top]:
+                report.write(f"{statistic}\n")
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+        with open(path_prefix + ".profile.txt", "w", encoding="utf-8") as fh:
+            fh.write(report.getvalue())
+        written.append(path_prefix + ".profile.txt")
+        return written
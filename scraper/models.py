@@ -2,7 +2,8 @@
 This module defines the data structures (TypedDicts) used across the scraping application
 to ensure a consistent format for course information.
 """
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from collections.abc import Iterable, Iterator, Sized
 
 class CourseData(BaseModel):
     """
@@ -26,4 +27,58 @@ class CourseList(BaseModel):
     """
     name: str
     course_code: str
-    url: str
\ No newline at end of file
+    url: str
+
+
+class SearchResults:
+    """
+    What BaseProvider.iter_search hands the engine, the courses one at a time plus, if the provider knows it, roughly how
+    many there will be for the progress bar. A provider can return one of these from its search methods to give an
+    estimate without building the whole list, i.e from a result count on the first page. It can only be iterated once.
+    """
+    def __init__(self, courses: Iterable[CourseList], estimated_total: int | None = None) -> None:
+        self._courses = courses
+        # A generator can update this while it is being iterated, the engine reads it again after every course
+        self.estimated_total = estimated_total
+
+    @classmethod
+    def of(cls, results: "Iterable[CourseList] | SearchResults") -> "SearchResults":
+        """
+        Wraps whatever a search method returned, a list's length is its exact total and a generator has no estimate.
+        """
+        if isinstance(results, SearchResults):
+            return results
+        return cls(results, len(results) if isinstance(results, Sized) else None)
+
+    def __iter__(self) -> Iterator[CourseList]:
+        return iter(self._courses)
+
+
+# Validating a whole list at once happens in one call into pydantic-core, a lot cheaper than building the models one by one.
+# ? model_construct looks like it should be cheaper still for data we already trust, but it runs in Python and is slower
+# ? than validating for models this small (see benchmarks/models.py), so there is no 'trusted' path that skips validation
+COURSE_LIST_PAGE = TypeAdapter(list[CourseList])
+COURSE_DATA_LIST = TypeAdapter(list[CourseData])
+
+
+def course_list_page(rows: list[dict]) -> list[CourseList]:
+    """
+    Turns one page of search results (dicts of name, course_code and url) into CourseList objects in one go.
+    """
+    return COURSE_LIST_PAGE.validate_python(rows)
+
+
+def course_data_list(records: list[dict]) -> list[CourseData]:
+    """
+    Turns records read back from disk (output files, the manifest, the index) into CourseData objects in one go.
+    """
+    return COURSE_DATA_LIST.validate_python(records)
+
+
+def record_fields(record: BaseModel) -> dict:
+    """
+    The fields of one of our models as a dict for orjson.dumps, without model_dump building a converted copy of it.
+    Every field of these models is a plain str so orjson can write them directly, the output is byte for byte the
+    same as orjson.dumps(record.model_dump()). The dict is the model's own, don't modify it.
+    """
+    return record.__dict__
@@ -0,0 +1,71 @@
+"""
+Helpers for the lxml fast path parsers. BeautifulSoup is easy to write parsers with but slow, these let a provider
+work on the raw lxml tree with precompiled XPath while producing exactly the same text BeautifulSoup would.
+"""
+from lxml import etree
+from collections.abc import Iterator
+
+# BeautifulSoup's get_text() leaves out the contents of these, so we have to as well
+SKIPPED_TEXT_TAGS = {"script", "style", "template"}
+
+def parse_html(html_content: str) -> etree._Element | None:
+    """
+    Parses a page into an lxml tree, None if there is nothing to parse (BeautifulSoup would give an empty document).
+    """
+    try:
+        return etree.HTML(html_content)
+    except ValueError:
+        # lxml refuses str input that has an encoding declaration in it, so give it bytes instead
+        return etree.HTML(html_content.encode("utf-8"), etree.HTMLParser(encoding="utf-8"))
+
+
+def select(xpath: etree.XPath, root: etree._Element | None) -> list[etree._Element]:
+    """
+    The elements a precompiled XPath finds, an XPath can also evaluate to strings, numbers or booleans but the
+    selectors the providers use only ever find elements. An empty list if there is no tree (see parse_html).
+    """
+    if root is None:
+        return []
+    result = xpath(root)
+    return [element for element in result if isinstance(element, etree._Element)] if isinstance(result, list) else []
+
+
+def has_class(class_name: str) -> str:
+    """
+    The XPath predicate equivalent of the CSS '.class_name' selector.
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+def _strings(element: etree._Element) -> Iterator[str]:
+    # Comments and processing instructions don't have a string tag, their text isn't part of the page text but their tail is
+    if not isinstance(element.tag, str) or element.tag in SKIPPED_TEXT_TAGS:
+        return
+    if element.text:
+        yield element.text
+    for child in element:
+        yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def text_content(element: etree._Element) -> str:
+    """
+    The same as BeautifulSoup's get_text(strip=True), every string stripped with the empty ones dropped and then joined together.
+    """
+    return "".join(stripped for string in _strings(element) if (stripped := string.strip()))
+
+
+def first_direct_string(element: etree._Element) -> str | None:
+    """
+    The same as BeautifulSoup's find(text=True, recursive=False), the first string that is a direct child of the element.
+    """
+    if element.text is not None:
+        return element.text
+    for child in element:
+        # BeautifulSoup counts comments as strings too
+        if child.tag is etree.Comment:
+            return child.text
+        if child.tail is not None:
+            return child.tail
+    return None
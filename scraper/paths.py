@@ -0,0 +1,6 @@
+# Central place for where things get written to disk, so every part of the scraper agrees on the layout of data/
+import os
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "data"))
+# Anything in here can be deleted at any time without losing scraped results
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
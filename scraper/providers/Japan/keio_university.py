@@ -1,26 +1,52 @@
 from scraper.providers.base_provider import BaseProvider
-from scraper.models import CourseList, CourseData
+from scraper.models import CourseList, CourseData, course_list_page
+from scraper.cache import ExpiringStore
+from scraper.paths import CACHE_DIR
+from scraper.parsing import parse_html, select, has_class, text_content
 from bs4 import BeautifulSoup
+from lxml import etree
 from bs4.builder import ParserRejectedMarkup
 from scraper.errors import ValidationError, CourseNotFoundError, ParseError, ScraperError
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, parse_qsl
 import orjson
+import os
 import re
 
 # ! In the HTML for the search page, the academic year selection menu has all the years it supports, this could be used for checking to make sure when a new year gets supported
 # * Test code is FST-ST-13501-211-43
 # * We can add language selection later for keyword search, need to figure out how to figure out if a provider supports multiple languages first
 
+# The values for SELECTED_TT_DWCD, results are split up by day so we have to ask for every one of them, 1-6 Mon-Sat and 9 for Others
+DAY_CODES = ("1", "2", "3", "4", "5", "6", "9")
+
+# The K-Number code tables only change when faculties/departments do, so keeping them for a month is plenty
+KNUMBER_TABLE_TTL = 30 * 24 * 60 * 60
+
+# How long a saved session is trusted for, the site doesn't say so this is kept well under the usual 30 minute idle timeout
+SESSION_TTL = 20 * 60
+
+# Precompiled versions of the parse_courses selectors for the lxml fast path
+SEMESTER_XPATH = etree.XPath("//th[contains(., 'Academic Year/Semester')]/following-sibling::*[1][self::td]")
+AIMS_XPATH = etree.XPath(f"//div[{has_class('syllabus-section')}]//div[{has_class('contents')}]")
+
 class KeioProvider(BaseProvider):
     university_name = "keio_university"
+    base_url = "https://gslbs.keio.jp/pub-syllabus/"
+    session_ttl = SESSION_TTL
+    academic_year = "2025"
+    # Format for the K-number (https://www.students.keio.ac.jp/en/com/class/registration/k-number.html), note that the subject type can include A-F letters, not in their official spec (example: https://gslbs.keio.jp/pub-syllabus/detail?ttblyr=2025&entno=18850&lang=en)
+    identifier_pattern = re.compile(r"^[A-Z]{3}-[A-Z]{2}-[0-9]{4}[1-4A-F9]-[1-79][1-4][1-29]-[0-9]{2}$")
 
-    def __init__(self) -> None:
+    def __init__(self, **kwargs) -> None:
         """
         Initializes the KeioProvider, this does not setup any networking stuff because sometimes (mainly testing) it is not needed.
         """
-        super().__init__()
-        self.base_url = "https://gslbs.keio.jp/pub-syllabus/"
+        super().__init__(**kwargs)
         # Set it to only accept json data for certain requests
         self.headers = {"Accept": "application/json, text/javascript, */*; q=0.01",}
+        # faculty -> course administrator code and (course administrator code, year) -> department tables for K-Number searches
+        self.knumber_tables = ExpiringStore(os.path.join(CACHE_DIR, f"{self.university_name}_knumber_tables.json"), ttl=KNUMBER_TABLE_TTL)
 
 
     def setup_provider(self) -> None:
@@ -28,8 +54,15 @@ class KeioProvider(BaseProvider):
         Sets up the session by getting initial cookies and setting the language to English.
         This is a separate method to make initialization lightweight and testing easier, this is provider specific.
         """
-        # This is just to get our 'auth' cookies
-        self._get(self.base_url + "search")
+        # This is just to get our 'auth' cookies, never from the cache since the whole point is the Set-Cookie
+        response = self._get(self.base_url + "search", cache=False)
+        # We have the search page anyway, so save the course administrator codes from it rather than asking for it again later
+        if self.knumber_tables.get("course_admin_codes") is None:
+            try:
+                self.knumber_tables.set("course_admin_codes", self._extract_course_admin_codes(response.text))
+            except ScraperError:
+                # Not worth failing setup over, K-Number searches will try again and report it properly
+                pass
 
         # We need to set the UI language to English to get cleaner 'subtitle' data
         lang_payload = {
@@ -42,40 +75,84 @@ class KeioProvider(BaseProvider):
         # Set the language to English
         self._post(self.base_url + "search", data=lang_payload)
 
-    # * This is imperfect, all we do is pull apart the knumber, we don't validate a course is actually associated with it, so we use error handling when requesting the course data later on
-    def _parse_knumber(self, knumber: str) -> dict[str, str]:
-        # Get the course administrator codes for the faculty/graduate school 
-        response = self._get(self.base_url + "search")
+    def session_rejected(self, method: str, response) -> bool:
+        """
+        Every POST we make (searches and the K-Number menus) gets JSON back, an expired session gets an HTML page instead.
+        """
+        return method.upper() == "POST" and response.content.lstrip()[:1] == b"<"
 
-        soup = BeautifulSoup(response.text, 'lxml')
+    def _extract_course_admin_codes(self, html_content: str) -> dict[str, str]:
+        """
+        Pulls the faculty -> course administrator code table out of the search page.
+        """
+        soup = BeautifulSoup(html_content, 'lxml')
         select_tag = soup.find('select', {"name": "KNUMBER_KNFNM"})
         if select_tag is None:
             # If the select element isn't present, raise an error
             raise ScraperError("Failed to find course administrator on the search page")
-        options = select_tag.find_all("option")
 
-        # 'Premature optimisation is the root of all evil' - johnhw, me turning a loop into a generator expression
-        course_admin_code = next((opt.get('value') for opt in options if opt.get('data-knfnm') == knumber[:3]), None)
+        return {str(opt.get('data-knfnm')): str(opt.get('value')) for opt in select_tag.find_all("option") if opt.get('data-knfnm')}
+
+    def _course_admin_codes(self) -> dict[str, str]:
+        """
+        The faculty (first 3 letters of a K-Number) -> course administrator code table, only fetched when it isn't already stored.
+        """
+        course_admin_codes = self.knumber_tables.get("course_admin_codes")
+        if course_admin_codes is None:
+            response = self._get(self.base_url + "search")
+            course_admin_codes = self._extract_course_admin_codes(response.text)
+            self.knumber_tables.set("course_admin_codes", course_admin_codes)
+        return course_admin_codes
+
+    def _department_options(self, course_admin_code: str, year: str) -> list[list[str]]:
+        """
+        Every [department name, department code] pair in the Department/Major menu for a course administrator in a given year.
+        """
+        table_key = f"department_options:{course_admin_code}:{year}"
+        department_options = self.knumber_tables.get(table_key)
+        if department_options is not None:
+            return department_options
 
         # Department/Major List to cross reference their number for the actual query
         major_list_payload = {
             "URL_TYPE_PNM_nZ9CpQJc": "general",
             "ACTION_ID": "SYLLABUS_SEARCH_KNUMBER_CHANGE_ITEM",
             "CHANGE_TARGET_SRC": "KNUMBER_KNFNM",
-            "KNUMBER_TTBLYR": "2025",
+            "KNUMBER_TTBLYR": year,
             "KNUMBER_KNFNM": course_admin_code,
             "KNUMBER_KNDEPNM": "",
             "KNUMBER_KNMJRCLSCD": ""
         }
 
         # For some reason this request has a msgType of 'error'?? Don't worry if this is present, for some reason it is set to this quite consistently throughout various requests, it'd be more worrying for it to be success at this point.
-        _response = self._post(self.base_url + "search", data=major_list_payload, headers=self.headers)
-        dictionary_repsonse = orjson.loads(_response.text)
-        major_list = dictionary_repsonse['changeTargetRs']['KNUMBER_KNDEPNM_ITEM']
+        _response = self._post(self.base_url + "search", data=major_list_payload, headers=self.headers, cache=True)
+        try:
+            dictionary_repsonse = orjson.loads(_response.text)
+            major_list = dictionary_repsonse['changeTargetRs']['KNUMBER_KNDEPNM_ITEM']
+        except (orjson.JSONDecodeError, KeyError, TypeError) as error:
+            raise ParseError(f"Failed to parse the department list for course administrator '{course_admin_code}'.") from error
 
-        for i in range(len(major_list)):
-            if major_list[i]['name'][0:2] == knumber[4:6]:
-                department = major_list[i]['value']
+        department_options = [[str(major['name']), str(major['value'])] for major in major_list]
+        self.knumber_tables.set(table_key, department_options)
+        return department_options
+
+    def _departments(self, course_admin_code: str, year: str) -> dict[str, str]:
+        """
+        The department (2 letters of a K-Number) -> department code table for a course administrator in a given year.
+        """
+        # If two departments share the same first two characters the last one wins, same as the old lookup did
+        return {name[0:2]: value for name, value in self._department_options(course_admin_code, year)}
+
+    # * This is imperfect, all we do is pull apart the knumber, we don't validate a course is actually associated with it, so we use error handling when requesting the course data later on
+    def _parse_knumber(self, knumber: str) -> dict[str, str]:
+        # Get the course administrator codes for the faculty/graduate school, after the first lookup these come from the stored tables without any requests
+        course_admin_code = self._course_admin_codes().get(knumber[:3])
+        if course_admin_code is None:
+            raise ValidationError(f"The K-Number '{knumber}' has an unknown faculty code '{knumber[:3]}'.")
+
+        department = self._departments(course_admin_code, self.academic_year).get(knumber[4:6])
+        if department is None:
+            raise ValidationError(f"The K-Number '{knumber}' has an unknown department code '{knumber[4:6]}'.")
 
         # Slice out the relevant parts of the knumber, already verified against the regex
         course_level = knumber[7]
@@ -103,13 +180,56 @@ class KeioProvider(BaseProvider):
         return parsed_knumber
 
 
+    def _search_day(self, search_payload: dict, day_code: str, search_description: str) -> list[dict]:
+        """
+        Runs the search for a single day of the week and returns the raw course entries.
+        """
+        # Every day gets its own copy of the payload since the days are searched at the same time
+        day_payload = {**search_payload, "SELECTED_TT_DWCD": day_code}
+        # The payload fully describes the search so it is safe to cache
+        _response = self._post(self.base_url + "result", data=day_payload, headers=self.headers, cache=True)
+
+        try:
+            dictionary_response = orjson.loads(_response.text)
+        except orjson.JSONDecodeError as error:
+            raise ParseError(f"Failed to parse JSON response when searching for {search_description}.") from error
+
+        return [course_entry for course_data_entry in dictionary_response['searchResultDs'] for course_entry in course_data_entry['sbjtDs']]
+
+    def _search_all_days(self, search_payload: dict, search_description: str) -> list[CourseList]:
+        """
+        Searches every day of the week at once and merges the results in day order.
+        A course held on several days shows up once per day, so they are deduplicated here rather than being fetched several times later on.
+        """
+        rows : list[dict] = []
+        seen : set[tuple[str, str]] = set()
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(DAY_CODES)), thread_name_prefix=f"{self.university_name}-search") as executor:
+            # map keeps the results in the same order as DAY_CODES so the output order is stable between runs
+            day_results = executor.map(lambda day_code: self._search_day(search_payload, day_code, search_description), DAY_CODES)
+
+            for course_entries in day_results:
+                for course_entry in course_entries:
+                    key = (str(course_entry['KNUMBER']), str(course_entry['SYLLABUS_DETAIL_URL']))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    rows.append({
+                        # This is a better alterantive than 'SUBTITLE' as 'SUBTITLE' sometimes doesn't exist and most of the time contains Japanese
+                        "name": str(course_entry['SBJTNM']),
+                        "course_code": key[0],
+                        "url": key[1]
+                    })
+
+        # Validated as one list rather than one CourseList at a time, a full faculty can be thousands of rows
+        return course_list_page(rows)
+
     def search_by_keyword(self, keyword: str) -> list[CourseList]:
-        course_list : list[CourseList]= []
         keyword_search_payload = {
         "URL_TYPE_PNM_nZ9CpQJc": "general",
         "ACTION_ID": "SYLLABUS_SEARCH_RESULT",
         "SUB_ACTION_ID": "SYLLABUS_SEARCH_KEYWORD_EXECUTE",
-        "KEYWORD_TTBLYR": "2025",
+        "KEYWORD_TTBLYR": self.academic_year,
         "KEYWORD_SMSCD": "ALL", # Semester number, 5 for Fall and 3 for Spring, ALL for both
         "KEYWORD_HALFSEMESTER": "ALL", # Whether it's the first half or second half of the semester, ALL for both
         "KEYWORD_KBS_SMSCD": "ALL",
@@ -137,37 +257,14 @@ class KeioProvider(BaseProvider):
         "SELECTED_TT_DWCD": "1" # The day selected, 1-6 Mon-Sat, 9 for Others
         }
         
-        for i in range(1,7):
-            keyword_search_payload["SELECTED_TT_DWCD"] = str(i)
-            # We want to also search the 'Others' category
-            if i == 7:
-                keyword_search_payload["SELECTED_TT_DWCD"] = str(9)
-            _response = self._post(self.base_url + "result", data=keyword_search_payload, headers=self.headers)
-
-            try:
-                dictionary_response = orjson.loads(_response.text)
-            except orjson.JSONDecodeError as error:
-                raise ParseError(f"Failed to parse JSON response when searching for keyword '{keyword}'.") from error
-
-            for course_data_entry in dictionary_response['searchResultDs']:
-                for course_entry in course_data_entry['sbjtDs']:
-                    course_list.append(CourseList(
-                        # This is a better alterantive than 'SUBTITLE' as 'SUBTITLE' sometimes doesn't exist and most of the time contains Japanese
-                        name=str(course_entry['SBJTNM']),
-                        course_code=str(course_entry['KNUMBER']),
-                        url=str(course_entry['SYLLABUS_DETAIL_URL'])
-                    ))
+        course_list = self._search_all_days(keyword_search_payload, f"keyword '{keyword}'")
 
         if not course_list:
             raise CourseNotFoundError(f"No course found for the keyword '{keyword}'.")
         return course_list
 
     def search_by_identifier(self, identifier: str) -> list[CourseList]:
-        course_list : list[CourseList]= []
-        
-        # Format for the K-number (https://www.students.keio.ac.jp/en/com/class/registration/k-number.html), note that the subject type can include A-F letters, not in their official spec (example: https://gslbs.keio.jp/pub-syllabus/detail?ttblyr=2025&entno=18850&lang=en)
-        pattern = re.compile(r"^[A-Z]{3}-[A-Z]{2}-[0-9]{4}[1-4A-F9]-[1-79][1-4][1-29]-[0-9]{2}$")
-        if not pattern.match(identifier.strip()):
+        if not self.is_identifier(identifier):
             raise ValidationError(f"The K-Number '{identifier}' is not valid. Enter a valid K-Number in the format 'XXX-XX-XXXXX-XXX-XX'.")
 
         parsed_knumber = self._parse_knumber(identifier)
@@ -176,7 +273,7 @@ class KeioProvider(BaseProvider):
             "URL_TYPE_PNM_nZ9CpQJc": "general",
             "ACTION_ID": "SYLLABUS_SEARCH_RESULT",
             "SUB_ACTION_ID": "SYLLABUS_SEARCH_KNUMBER_EXECUTE",
-            "KNUMBER_TTBLYR": "2025",
+            "KNUMBER_TTBLYR": self.academic_year,
             "KNUMBER_KNFNM": parsed_knumber["course_admin_code"],
             "KNUMBER_KNDEPNM": parsed_knumber["department"],
             "KNUMBER_KNLVLCD": parsed_knumber["course_level"],
@@ -191,44 +288,84 @@ class KeioProvider(BaseProvider):
             "SELECTED_TT_DWCD": "1" # The day selected, 1-6 Mon-Sat, 9 for Others
         }
 
-        for i in range(1,7):
-            identifier_search_payload["SELECTED_TT_DWCD"] = str(i)
-            # We want to also search the 'Others' category which is the 9 code
-            if i == 7:
-                identifier_search_payload["SELECTED_TT_DWCD"] = str(9)
-            _response = self._post(self.base_url + "result", data=identifier_search_payload, headers=self.headers)
-            try:
-                dictionary_response = orjson.loads(_response.text)
-            except orjson.JSONDecodeError as error:
-                raise ParseError(f"Failed to parse JSON response when searching for K-Number '{identifier}'.") from error
-            
-            for course_data_entry in dictionary_response['searchResultDs']:
-                for course_entry in course_data_entry['sbjtDs']:
-                    course_list.append(CourseList(
-                        # This is a better alterantive than 'SUBTITLE' as 'SUBTITLE' sometimes doesn't exist and most of the time contains Japanese
-                        name=str(course_entry['SBJTNM']),
-                        course_code=str(course_entry['KNUMBER']),
-                        url=str(course_entry['SYLLABUS_DETAIL_URL'])
-                    ))
+        course_list = self._search_all_days(identifier_search_payload, f"K-Number '{identifier}'")
 
         if not course_list:
             raise CourseNotFoundError(f"No course found for the K-Number '{identifier}'.")
         
         return course_list
 
-    def fetch_course_details(self, course_info: CourseList) -> CourseData:
+    def list_shards(self) -> dict[str, str]:
+        """
+        Every faculty x department in the K-Number search menus, each one is searched as its own shard.
+        """
+        shards: dict[str, str] = {}
+        for faculty, course_admin_code in self._course_admin_codes().items():
+            for department_name, department_code in self._department_options(course_admin_code, self.academic_year):
+                # Faculties can share a course administrator code, the key makes sure its departments are only searched once
+                shards.setdefault(urlencode({"KNFNM": course_admin_code, "KNDEPNM": department_code}), f"{faculty} {department_name}")
+        return shards
+
+    def search_shard(self, shard: str) -> list[CourseList]:
+        parameters = dict(parse_qsl(shard))
+        # The same search as search_by_identifier but with only the faculty and department filled in, the rest of the K-Number is left as 'any'
+        shard_search_payload = {
+            "URL_TYPE_PNM_nZ9CpQJc": "general",
+            "ACTION_ID": "SYLLABUS_SEARCH_RESULT",
+            "SUB_ACTION_ID": "SYLLABUS_SEARCH_KNUMBER_EXECUTE",
+            "KNUMBER_TTBLYR": self.academic_year,
+            "KNUMBER_KNFNM": parameters["KNFNM"],
+            "KNUMBER_KNDEPNM": parameters["KNDEPNM"],
+            "KNUMBER_KNLVLCD": "",
+            "KNUMBER_KNMJRCLSCD": "",
+            "KNUMBER_KNMNRCLSCD": "",
+            "KNUMBER_KNSBJTTPCD": "",
+            "KNUMBER_KNLESSONCATCD": "",
+            "KNUMBER_KNLESSONMODECD": "",
+            "KNUMBER_KNLESSONLANGCD": "",
+            "KNUMBER_KNSDYAREACD": "",
+            "NARABIJUN": "1", # Display order, not really relevant here
+            "SELECTED_TT_DWCD": "1" # The day selected, 1-6 Mon-Sat, 9 for Others
+        }
+        # An empty department is fine here, the crawl just moves on to the next shard
+        return self._search_all_days(shard_search_payload, f"shard '{shard}'")
+
+    def fetch_course_html(self, course_info: CourseList) -> str:
         """
-        Fetches the specific course webpage and download its html, calls the 'parse_courses' method and
-        returns a CourseData object given by the parse_courses funciton
+        Fetches the specific course webpage and returns its html, parsing is left to the 'parse_courses' method
         """
         response = self._get(self.base_url + course_info.url)
-        parsed_data = self.parse_courses(response.text, course_info)
-        return parsed_data
+        return response.text
     
     def parse_courses(self, html_content: str, course_info: CourseList) -> CourseData:
         """
         Parses the html content of a course page and returns a CourseData object.
         """
+        if self.fast_parse:
+            return self._parse_courses_lxml(html_content, course_info)
+        return self._parse_courses_soup(html_content, course_info)
+
+    def _parse_courses_lxml(self, html_content: str, course_info: CourseList) -> CourseData:
+        """
+        The lxml fast path of parse_courses, has to produce exactly the same output as _parse_courses_soup.
+        """
+        root = parse_html(html_content)
+
+        semester_td = select(SEMESTER_XPATH, root)
+        semester = text_content(semester_td[0]) if semester_td else "N/A"
+
+        aims_div = select(AIMS_XPATH, root)
+        aims = text_content(aims_div[0]) if aims_div else ""
+
+        return CourseData(
+            name=course_info.name,
+            course_code=course_info.course_code,
+            semester=semester,
+            aims=aims,
+            ilos=aims
+        )
+
+    def _parse_courses_soup(self, html_content: str, course_info: CourseList) -> CourseData:
         try:
             soup = BeautifulSoup(html_content, 'lxml')
         # This should never happen, but just in case lxml fails for some reason
@@ -1,29 +1,46 @@
 from scraper.providers.base_provider import BaseProvider
-from scraper.models import CourseList, CourseData
-from scraper.errors import ValidationError, CourseNotFoundError
+from scraper.models import CourseList, CourseData, course_list_page
+from scraper.errors import ValidationError, CourseNotFoundError, ParseError
+from scraper.parsing import parse_html, select, text_content, first_direct_string
 from bs4 import BeautifulSoup
 from bs4.builder import ParserRejectedMarkup
+from lxml import etree
+from collections.abc import Iterator
+from urllib.parse import urljoin, urlencode, parse_qsl, quote_plus
 import re
 
+# Precompiled versions of the parse_courses selectors for the lxml fast path
+SEMESTER_XPATH = etree.XPath("//li[contains(., 'Typically Offered:')]")
+AIMS_XPATH = etree.XPath("//h3[contains(., 'Course Aims')]/following-sibling::*[1][self::div]")
+ILOS_XPATH = etree.XPath("//h3[contains(., 'Intended Learning Outcomes of Course')]/following-sibling::*[1][self::div]")
+
 # * Needs to be full name as we also have Glasgow Caledonian University
 class UniversityOfGlasgowProvider(BaseProvider):
     university_name = "university_of_glasgow"
-    def __init__(self) -> None:
+    base_url = "https://www.gla.ac.uk/coursecatalogue/"
+    # There isn't really a specific regex pattern we can use so we use a more general one
+    identifier_pattern = re.compile(r"^[A-Za-z]{4,7}[0-9]{4}$")
+
+    def __init__(self, **kwargs) -> None:
         """
         Initializes the University of Glasgow provider.
         """
-        super().__init__()
-        self.base_url = "https://www.gla.ac.uk/coursecatalogue/"
+        super().__init__(**kwargs)
 
-    def search_by_keyword(self, keyword: str) -> list[CourseList]:
-        course_list : list[CourseList]= []
+    def _search_pages(self, keyword: str = "", school: str = "", subject: str = "") -> Iterator[CourseList]:
+        """
+        Yields courses page by page as they are found, so the engine can fetch details while we are still paging through the results.
+        """
         page = 1
         # d = REG code for the school the course belongs to, s = subject area, l = course level, c = course credits, wt = 'typically offered' (sem 1, sem 2, etc), HIDDEN PARAMETER v = visiting student courses (true/false) and HIDDEN PARAMETER c4l = cirriculum for life (true/false)
-        response = self._get(self.base_url + f"searchresults?q={keyword}&d=&s=&l=&c=&wt=&_search=Search")
+        # ! The next pages only carry the page number, the query itself lives in the server side session, so none of the search pages
+        # ! can come from the cache, otherwise the session never learns about the query and the next pages belong to some other search
+        response = self._get(self.base_url + f"searchresults?q={keyword}&d={quote_plus(school)}&s={quote_plus(subject)}&l=&c=&wt=&_search=Search", cache=False)
         soup = BeautifulSoup(response.text, 'lxml')
         while True:
             maincontent_div = soup.find_all('div', class_='catSearchResult')
 
+            rows = []
             for course in maincontent_div:
                 course_name_link = course.select_one('a')
                 course_name = course_name_link.getText(strip=True) if course_name_link else "N/A"
@@ -31,16 +48,15 @@ class UniversityOfGlasgowProvider(BaseProvider):
                 raw_href = course_name_link.get('href') if course_name_link else None
                 course_url = str(raw_href) if raw_href is not None else "N/A"
 
-                course_code = course.find(text=True, recursive=False)
-                course_code = str(course_code) if course_code is not None else "N/A"
-                course_code = course_code.strip()
+                course_code_string = course.find(text=True, recursive=False)
+                course_code = str(course_code_string).strip() if course_code_string is not None else "N/A"
                 
                 # print(course_name, course_url, course_code_str)
-                course_list.append(CourseList(
-                    name=course_name,
-                    course_code=course_code,
-                    url=course_url
-                ))
+                rows.append({"name": course_name, "course_code": course_code, "url": course_url})
+
+            # The whole page is validated at once, the engine still gets it as soon as the page has been read
+            if rows:
+                yield from course_list_page(rows)
 
             # check for a 'Next' navigation link to continue paging
             nav_link = soup.find('a', class_='catSearchNavLink')
@@ -48,28 +64,85 @@ class UniversityOfGlasgowProvider(BaseProvider):
                 break
 
             page += 1
-            response = self._get(self.base_url + f"searchresults/?p={page}")
+            response = self._get(self.base_url + f"searchresults/?p={page}", cache=False)
             soup = BeautifulSoup(response.text, 'lxml')
-        if not course_list:
+
+    def search_by_keyword(self, keyword: str) -> Iterator[CourseList]:
+        found_any = False
+        for course in self._search_pages(keyword=keyword):
+            found_any = True
+            yield course
+        if not found_any:
             # We can't be specific about whether its name or code not found here since we use the same function for both
             raise CourseNotFoundError(f"No course found for '{keyword}'.")
-        return course_list
 
-    def search_by_identifier(self, identifier: str) -> list[CourseList]:
-        # There isn't really a specific regex pattern we can use so we use a more general one
-        pattern = re.compile(r"^[A-Za-z]{4,7}[0-9]{4}$")
-        if not pattern.match(identifier.strip()):
+    def list_shards(self) -> dict[str, str]:
+        """
+        Every school (d=) and every subject (s=) in the search form's filters. A course turns up under both its school
+        and its subject, the crawl only scrapes it once, but between them nothing that is only listed under one is missed.
+        """
+        response = self._get(self.base_url)
+        soup = BeautifulSoup(response.text, 'lxml')
+        shards: dict[str, str] = {}
+        for parameter, kind in (("d", "School"), ("s", "Subject")):
+            select_tag = soup.find('select', {"name": parameter})
+            if select_tag is None:
+                continue
+            for option in select_tag.find_all("option"):
+                value = str(option.get('value') or "").strip()
+                # The first option of each is the empty 'any' choice
+                if value:
+                    shards[urlencode({parameter: value})] = f"{kind}: {option.get_text(strip=True)}"
+        if not shards:
+            raise ParseError("Failed to find the school and subject filters on the search page")
+        return shards
+
+    def search_shard(self, shard: str) -> Iterator[CourseList]:
+        parameters = dict(parse_qsl(shard))
+        return self._search_pages(school=parameters.get("d", ""), subject=parameters.get("s", ""))
+
+    def search_by_identifier(self, identifier: str) -> Iterator[CourseList]:
+        if not self.is_identifier(identifier):
             raise ValidationError(f"The course code '{identifier}' is not valid. Enter a valid Course Code in the format 'CXXXX9999'.")
         # Just reuse the keyword search as the search function works for both name and code
-        course_list = self.search_by_keyword(identifier)
-        return course_list
+        # This isn't a generator itself so the validation above still happens as soon as it is called
+        return self.search_by_keyword(identifier)
 
-    def fetch_course_details(self, course_info: CourseList) -> CourseData:
-        response = self._get("https://www.gla.ac.uk" + course_info.url)
-        parsed_data = self.parse_courses(response.text, course_info)
-        return parsed_data
+    def fetch_course_html(self, course_info: CourseList) -> str:
+        # The course urls are absolute paths (/coursecatalogue/course/?code=...), so only the host is taken from base_url
+        response = self._get(urljoin(self.base_url, course_info.url))
+        return response.text
     
     def parse_courses(self, html_content: str, course_info: CourseList) -> CourseData:
+        if self.fast_parse:
+            return self._parse_courses_lxml(html_content, course_info)
+        return self._parse_courses_soup(html_content, course_info)
+
+    def _parse_courses_lxml(self, html_content: str, course_info: CourseList) -> CourseData:
+        """
+        The lxml fast path of parse_courses, has to produce exactly the same output as _parse_courses_soup.
+        """
+        root = parse_html(html_content)
+
+        semester_li = select(SEMESTER_XPATH, root)
+        semester = first_direct_string(semester_li[0]) if semester_li else "N/A"
+        semester = str(semester).strip()
+
+        aims_div = select(AIMS_XPATH, root)
+        aims = text_content(aims_div[0]) if aims_div else "N/A"
+
+        ilos = select(ILOS_XPATH, root)
+        ilo_text = text_content(ilos[0]) if ilos else "N/A"
+
+        return CourseData(
+            name=course_info.name,
+            course_code=course_info.course_code,
+            semester=semester,
+            aims=aims,
+            ilos=ilo_text
+        )
+
+    def _parse_courses_soup(self, html_content: str, course_info: CourseList) -> CourseData:
         try:
             soup = BeautifulSoup(html_content, 'lxml')
         except ParserRejectedMarkup:
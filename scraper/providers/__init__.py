@@ -1,40 +1,185 @@
-import pkgutil
+import ast
 import importlib
-import inspect
-from .base_provider import BaseProvider
+import json
+import os
+from collections.abc import Iterator, Mapping
+from typing import TYPE_CHECKING
+from scraper.paths import CACHE_DIR
 
-# This dictionary will hold the map: 'keio_university' -> KeioProvider class
-PROVIDER_REGISTRY = {}
+if TYPE_CHECKING:
+    from .base_provider import BaseProvider
 
-def _register_providers() -> None:
+# Listing the providers used to import every one of them (and so bs4, lxml, requests and pydantic) before the first
+# prompt could even show. Now the provider files are only read, not imported, the classes are found with ast and
+# the result is cached in a manifest of 'keio_university' -> ('scraper.providers.Japan.keio_university', 'KeioProvider').
+# A provider's module is only imported once its class is actually asked for.
+MANIFEST_PATH = os.path.join(CACHE_DIR, "provider_manifest.json")
+# Bump this if what goes into the manifest changes, old manifests are then rebuilt instead of trusted
+MANIFEST_VERSION = 1
+
+PACKAGE_DIR = os.path.dirname(__file__)
+# Not provider modules, never scanned
+SKIP_MODULES = {"__init__", "base_provider"}
+
+
+def _module_files() -> dict[str, tuple[str, int]]:
+    """
+    Every provider module under this package as module name -> (file path, mtime in ns).
+    """
+    files: dict[str, tuple[str, int]] = {}
+    for directory, subdirectories, filenames in os.walk(PACKAGE_DIR):
+        subdirectories[:] = [name for name in subdirectories if not name.startswith((".", "__"))]
+        relative = os.path.relpath(directory, PACKAGE_DIR)
+        package = __name__ if relative == "." else __name__ + "." + relative.replace(os.sep, ".")
+        for filename in filenames:
+            module, extension = os.path.splitext(filename)
+            if extension != ".py" or module in SKIP_MODULES:
+                continue
+            path = os.path.join(directory, filename)
+            files[f"{package}.{module}"] = (path, os.stat(path).st_mtime_ns)
+    return files
+
+
+def _scan_module(path: str) -> list[tuple[str, str]]:
+    """
+    Finds every provider class defined in a module without importing it, returns (university_name, class name) pairs.
+    A provider is any class with a base class and a plain string university_name, the same thing BaseProvider.__init_subclass__ insists on.
+    """
+    with open(path, "rb") as fh:
+        tree = ast.parse(fh.read(), filename=path)
+
+    providers = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef) or not node.bases:
+            continue
+        for statement in node.body:
+            if isinstance(statement, ast.Assign):
+                targets, value = statement.targets, statement.value
+            elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+                targets, value = [statement.target], statement.value
+            else:
+                continue
+            if any(isinstance(target, ast.Name) and target.id == "university_name" for target in targets):
+                if isinstance(value, ast.Constant) and isinstance(value.value, str) and value.value:
+                    providers.append((value.value, node.name))
+                break
+    return providers
+
+
+def _load_manifest() -> dict:
+    # Plain json rather than orjson, importing orjson alone takes longer than reading this file does
+    try:
+        with open(MANIFEST_PATH, "rb") as fh:
+            manifest = json.loads(fh.read())
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def _save_manifest(manifest: dict) -> None:
+    # The manifest is only a cache, failing to write it (i.e a read only install) just means scanning again next time
+    try:
+        os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+        temporary_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, indent=2)
+        os.replace(temporary_path, MANIFEST_PATH)
+    except OSError:
+        pass
+
+
+def build_manifest() -> dict[str, tuple[str, str]]:
     """
-    Scans the current directory for modules, imports them,
-    and looks for classes that inherit from BaseProvider.
+    university_name -> (module, class name) for every provider. Only modules that were added or changed since the
+    cached manifest was written get parsed again, so normally this is one stat per provider file and no imports at all.
     """
-    # Look at the current folder (where this __init__.py is)
-    package_path = __path__
-    prefix = __name__ + "."
+    files = _module_files()
+    cached = _load_manifest()
+    cached_modules: dict = cached.get("modules", {})
+
+    modules: dict[str, dict] = {}
+    changed = set(cached_modules) != set(files)
+    for module, (path, mtime) in files.items():
+        entry = cached_modules.get(module)
+        if entry is None or entry["mtime"] != mtime:
+            try:
+                module_providers = _scan_module(path)
+            except (OSError, SyntaxError, ValueError) as e:
+                print(f"Could not scan provider module {module}: {e}")
+                module_providers = []
+            entry = {"mtime": mtime, "providers": module_providers}
+            changed = True
+        modules[module] = entry
+
+    if changed:
+        _save_manifest({"version": MANIFEST_VERSION, "modules": modules})
+
+    providers: dict[str, tuple[str, str]] = {}
+    for module, entry in sorted(modules.items()):
+        for university_name, class_name in entry["providers"]:
+            providers[university_name] = (module, class_name)
+    return providers
+
+
+class ProviderRegistry(Mapping):
+    """
+    Behaves like the old dict of 'keio_university' -> KeioProvider class, but the keys come from the manifest and
+    a provider's module is only imported the first time its class is looked up.
+    """
+    def __init__(self) -> None:
+        self._manifest: dict[str, tuple[str, str]] | None = None
+        self._classes: dict[str, "type[BaseProvider]"] = {}
+
+    @property
+    def manifest(self) -> dict[str, tuple[str, str]]:
+        if self._manifest is None:
+            self._manifest = build_manifest()
+        return self._manifest
+
+    def _names(self) -> list[str]:
+        return list(self.manifest) + [name for name in self._classes if name not in self.manifest]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names())
+
+    def __len__(self) -> int:
+        return len(self._names())
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._classes or name in self.manifest
+
+    def __getitem__(self, name: str) -> "type[BaseProvider]":
+        if name in self._classes:
+            return self._classes[name]
+        module_name, class_name = self.manifest[name]
+        from .base_provider import BaseProvider
+
+        provider_class = getattr(importlib.import_module(module_name), class_name, None)
+        # The scan only looks at the source, make sure what was imported really is the provider it said it was
+        if not (isinstance(provider_class, type) and issubclass(provider_class, BaseProvider) and provider_class.university_name == name):
+            raise KeyError(name)
+        self._classes[name] = provider_class
+        return provider_class
+
+    def register(self, provider_class: "type[BaseProvider]") -> None:
+        """
+        Adds a provider that doesn't live under this package, i.e one defined by a script.
+        """
+        self._classes[str(provider_class.university_name)] = provider_class
 
-    # Iterate over all files in this folder
-    for _, name, _ in pkgutil.walk_packages(package_path, prefix):
-        try:
-            # Dynamically import the module (e.g., scraper.providers.Japan.KeioProvider)
-            module = importlib.import_module(name)
+    def refresh(self) -> None:
+        self._manifest = None
 
-            # Scan the module for classes
-            for attribute_name, attribute_value in inspect.getmembers(module):
-                # Check if it is a class, inherits from BaseProvider, and is not BaseProvider itself
-                if (inspect.isclass(attribute_value) and issubclass(attribute_value, BaseProvider) and attribute_value is not BaseProvider):
-                    code = attribute_value.university_name
-                    if code:
-                        PROVIDER_REGISTRY[code] = attribute_value
-                        
-        except Exception as e:
-            print(f"Could not load provider from {name}: {e}")
 
-# As soon as we import the providers module, being registering the providers
-_register_providers()
+# This used to be filled by importing every provider module, now it only reads the manifest when first used
+PROVIDER_REGISTRY = ProviderRegistry()
 
 # For use in GUI/user interface later
-def get_provider_class(uni_code: str) -> type[BaseProvider] | None:
-    return PROVIDER_REGISTRY.get(uni_code)
\ No newline at end of file
+def get_provider_class(uni_code: str) -> "type[BaseProvider] | None":
+    try:
+        return PROVIDER_REGISTRY[uni_code]
+    except KeyError:
+        return None
+    except Exception as e:
+        print(f"Could not load provider {uni_code}: {e}")
+        return None
@@ -1,8 +1,19 @@
-from scraper.models import CourseData, CourseList
-from scraper.errors import NetworkError, HTTPStatusError
+from scraper.models import CourseData, CourseList, SearchResults
+from scraper.errors import NetworkError, HTTPStatusError, RetryableError, DeadlineExceededError, SessionRejectedError
+from scraper.cache import ResponseCache, CachedResponse, CACHEABLE_STATUS_CODES
+from scraper.metrics import Metrics, RequestRecord
+from scraper.singleflight import SingleFlight
+from scraper.sessions import SessionStore, load_cookies
+from scraper.ratelimit import HostLimiter, get_limiter, retries_deferred, backoff_delay, parse_retry_after, THROTTLE_STATUS_CODES
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
 import requests
 from requests.adapters import HTTPAdapter, Retry
+from urllib.parse import urlsplit
+import orjson
+import re
+import threading
+import time
 class BaseProvider(ABC):
     """
         All university's !! MUST !! follow this 'standard'
@@ -19,21 +30,106 @@ class BaseProvider(ABC):
     """
     university_name: str | None = None
 
-    def __init__(self) -> None:
-        # Make sure to set up exponential backoff to prevent banging services, requests_cache does not work for some reason 
-        # So we would need to do it ourselves
-        # Stolen from https://substack.thewebscraping.club/p/rate-limit-scraping-exponential-backoff
+    """
+        Where the university's site lives, every URL the provider requests is built from this.
+        It can be overridden per instance (base_url=...) to point the provider somewhere else,
+        i.e the local replay server the throughput benchmark runs against (benchmarks/replay_server.py)
+    """
+    base_url: str = ""
+
+    """
+        The maximum number of requests this provider is allowed to have in flight at once,
+        the engine uses this to size its worker pool so be nice to smaller university sites
+    """
+    max_concurrency: int = 4
+
+    """
+        Names of any cookies that change what the site sends back, their values become part of the cache key
+        so a cached response from one session state is never replayed into another
+    """
+    cache_vary_cookies: tuple[str, ...] = ()
+
+    """
+        The version of this provider's parse_courses, bump it whenever the parser changes what it outputs
+        so incremental runs know to parse the stored HTML again instead of trusting the old records
+    """
+    parse_version: int = 1
+
+    """
+        The academic year this provider's courses are for, the course store keys on it so the same course code
+        from different years is kept apart. Leave as None to use the current calendar year
+    """
+    academic_year: str | None = None
+
+    """
+        The most requests per second this provider may send to its site, the rate limiter starts below this and only
+        works its way up while the site keeps answering quickly (see scraper/ratelimit.py)
+    """
+    max_requests_per_second: float = 5.0
+
+    """
+        How many times a request that failed with a 429, a 5xx or a timeout is tried again before giving up
+    """
+    max_retries: int = 5
+
+    """
+        How long (in seconds) the session setup_provider sets up stays usable, with a SessionStore it is saved and reused
+        by later runs and other workers for this long instead of running the setup again (see scraper/sessions.py).
+        0 for providers whose session isn't worth keeping, or that hold per search state in it
+    """
+    session_ttl: float = 0
+
+    """
+        What this provider's course identifiers look like, search_by_identifier rejects anything that doesn't match and
+        is_identifier uses it to tell a course code from a keyword. None if there is no fixed format
+    """
+    identifier_pattern: re.Pattern[str] | None = None
+
+    def __init__(self, *, max_concurrency: int | None = None, cache: ResponseCache | None = None, fast_parse: bool = False, base_url: str | None = None, sessions: SessionStore | None = None) -> None:
+        if base_url is not None:
+            self.base_url = base_url
+        if max_concurrency is not None:
+            if max_concurrency < 1:
+                raise ValueError("max_concurrency must be at least 1")
+            self.max_concurrency = max_concurrency
+        # Use the lxml fast path in parse_courses instead of BeautifulSoup, both produce identical CourseData (see benchmarks/parsers.py)
+        self.fast_parse = fast_parse
+
+        # requests_cache does not work for some reason so we have our own cache in scraper/cache.py, it is optional so tests and one off runs can skip it
+        # ! Backing off on 429/5xx used to be urllib3's job, but it slept inside the worker for up to a minute without
+        # knowing about any of the other requests to the same site. That is now the rate limiter's job (see _request),
+        # urllib3 only quickly retries connections that never got anywhere
         retry_strategy = Retry(
-            total=5,                        # Total number of retries
-            backoff_factor=2,               # Base delay factor (seconds)
-            status_forcelist=[429, 500, 502, 503, 504],  # HTTP status codes to retry on
-            backoff_jitter=0.5 # Add a random jitter of no more than 500ms
+            total=2,
+            connect=2,
+            read=0,
+            status=0,
+            backoff_factor=0.1,
+            # Hand every 429/5xx (Retry-After and all) back to us instead of urllib3 retrying or raising on it
+            respect_retry_after_header=False,
+            raise_on_status=False,
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # The connection pool has to be at least as big as the number of workers sharing the session, otherwise urllib3 throws away connections and warns about a full pool
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=self.max_concurrency, pool_maxsize=self.max_concurrency)
         # A session is very helpful for any universities that use cookies, and is a good thing to have even if they don't
+        # It is shared between the engine's worker threads, so providers should not mutate it outside of setup_provider
+        # (which may be run again mid run, see _renew_session)
         self.session = requests.Session()
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
+        self.cache = cache
+        # Set by the engine for the length of a run, every request is recorded into it (see scraper/metrics.py)
+        self.metrics: Metrics | None = None
+        # Identical GETs made at the same time (i.e two workers on the same course page) share one request, see _request
+        self._in_flight: SingleFlight[requests.Response] = SingleFlight()
+        # Set by the engine when a run has a time budget, a time.monotonic() no request may run past (see _clip_timeout)
+        self.deadline: float | None = None
+        # Saved sessions, optional like the cache. _session_saved_at tells the session in use apart from a renewed one
+        self.sessions = sessions
+        self._session_lock = threading.Lock()
+        self._session_saved_at: float | None = None
+        # The thread running setup_provider, its requests are the ones setting the session up so they are never "rejected"
+        self._setup_thread: int | None = None
 
 
     def __init_subclass__(cls, **kwargs) -> None:
@@ -52,67 +148,342 @@ class BaseProvider(ABC):
                 f"Please set a unique string name for use within the program (e.g., university_name = 'keio_university')."
             )
 
-    def _request(self, method: str, url: str, *, timeout: float | tuple[float, float] = 15, allow_redirects: bool = True, **kwargs) -> requests.Response:
+    def setup_session(self) -> None:
+        """
+            Gets the session ready for a run, callers use this rather than calling setup_provider themselves.
+            With a SessionStore and a session_ttl a saved session is used if there is one that hasn't expired,
+            otherwise setup_provider is run and the session it ends up with is saved for the next run or worker.
+        """
+        if not callable(getattr(self, "setup_provider", None)):
+            return
+        if self.sessions is None or self.session_ttl <= 0:
+            self._run_setup()
+            self._session_saved_at = time.time()
+            return
+        with self.sessions.setup_lock(str(self.university_name), self.base_url):
+            saved = self.sessions.load(str(self.university_name), self.base_url)
+            if saved is not None:
+                self._use_saved_session(saved)
+                return
+            self._run_setup()
+            self._save_session()
+
+    def session_rejected(self, method: str, response: requests.Response) -> bool:
+        """
+            Whether a successful looking response is really the site turning the session away (i.e an expired session
+            getting the start page back), the session is then set up again and the request retried once.
+            Providers with a session_ttl should override this, the default never rejects anything.
+        """
+        return False
+
+    def _run_setup(self) -> None:
+        self._setup_thread = threading.get_ident()
+        try:
+            self.setup_provider()  # type: ignore[attr-defined]
+        finally:
+            self._setup_thread = None
+
+    def _use_saved_session(self, saved: dict) -> None:
+        self.session.cookies.clear()
+        load_cookies(self.session.cookies, saved["cookies"])
+        self._session_saved_at = saved["saved_at"]
+
+    def _save_session(self) -> None:
+        assert self.sessions is not None
+        self._session_saved_at = self.sessions.save(str(self.university_name), self.base_url, self.session.cookies, self.session_ttl)["saved_at"]
+
+    def _renew_session(self, rejected_session: float | None) -> None:
+        """
+            Replaces a session the site rejected. Only the first thread to get here does anything, the rest find the
+            session has already been replaced and just try again. A newer session saved by another worker (or process)
+            is used if there is one, otherwise the setup is run again.
+        """
+        with self._session_lock:
+            if self._session_saved_at != rejected_session:
+                return
+            if self.sessions is None or self.session_ttl <= 0:
+                self.session.cookies.clear()
+                self._run_setup()
+                self._session_saved_at = time.time()
+                return
+            with self.sessions.setup_lock(str(self.university_name), self.base_url):
+                saved = self.sessions.load(str(self.university_name), self.base_url)
+                if saved is not None and saved["saved_at"] != rejected_session:
+                    self._use_saved_session(saved)
+                    return
+                self.sessions.discard(str(self.university_name), self.base_url)
+                self.session.cookies.clear()
+                self._run_setup()
+                self._save_session()
+
+    def _request(self, method: str, url: str, *, timeout: float | tuple[float, float] = 15, allow_redirects: bool = True, cache: bool | None = None, **kwargs) -> requests.Response:
         """
         Internal helper to make HTTP requests with consistent error handling.
         Providers should prefer using `_get` / `_post` wrappers due to their consistent error handling.
+
+        If the provider has a cache, GET requests go through it by default, anything else has to opt in with `cache=True`
+        (i.e POST searches where the body fully describes the query). Pass `cache=False` for requests that depend on or
+        change server side session state.
         """
+        start = time.perf_counter()
+        use_cache = self.cache is not None and (cache if cache is not None else method.upper() == "GET")
+        cache_key: str | None = None
+        cached: CachedResponse | None = None
+
+        if use_cache and self.cache is not None:
+            vary = {name: self.session.cookies.get(name) for name in self.cache_vary_cookies}
+            cache_key = self.cache.make_key(
+                method, url,
+                params=kwargs.get("params"), data=kwargs.get("data"), json=kwargs.get("json"),
+                headers=kwargs.get("headers"), vary=vary,
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                if cached.is_fresh(self.cache.ttl):
+                    response = cached.to_response()
+                    self._record_request(method, url, start, response, "hit")
+                    return response
+                # Stale, ask the server if it has changed rather than downloading it again
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), **cached.conditional_headers()}
+
+        cache_outcome = "miss" if use_cache else "bypass"
+        # Only GETs that don't touch the session (cache=False) are shared, those are the ones where asking twice gets the same answer
+        flight_key = self._flight_key(url, kwargs) if method.upper() == "GET" and cache is not False else None
+        attempt = 0
+        session_used = self._session_saved_at
+        renewed = False
+        while True:
+            # Every attempt gets whatever is left of the budget at most, a retry has less time than the first try did
+            if self.deadline is not None:
+                timeout = self._clip_timeout(timeout)
+            try:
+                if flight_key is None:
+                    return self._send(method, url, attempt, cache_outcome, cached, cache_key, timeout=timeout, allow_redirects=allow_redirects, **kwargs)
+                waited_from = time.perf_counter()
+                response, shared = self._in_flight.do(flight_key, lambda: self._send(method, url, attempt, cache_outcome, cached, cache_key, timeout=timeout, allow_redirects=allow_redirects, **kwargs))
+                if shared:
+                    self._record_request(method, url, waited_from, response, "coalesced")
+                return response
+            except SessionRejectedError:
+                # A session that has just been set up being rejected as well isn't something another setup will fix
+                if renewed:
+                    raise
+                renewed = True
+                self._renew_session(session_used)
+                session_used = self._session_saved_at
+            except RetryableError as error:
+                attempt += 1
+                # Threads that can requeue the work (the engine's fetch workers) get the error straight away, the
+                # engine tries the course again later and the worker carries on with something else in the meantime
+                if retries_deferred():
+                    raise
+                if attempt > self.max_retries:
+                    if error.cause is not None:
+                        raise error.cause from error
+                    raise
+                delay = error.retry_after if error.retry_after is not None else backoff_delay(attempt)
+                if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                    raise DeadlineExceededError(f"Out of time to retry {method.upper()} {url}") from error
+                time.sleep(delay)
+
+    def _clip_timeout(self, timeout: float | tuple[float, float]) -> float | tuple[float, float]:
+        """
+        Cuts a request's (connect, read) timeout down to what is left before the deadline, so a request can't block the
+        run past its time budget. Raises DeadlineExceededError if there's nothing left.
+        """
+        assert self.deadline is not None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("Out of time, the request was not sent")
+        if isinstance(timeout, tuple):
+            return (min(timeout[0], remaining), min(timeout[1], remaining))
+        return min(timeout, remaining)
+
+    def _flight_key(self, url: str, kwargs: dict) -> bytes:
+        """
+        Everything that makes two GETs the same request, the cookies are left out as every request from this provider shares its session.
+        """
+        return orjson.dumps([url, kwargs.get("params"), kwargs.get("headers")], option=orjson.OPT_SORT_KEYS, default=str)
+
+    def _limiter(self, url: str) -> HostLimiter:
+        return get_limiter(urlsplit(url).netloc, max_concurrency=self.max_concurrency, max_rate=self.max_requests_per_second)
+
+    def _send(self, method: str, url: str, attempt: int, cache_outcome: str, cached: CachedResponse | None, cache_key: str | None, **kwargs) -> requests.Response:
+        """
+        A single attempt at a request, through the host's rate limiter. Raises RetryableError for anything worth trying again.
+        """
+        with self._limiter(url).slot(self.deadline) as outcome:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method=method, url=url, **kwargs)
+            except requests.exceptions.Timeout as error:
+                self._record_request(method, url, start, None, cache_outcome, error=error, retries=attempt)
+                message = f"Timeout during {method.upper()} {url}"
+                raise RetryableError(message, cause=NetworkError(message)) from error
+            except requests.exceptions.ConnectionError as error:
+                self._record_request(method, url, start, None, cache_outcome, error=error, retries=attempt)
+                message = f"Connection error during {method.upper()} {url}"
+                raise RetryableError(message, cause=NetworkError(message)) from error
+            outcome["status_code"] = response.status_code
+            if response.status_code in THROTTLE_STATUS_CODES:
+                outcome["retry_after"] = parse_retry_after(response.headers.get("Retry-After"))
+
+        if response.status_code in THROTTLE_STATUS_CODES:
+            self._record_request(method, url, start, response, cache_outcome, error=HTTPStatusError(response.status_code, url), retries=attempt)
+            raise RetryableError(
+                f"HTTP error {response.status_code} for URL: {url}",
+                retry_after=outcome["retry_after"],
+                cause=HTTPStatusError(status_code=response.status_code, url=url),
+            )
+
+        if response.status_code == 304 and cached is not None and cache_key is not None and self.cache is not None:
+            refreshed = self.cache.refresh(cache_key, cached, response).to_response()
+            self._record_request(method, url, start, refreshed, "revalidated", retries=attempt)
+            return refreshed
         try:
-            response = self.session.request(method=method, url=url, timeout=timeout, allow_redirects=allow_redirects, **kwargs)
             response.raise_for_status()
-            return response
-        except requests.exceptions.Timeout as error:
-            raise NetworkError(f"Timeout during {method.upper()} {url}") from error
-        except requests.exceptions.ConnectionError as error:
-            raise NetworkError(f"Connection error during {method.upper()} {url}") from error
         except requests.exceptions.HTTPError as error:
-            status = getattr(error.response, "status_code", None)
-            raise HTTPStatusError(status_code=status, url=url) from error
+            self._record_request(method, url, start, response, cache_outcome, error=error, retries=attempt)
+            raise HTTPStatusError(status_code=response.status_code, url=url) from error
+        if self._setup_thread != threading.get_ident() and self.session_rejected(method, response):
+            rejected = SessionRejectedError(url)
+            self._record_request(method, url, start, response, cache_outcome, error=rejected, retries=attempt)
+            raise rejected
 
-    def _get(self, url: str, *, params: dict | None = None, headers: dict | None = None, timeout: float | tuple[float, float] = 15, allow_redirects: bool = True) -> requests.Response:
-        return self._request("GET", url, params=params, headers=headers, timeout=timeout, allow_redirects=allow_redirects)
+        if cache_key is not None and self.cache is not None and self._is_storable(response):
+            self.cache.put(cache_key, response)
+        self._record_request(method, url, start, response, cache_outcome, retries=attempt)
+        return response
+
+    def _record_request(self, method: str, url: str, start: float, response: requests.Response | None, cache_outcome: str, error: BaseException | None = None, retries: int = 0) -> None:
+        if self.metrics is None:
+            return
+        # urllib3 keeps its own (connection) retries on the response's Retry object, cached responses have no raw response at all
+        retry_state = getattr(getattr(response, "raw", None), "retries", None)
+        self.metrics.record_request(RequestRecord(
+            method=method.upper(),
+            url=url,
+            status=response.status_code if response is not None else None,
+            latency=time.perf_counter() - start,
+            bytes=len(response.content) if response is not None else 0,
+            retries=retries + len(getattr(retry_state, "history", None) or ()),
+            cache=cache_outcome,
+            error=type(error).__name__ if error is not None else None,
+        ))
+
+    def _is_storable(self, response: requests.Response) -> bool:
+        """
+        Responses that set cookies are never stored, replaying them would skip the cookie and leave the session in the wrong state.
+        """
+        if response.status_code not in CACHEABLE_STATUS_CODES:
+            return False
+        if "Set-Cookie" in response.headers:
+            return False
+        return "no-store" not in response.headers.get("Cache-Control", "").lower()
+
+    def _get(self, url: str, *, params: dict | None = None, headers: dict | None = None, timeout: float | tuple[float, float] = 15, allow_redirects: bool = True, cache: bool | None = None) -> requests.Response:
+        return self._request("GET", url, params=params, headers=headers, timeout=timeout, allow_redirects=allow_redirects, cache=cache)
+
+    def _post(self, url: str, *, data: dict | None = None, json: dict | None = None, headers: dict | None = None, timeout: float | tuple[float, float] = 20, cache: bool | None = None) -> requests.Response:
+        return self._request("POST", url, data=data, json=json, headers=headers, timeout=timeout, cache=cache)
 
-    def _post(self, url: str, *, data: dict | None = None, json: dict | None = None, headers: dict | None = None, timeout: float | tuple[float, float] = 20) -> requests.Response:
-        return self._request("POST", url, data=data, json=json, headers=headers, timeout=timeout)
-        
     @abstractmethod
-    def search_by_keyword(self, keyword: str) -> list[CourseList]:
+    def search_by_keyword(self, keyword: str) -> Iterable[CourseList]:
         """
             This is the method to search for courses by keyword
-            that should return a CourseList object,
+            that should return CourseList objects,
             which contains the name, course code and url of the course
-            for use in the parsing and getting of data for each course
+            for use in the parsing and getting of data for each course.
+            This can either be a list or a generator that yields courses as each
+            results page is parsed, the engine starts fetching details straight away either way.
+            Wrap a generator in a SearchResults to give the progress bar an estimated total
         """
         raise NotImplementedError
 
     @abstractmethod
-    def search_by_identifier(self, identifier: str) -> list[CourseList]:
+    def search_by_identifier(self, identifier: str) -> Iterable[CourseList]:
         """
             This is the method to search for courses by identifier
-            that should return a CourseList object,
+            that should return CourseList objects,
             which contains the name, course code and url of the course
-            for use in the parsing and getting of data for each course
+            for use in the parsing and getting of data for each course.
+            This can either be a list or a generator that yields courses as each
+            results page is parsed, the engine starts fetching details straight away either way.
+            Wrap a generator in a SearchResults to give the progress bar an estimated total
         """
         raise NotImplementedError
 
+    @classmethod
+    def is_identifier(cls, value: str) -> bool:
+        """
+            Whether the value is in this provider's course identifier format, i.e whether a search for it
+            should be an identifier search rather than a keyword one
+        """
+        return cls.identifier_pattern is not None and cls.identifier_pattern.match(value.strip()) is not None
+
+    def iter_search(self, search_method: str, value: str) -> SearchResults:
+        """
+            This is how the engine searches, whichever search method it is. The search methods can
+            return a list, a generator or a SearchResults (to give the progress bar an estimated total),
+            they all come out as SearchResults which is consumed one course at a time, so a generator
+            keeps memory flat however many courses a broad search finds.
+        """
+        if search_method == "keyword":
+            results = self.search_by_keyword(value)
+        elif search_method == "course_identifier":
+            results = self.search_by_identifier(value)
+        elif search_method == "shard":
+            results = self.search_shard(value)
+        else:
+            raise ValueError(f"Unknown search method '{search_method}'")
+        return SearchResults.of(results)
+
+    def list_shards(self) -> dict[str, str]:
+        """
+            This is the method for crawling the whole catalogue (scraper/crawl.py), it splits the
+            catalogue into shards that can each be searched on their own and returns shard key -> label,
+            i.e a faculty and department. The key is all 'search_shard' gets so it has to hold
+            everything needed to search that shard, it is also used in file names so stick to
+            query string style keys (a=1&b=2). Providers that can't be crawled don't override this.
+        """
+        raise NotImplementedError(f"{self.university_name} does not support crawling its whole catalogue")
+
+    def search_shard(self, shard: str) -> Iterable[CourseList]:
+        """
+            This is the method that returns every course in one of the shards from 'list_shards',
+            a shard with no courses in it just returns nothing rather than raising CourseNotFoundError.
+        """
+        raise NotImplementedError(f"{self.university_name} does not support crawling its whole catalogue")
+
     @abstractmethod
+    def fetch_course_html(self, course: CourseList) -> str:
+        """
+            This is a method that fetches the raw HTML of a course's page
+            and nothing else, keeping it separate from parsing lets the engine
+            store the HTML and parse it again later without another request.
+
+            Args:
+                course: A CourseList object - a list of the basics of a course
+        """
+        raise NotImplementedError
+
     def fetch_course_details(self, course: CourseList) -> CourseData:
         """
             This is a method that returns the data to be written out
-            to the file, which is a CourseData object. This method should
-            handle fetching the raw HTML and then parsing it internally by
-            calling the 'parse_courses' method.
+            to the file, which is a CourseData object. It fetches the raw HTML
+            with 'fetch_course_html' and then parses it with 'parse_courses'.
 
             Args:
                 course: A CourseList object - a list of the basics of a course
         """
-        raise NotImplementedError
+        return self.parse_courses(self.fetch_course_html(course), course)
     
     @abstractmethod
     def parse_courses(self, html_content: str, course_info: CourseList) -> CourseData:
         """
-            This is a method that takes in the text response from fetch_course_details
+            This is a method that takes in the text response from fetch_course_html
             and parses it into a CourseData object, this exists to enforce a common format
             and for testing the parsing.
+            !! Bump 'parse_version' whenever what this outputs changes !!
         """
         raise NotImplementedError
\ No newline at end of file
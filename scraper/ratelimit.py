@@ -0,0 +1,232 @@
+"""
+Per host rate limiting shared by every provider (and every thread) talking to that host.
+Every host gets a token bucket for requests per second plus an AIMD (additive increase, multiplicative decrease) limit
+on requests in flight: both creep up while the site answers quickly and halve as soon as it sends a 429/5xx, takes a lot
+longer than usual to answer or asks us to back off with Retry-After. Too many failures in a row and the circuit breaker
+opens, requests then fail straight away until the cool down is over instead of piling more load onto a struggling site.
+"""
+from scraper.errors import CircuitOpenError, DeadlineExceededError
+from contextlib import contextmanager
+from collections.abc import Iterator
+from email.utils import parsedate_to_datetime
+import math, random, threading, time
+
+# Responses that mean the site wants us to slow down (or is struggling), they are retried and shrink the limits
+THROTTLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Retry-After is either a number of seconds or an HTTP date, returns the seconds to wait or None if it is missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter, so retries from several workers don't all land at the same moment.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class HostLimiter:
+    """
+    The limits for a single host. acquire() blocks until a request is allowed, every acquire must be followed by
+    exactly one release() with how the request went.
+    """
+    def __init__(self, host: str, max_concurrency: int = 4, max_rate: float = 5.0, min_rate: float = 0.2, failure_threshold: int = 5, cooldown: float = 30.0) -> None:
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._condition = threading.Condition()
+        # Start at half speed and let additive increase find out what the site is happy with
+        self.concurrency_limit = max(1.0, max_concurrency / 2)
+        self.rate = max(min_rate, max_rate / 2)
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self.in_flight = 0
+        # Nothing goes out before this (monotonic) time, set by Retry-After
+        self._blocked_until = 0.0
+        # A smoothed latency and the best it has been, a big gap between the two means the site is struggling
+        self._latency: float | None = None
+        self._baseline_latency: float | None = None
+        self._last_decrease = 0.0
+
+        self.consecutive_failures = 0
+        self._circuit_open_until = 0.0
+        self._half_open_probe = False
+
+    def configure(self, max_concurrency: int, max_rate: float) -> None:
+        """
+        Changes the caps, the current limits are pulled down to fit under lower ones straight away and creep up to higher ones as usual.
+        """
+        with self._condition:
+            self.max_concurrency = max_concurrency
+            self.max_rate = max_rate
+            self.concurrency_limit = min(self.concurrency_limit, float(max_concurrency))
+            self.rate = max(self.min_rate, min(self.rate, max_rate))
+            self._condition.notify_all()
+
+    def _refill(self, now: float) -> None:
+        # The bucket holds at most one second's worth of tokens, so a quiet spell can't turn into a burst
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def acquire(self, deadline: float | None = None) -> None:
+        """
+        Waits for a token and a free in flight slot. Raises CircuitOpenError straight away if the breaker is open,
+        after the cool down a single request is let through to test the water (half open).
+        With a (monotonic) deadline it raises DeadlineExceededError rather than waiting past it.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise DeadlineExceededError(f"Out of time waiting to send a request to {self.host}")
+                if self._circuit_open_until:
+                    if now < self._circuit_open_until or self._half_open_probe:
+                        retry_after = max(self._circuit_open_until - now, 1.0)
+                        raise CircuitOpenError(self.host, retry_after)
+                    # Cool down is over, this request is the probe, everyone else waits until it comes back
+                    self._half_open_probe = True
+                    self.in_flight += 1
+                    return
+
+                self._refill(now)
+                waits: list[float] = []
+                if now < self._blocked_until:
+                    waits.append(self._blocked_until - now)
+                # No slot free, nothing to time, release() wakes us up when one frees
+                if self.in_flight >= int(self.concurrency_limit):
+                    waits.append(math.inf)
+                if self._tokens < 1.0:
+                    waits.append((1.0 - self._tokens) / self.rate)
+                if not waits:
+                    self._tokens -= 1.0
+                    self.in_flight += 1
+                    return
+                # Woken early by release() whenever a slot frees up, otherwise when the next token is due
+                wait = max(waits)
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                self._condition.wait(timeout=None if math.isinf(wait) else wait)
+
+    def release(self, status_code: int | None, latency: float, retry_after: float | None = None) -> None:
+        """
+        Reports how a request went, status_code is None if it never got a response (timeout, connection error).
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            throttled = status_code is None or status_code in THROTTLE_STATUS_CODES
+            was_probe = self._half_open_probe
+            self._half_open_probe = False
+
+            if retry_after is not None and retry_after > 0:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+            if throttled:
+                self.consecutive_failures += 1
+                self._decrease(now, force=True)
+                if was_probe or self.consecutive_failures >= self.failure_threshold:
+                    self._circuit_open_until = now + max(self.cooldown, retry_after or 0.0)
+            else:
+                self.consecutive_failures = 0
+                self._circuit_open_until = 0.0
+                self._observe_latency(now, latency)
+            self._condition.notify_all()
+
+    def _observe_latency(self, now: float, latency: float) -> None:
+        self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+        if self._baseline_latency is None or self._latency < self._baseline_latency:
+            self._baseline_latency = self._latency
+        # Answering three times slower than it used to is the site telling us it is busy before it starts sending 503s
+        if self._latency > 3 * self._baseline_latency and self._latency > 0.5:
+            self._decrease(now)
+            return
+        # Additive increase, roughly one more concurrent request per 'round' of requests at the current limit
+        self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def _decrease(self, now: float, force: bool = False) -> None:
+        # The requests already in flight when things went wrong all come back bad together, they only halve the limits once.
+        # force (an actual 429/5xx) is allowed to halve again much sooner than a latency spike is
+        if now - self._last_decrease < (0.2 if force else 1.0):
+            return
+        self._last_decrease = now
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    @contextmanager
+    def slot(self, deadline: float | None = None) -> Iterator[dict]:
+        """
+        acquire() and release() as a context manager, fill in the yielded dict's status_code and retry_after.
+        Anything raised inside counts as a failed request.
+        """
+        self.acquire(deadline)
+        outcome: dict = {"status_code": None, "retry_after": None}
+        start = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.release(outcome["status_code"], time.perf_counter() - start, outcome["retry_after"])
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {
+                "host": self.host,
+                "concurrency_limit": self.concurrency_limit,
+                "rate": self.rate,
+                "in_flight": self.in_flight,
+                "consecutive_failures": self.consecutive_failures,
+                "circuit_open": bool(self._circuit_open_until),
+            }
+
+
+# One limiter per host for the whole process, so two providers (or two batch jobs) on the same site share its limits.
+# This is the one place a provider's max_concurrency is enforced, callers running several providers at once (batch jobs,
+# crawl workers) don't split it between them, they all go through the same limiter
+_limiters: dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(host: str, max_concurrency: int = 4, max_rate: float = 5.0) -> HostLimiter:
+    """
+    The shared limiter for a host. If the caps asked for aren't the limiter's it is reconfigured with them, so the limits
+    are always those of the provider talking to the host now rather than whichever one happened to talk to it first.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = HostLimiter(host, max_concurrency=max_concurrency, max_rate=max_rate)
+        elif limiter.max_concurrency != max_concurrency or limiter.max_rate != max_rate:
+            limiter.configure(max_concurrency, max_rate)
+        return limiter
+
+
+# Threads that can put a failed request back in a queue (the engine's fetch workers) turn deferred retries on, their
+# requests then raise RetryableError instead of sleeping on a retry. Everything else (i.e searches) still retries in place.
+_deferred = threading.local()
+
+@contextmanager
+def deferred_retries() -> Iterator[None]:
+    previous = getattr(_deferred, "enabled", False)
+    _deferred.enabled = True
+    try:
+        yield
+    finally:
+        _deferred.enabled = previous
+
+def retries_deferred() -> bool:
+    return getattr(_deferred, "enabled", False)
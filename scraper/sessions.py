@@ -0,0 +1,133 @@
+"""
+Keeps providers' sessions (the cookies setup_provider ends up with) on disk so the next run, or the next worker, can carry
+on with them instead of doing the setup round trips again. For Keio that is the GET for the session cookies and the POST
+that switches the session to English, the language lives in the server side session the cookies point at so the cookies
+are all that needs keeping.
+A saved session is used until the provider's session_ttl is up or one of its cookies expires, whichever is first, or
+until the site rejects it (BaseProvider.session_rejected), then the setup is run again and the new session saved.
+The setup lock covers other processes as well (batch processes, a background --finish) where fcntl is available, on
+Windows it only covers the one process.
+"""
+from scraper.cache import ExpiringStore
+from scraper.paths import CACHE_DIR
+from requests.cookies import RequestsCookieJar, create_cookie
+from typing import IO
+import os, threading, time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+SESSIONS_DIR = os.path.join(CACHE_DIR, "sessions")
+
+# However long a provider says its sessions last, nothing older than this is ever used
+MAX_SESSION_AGE = 24 * 60 * 60
+
+
+def dump_cookies(cookies: RequestsCookieJar) -> list[dict]:
+    return [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+            "secure": cookie.secure,
+            "rest": {"HttpOnly": cookie.get_nonstandard_attr("HttpOnly")} if cookie.has_nonstandard_attr("HttpOnly") else {},
+        }
+        for cookie in cookies
+    ]
+
+
+def load_cookies(cookies: RequestsCookieJar, saved: list[dict]) -> None:
+    for cookie in saved:
+        cookies.set_cookie(create_cookie(**cookie))
+
+
+class SetupLock:
+    """
+    A threading.Lock for the threads in this process plus an exclusive flock on `path` for every other process, the
+    flock is only taken while the thread lock is held so one open file is enough. Without fcntl it is just the thread lock.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._fh: IO[str] | None = None
+
+    def __enter__(self) -> "SetupLock":
+        self._lock.acquire()
+        if fcntl is None:
+            return self
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fh = open(self.path, "a")
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        except BaseException:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._fh is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self._lock.release()
+
+
+class SessionStore:
+    """
+    Saved sessions for every provider, one JSON file per provider keyed by base_url so a provider pointed somewhere else
+    (i.e the replay server) never gets the real site's cookies. One store is meant to be shared by every provider in the
+    process like ResponseCache, it also makes sure only one of them (in any process) runs a provider's setup at a time.
+    """
+    def __init__(self, directory: str | None = None) -> None:
+        self.directory = directory or SESSIONS_DIR
+        self._lock = threading.Lock()
+        self._stores: dict[str, ExpiringStore] = {}
+        self._setup_locks: dict[str, SetupLock] = {}
+
+    def _store(self, university_name: str) -> ExpiringStore:
+        with self._lock:
+            store = self._stores.get(university_name)
+            if store is None:
+                store = self._stores[university_name] = ExpiringStore(os.path.join(self.directory, f"{university_name}.json"), ttl=MAX_SESSION_AGE)
+            return store
+
+    def setup_lock(self, university_name: str, base_url: str) -> SetupLock:
+        """
+        Held while a provider restores or sets up its session, so several workers (or processes) starting at once do the
+        setup once between them. Other processes lock the provider's whole session file, whichever base_url it is for.
+        """
+        with self._lock:
+            return self._setup_locks.setdefault(f"{university_name} {base_url}", SetupLock(os.path.join(self.directory, f"{university_name}.lock")))
+
+    def load(self, university_name: str, base_url: str) -> dict | None:
+        """
+        The saved session ({"cookies", "saved_at", "expires_at"}), None if there isn't one or it has expired.
+        It is read from disk every time, another process may have saved a session since.
+        """
+        store = self._store(university_name)
+        store.reload()
+        session = store.get(base_url)
+        if session is None or session["expires_at"] <= time.time():
+            return None
+        return session
+
+    def save(self, university_name: str, base_url: str, cookies: RequestsCookieJar, ttl: float) -> dict:
+        now = time.time()
+        cookie_expiry = [cookie.expires for cookie in cookies if cookie.expires]
+        session = {
+            "cookies": dump_cookies(cookies),
+            "saved_at": now,
+            "expires_at": min([now + min(ttl, MAX_SESSION_AGE), *cookie_expiry]),
+        }
+        self._store(university_name).set(base_url, session)
+        return session
+
+    def discard(self, university_name: str, base_url: str) -> None:
+        self._store(university_name).delete(base_url)
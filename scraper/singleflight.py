@@ -0,0 +1,58 @@
+"""
+Request coalescing: when several threads ask for the same thing at the same time only the first one actually does it,
+the rest wait for it and get the same result (or the same exception). Nothing is kept once the call is done, this is
+about requests that overlap in time, anything longer lived is the ResponseCache's job.
+"""
+from collections.abc import Callable, Hashable
+from typing import Generic, TypeVar
+import threading
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: T | None = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call[T]] = {}
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> tuple[T, bool]:
+        """
+        Calls function, unless a call with the same key is already running in which case it waits for that one instead.
+        Returns (result, shared), shared is True if the result came from another thread's call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True  # type: ignore[return-value]
+
+        try:
+            call.result = function()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            # Removed before waking the waiters, anyone arriving after this point starts a call of their own
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
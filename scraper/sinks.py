@@ -0,0 +1,130 @@
+"""
+This module defines where scraped courses get written to. Sinks receive each CourseData as soon as it is
+scraped instead of at the end of a run, so memory stays flat and a crash part way through keeps everything before it.
+"""
+from scraper.models import CourseData, record_fields
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+import gzip, orjson, os
+
+class OutputSink(ABC):
+    """
+    Every output format !! MUST !! follow this, the engine only ever talks to sinks through these methods.
+    """
+    path: str
+
+    @abstractmethod
+    def write(self, record: CourseData) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """
+        Pushes anything buffered to disk, sinks that don't buffer don't need to override this.
+        """
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self) -> "OutputSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class NdjsonSink(OutputSink):
+    """
+    Writes one JSON object per line, optionally gzip compressed. Flushed every `flush_every` records so a crash loses at most that many.
+    """
+    def __init__(self, path: str, compress: bool = False, flush_every: int = 25) -> None:
+        if compress and not path.endswith(".gz"):
+            path += ".gz"
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fh = gzip.open(path, "wb") if compress else open(path, "wb")
+
+    def write(self, record: CourseData) -> None:
+        self.write_dict(record_fields(record))
+
+    def write_dict(self, record: dict) -> None:
+        """
+        Writes an already dumped record, for callers that add their own fields to it (i.e scraper/fanout.py).
+        """
+        self._fh.write(orjson.dumps(record) + b"\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        self._fh.flush()
+
+    def close(self) -> None:
+        if not self._fh.closed:
+            self._fh.close()
+
+
+class TeeSink(OutputSink):
+    """
+    Sends every record to several sinks, i.e a file and the course store. The path is the first sink's.
+    """
+    def __init__(self, *sinks: OutputSink) -> None:
+        if not sinks:
+            raise ValueError("TeeSink needs at least one sink")
+        self.sinks = sinks
+        self.path = sinks[0].path
+
+    def write(self, record: CourseData) -> None:
+        for sink in self.sinks:
+            sink.write(record)
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def iter_ndjson(path: str) -> Iterator[dict]:
+    """
+    Reads records back out of an NDJSON file one at a time, gzip files are detected by their extension.
+    A half written last line (i.e from a crash) is skipped rather than failing the whole file.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+
+
+def write_json_array(path: str, records: Iterable[dict]) -> int:
+    """
+    Writes records out as the same indented JSON array we have always written, one record at a time so it never
+    holds them all in memory. Returns the number of records written.
+    """
+    count = 0
+    with open(path, "wb") as fh:
+        fh.write(b"[")
+        for record in records:
+            # Indent every line by one level since the records sit inside the array
+            indented = orjson.dumps(record, option=orjson.OPT_INDENT_2).replace(b"\n", b"\n  ")
+            fh.write((b",\n  " if count else b"\n  ") + indented)
+            count += 1
+        fh.write(b"\n]" if count else b"]")
+    return count
+
+
+def compact_to_json(ndjson_path: str, json_path: str) -> int:
+    """
+    Turns an NDJSON file into an indented JSON file, returns the number of records written.
+    """
+    return write_json_array(json_path, iter_ndjson(ndjson_path))
@@ -0,0 +1,179 @@
+"""
+A single SQLite database holding every course we have ever scraped, one row per (university, course code, year) so scraping
+the same course again just updates it. The aims and ILOs are indexed with FTS5 so they can be searched and matched
+against without loading everything.
+"""
+from scraper.models import CourseData, course_data_list, record_fields
+from scraper.paths import DATA_DIR
+from scraper.sinks import OutputSink, write_json_array
+from collections.abc import Iterable, Iterator
+import os, sqlite3, threading, time
+
+STORE_PATH = os.path.join(DATA_DIR, "courses.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    id INTEGER PRIMARY KEY,
+    university_name TEXT NOT NULL,
+    course_code TEXT NOT NULL,
+    year TEXT NOT NULL,
+    name TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    aims TEXT NOT NULL,
+    ilos TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    UNIQUE (university_name, course_code, year)
+);
+CREATE INDEX IF NOT EXISTS courses_scraped_at ON courses (university_name, scraped_at);
+
+-- External content table, the text only lives in courses and the triggers keep the index in step with it
+CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+    name, aims, ilos, content='courses', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS courses_after_insert AFTER INSERT ON courses BEGIN
+    INSERT INTO courses_fts (rowid, name, aims, ilos) VALUES (new.id, new.name, new.aims, new.ilos);
+END;
+CREATE TRIGGER IF NOT EXISTS courses_after_delete AFTER DELETE ON courses BEGIN
+    INSERT INTO courses_fts (courses_fts, rowid, name, aims, ilos) VALUES ('delete', old.id, old.name, old.aims, old.ilos);
+END;
+CREATE TRIGGER IF NOT EXISTS courses_after_update AFTER UPDATE ON courses BEGIN
+    INSERT INTO courses_fts (courses_fts, rowid, name, aims, ilos) VALUES ('delete', old.id, old.name, old.aims, old.ilos);
+    INSERT INTO courses_fts (rowid, name, aims, ilos) VALUES (new.id, new.name, new.aims, new.ilos);
+END;
+"""
+
+UPSERT = """
+INSERT INTO courses (university_name, course_code, year, name, semester, aims, ilos, scraped_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (university_name, course_code, year) DO UPDATE SET
+    name = excluded.name,
+    semester = excluded.semester,
+    aims = excluded.aims,
+    ilos = excluded.ilos,
+    scraped_at = excluded.scraped_at
+"""
+
+COURSE_FIELDS = ("name", "course_code", "semester", "aims", "ilos")
+COURSE_COLUMNS = ", ".join(COURSE_FIELDS)
+
+
+class CourseStore:
+    """
+    The course database. One connection is shared between threads (the engine's workers write through a StoreSink),
+    so every use of it goes through the lock.
+    """
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or STORE_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # Batch runs have a process per provider all writing here, the timeout is how long a writer waits for another one's transaction
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # WAL lets readers (i.e the matcher) carry on while a scrape is writing, NORMAL is safe with WAL and a lot quicker than FULL
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def upsert_many(self, university_name: str, year: str, records: Iterable[CourseData]) -> int:
+        """
+        Inserts or updates a batch of courses in a single transaction, returns how many rows were written.
+        """
+        scraped_at = time.time()
+        rows = [
+            (university_name, record.course_code, year, record.name, record.semester, record.aims, record.ilos, scraped_at)
+            for record in records
+        ]
+        if not rows:
+            return 0
+        with self._lock, self._connection:
+            self._connection.executemany(UPSERT, rows)
+        return len(rows)
+
+    def _where(self, university_name: str | None, year: str | None, scraped_since: float | None) -> tuple[str, list]:
+        clauses = []
+        parameters: list = []
+        if university_name is not None:
+            clauses.append("courses.university_name = ?")
+            parameters.append(university_name)
+        if year is not None:
+            clauses.append("courses.year = ?")
+            parameters.append(year)
+        if scraped_since is not None:
+            clauses.append("courses.scraped_at >= ?")
+            parameters.append(scraped_since)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+    def iter_courses(self, university_name: str | None = None, year: str | None = None, scraped_since: float | None = None, batch_size: int = 500) -> Iterator[CourseData]:
+        """
+        Every stored course matching the filters, read in batches so a whole catalogue is never in memory at once.
+        """
+        where, parameters = self._where(university_name, year, scraped_since)
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT id, {COURSE_COLUMNS} FROM courses{where}{' AND' if where else ' WHERE'} courses.id > ? ORDER BY courses.id LIMIT ?",
+                    [*parameters, last_id, batch_size],
+                ).fetchall()
+            if not rows:
+                return
+            yield from course_data_list([dict(zip(COURSE_FIELDS, row[1:])) for row in rows])
+            last_id = rows[-1][0]
+
+    def count(self, university_name: str | None = None, year: str | None = None) -> int:
+        where, parameters = self._where(university_name, year, None)
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM courses{where}", parameters).fetchone()[0]
+
+    def search(self, query: str, university_name: str | None = None, limit: int = 50) -> list[tuple[str, CourseData]]:
+        """
+        Full text search over names, aims and ILOs, best match (by FTS5's bm25) first. Returns (university name, course) pairs.
+        Every word is quoted so punctuation in the query can't be read as FTS5 syntax.
+        """
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if not match:
+            return []
+        where, parameters = self._where(university_name, None, None)
+        sql = (
+            f"SELECT courses.university_name, {', '.join('courses.' + column for column in COURSE_COLUMNS.split(', '))} "
+            f"FROM courses_fts JOIN courses ON courses.id = courses_fts.rowid"
+            f"{where}{' AND' if where else ' WHERE'} courses_fts MATCH ? ORDER BY bm25(courses_fts) LIMIT ?"
+        )
+        with self._lock:
+            rows = self._connection.execute(sql, [*parameters, match, limit]).fetchall()
+        return list(zip((row[0] for row in rows), course_data_list([dict(zip(COURSE_FIELDS, row[1:])) for row in rows])))
+
+    def export_json(self, path: str, university_name: str | None = None, year: str | None = None) -> int:
+        """
+        Writes stored courses out in the same indented JSON format the engine writes, one record at a time.
+        """
+        return write_json_array(path, (record_fields(record) for record in self.iter_courses(university_name, year)))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class StoreSink(OutputSink):
+    """
+    Writes courses into the store in batches, every batch being one transaction.
+    """
+    def __init__(self, store: CourseStore, university_name: str, year: str, batch_size: int = 100) -> None:
+        self.store = store
+        self.path = store.path
+        self.university_name = university_name
+        self.year = year
+        self.batch_size = batch_size
+        self._batch: list[CourseData] = []
+
+    def write(self, record: CourseData) -> None:
+        self._batch.append(record)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        self.store.upsert_many(self.university_name, self.year, batch)
+
+    def close(self) -> None:
+        # The store itself is shared so it stays open, only what is left of the batch gets written
+        self.flush()
@@ -0,0 +1,96 @@
+from scraper.models import CourseData, CourseList
+from scraper.providers import PROVIDER_REGISTRY
+from scraper.providers.base_provider import BaseProvider
+from scraper.ratelimit import _limiters, _limiters_lock
+import pytest
+import threading, time
+
+
+class LimitedProvider(BaseProvider):
+    """
+    A provider that never touches the network, for checking what batch and crawl hand to the host limiter.
+    """
+    university_name = "limited_test_university"
+    base_url = "http://limited.test/"
+    max_concurrency = 4
+    max_requests_per_second = 10_000.0
+
+    def search_by_keyword(self, keyword: str) -> list[CourseList]:
+        return []
+
+    def search_by_identifier(self, identifier: str) -> list[CourseList]:
+        return []
+
+    def list_shards(self) -> dict[str, str]:
+        return {f"shard-{number}": f"Shard {number}" for number in range(4)}
+
+    def fetch_course_html(self, course: CourseList) -> str:
+        return ""
+
+    def parse_courses(self, html_content: str, course_info: CourseList) -> CourseData:
+        return CourseData(name=course_info.name, course_code=course_info.course_code, semester="", aims="", ilos="")
+
+
+class LimiterProbe:
+    """
+    Stands in for ScraperEngine: every run sends `requests_per_thread` pretend requests from `threads` threads through
+    the provider's host limiter and records the most that were ever in flight at once, across every engine.
+    """
+    def __init__(self, threads: int = 4, requests_per_thread: int = 30) -> None:
+        self.threads = threads
+        self.requests_per_thread = requests_per_thread
+        self.providers: list[BaseProvider] = []
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.peak_in_flight = 0
+
+    def _requests(self, provider: BaseProvider) -> None:
+        limiter = provider._limiter(provider.base_url)
+        for _ in range(self.requests_per_thread):
+            with limiter.slot() as outcome:
+                with self._lock:
+                    self._in_flight += 1
+                    self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+                time.sleep(0.002)
+                with self._lock:
+                    self._in_flight -= 1
+                outcome["status_code"] = 200
+
+    def engine(self, provider: BaseProvider, **kwargs) -> "LimiterProbe.Engine":
+        with self._lock:
+            self.providers.append(provider)
+        return LimiterProbe.Engine(self, provider)
+
+    class Engine:
+        def __init__(self, probe: "LimiterProbe", provider: BaseProvider) -> None:
+            self.probe = probe
+            self.provider = provider
+            self.found = self.written = 0
+            self.errors: list = []
+            self.output_path = None
+
+        def run(self, search_method: str, value: str) -> None:
+            threads = [threading.Thread(target=self.probe._requests, args=(self.provider,)) for _ in range(self.probe.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+
+def _forget_limiter(host: str) -> None:
+    with _limiters_lock:
+        _limiters.pop(host, None)
+
+
+@pytest.fixture
+def limited_provider():
+    # The limiters are process wide, every test starts with a fresh one for the test host
+    _forget_limiter("limited.test")
+    PROVIDER_REGISTRY.register(LimitedProvider)
+    yield LimitedProvider
+    _forget_limiter("limited.test")
+
+
+@pytest.fixture
+def limiter_probe() -> LimiterProbe:
+    return LimiterProbe()
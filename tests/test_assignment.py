@@ -0,0 +1,111 @@
+from matcher.assignment import assign_courses, semester_terms, AUTUMN, SPRING, SUMMER
+from matcher.catalogue import Catalogue
+from matcher.similarity import similarity_matrix
+from scraper.models import CourseData
+from collections import Counter
+import itertools, random
+import pytest
+
+WORDS = [f"topic{number}" for number in range(12)]
+SEMESTERS = ["Semester 1", "Semester 2", "2025 Spring", "2025 Fall", "N/A"]
+
+
+def make_courses(rng: random.Random, count: int, prefix: str) -> list[CourseData]:
+    return [
+        CourseData(name=f"{prefix}{number}", course_code=f"{prefix}{number}", semester=rng.choice(SEMESTERS), aims=" ".join(rng.choices(WORDS, k=6)), ilos="N/A")
+        for number in range(count)
+    ]
+
+
+def brute_force(home: list[CourseData], abroad: list[CourseData], capacity: int, match_semesters: bool) -> float:
+    """
+    The best total score over every way of giving each home course one allowed abroad course or none.
+    """
+    scores = similarity_matrix(home, abroad).toarray()
+
+    def allowed(row: int, column: int) -> bool:
+        if scores[row, column] <= 0:
+            return False
+        if not match_semesters:
+            return True
+        home_terms, abroad_terms = semester_terms(home[row].semester), semester_terms(abroad[column].semester)
+        return home_terms == 0 or abroad_terms == 0 or bool(home_terms & abroad_terms)
+
+    options = [[None] + [column for column in range(len(abroad)) if allowed(row, column)] for row in range(len(home))]
+    best = 0.0
+    for choice in itertools.product(*options):
+        use = Counter(column for column in choice if column is not None)
+        if any(count > capacity for count in use.values()):
+            continue
+        best = max(best, sum(scores[row, column] for row, column in enumerate(choice) if column is not None))
+    return best
+
+
+@pytest.mark.parametrize("capacity", [1, 2])
+@pytest.mark.parametrize("match_semesters", [False, True], ids=["any_semester", "same_semester"])
+def test_objective_matches_brute_force(capacity, match_semesters):
+    rng = random.Random(capacity * 10 + match_semesters)
+    for _ in range(25):
+        home = make_courses(rng, rng.randint(1, 5), "H")
+        abroad = make_courses(rng, rng.randint(1, 4), "A")
+        result = assign_courses(home, [Catalogue("abroad", abroad)], capacity=capacity, match_semesters=match_semesters)
+
+        assert result.exact
+        assert result.objective == pytest.approx(brute_force(home, abroad, capacity, match_semesters))
+        assert result.objective >= result.greedy_objective - 1e-9
+        assert len(result.assignments) + len(result.unmatched) == len(home)
+        use = Counter(assignment.match.course.course_code for assignment in result.assignments)
+        assert all(count <= capacity for count in use.values())
+
+
+def test_the_best_overall_beats_handing_out_the_best_pairs_first():
+    abroad = [
+        CourseData(name="Graph algorithms", course_code="A1", semester="", aims="graphs algorithms", ilos=""),
+        CourseData(name="Databases", course_code="A2", semester="", aims="databases", ilos=""),
+    ]
+    home = [
+        CourseData(name="Graph algorithms", course_code="H1", semester="", aims="graphs algorithms databases", ilos=""),
+        CourseData(name="Algorithms", course_code="H2", semester="", aims="algorithms", ilos=""),
+    ]
+    result = assign_courses(home, [Catalogue("abroad", abroad)], match_semesters=False)
+    # H1's best pair is A1, taking it first would leave H2 without anything
+    given = {assignment.home_course.course_code: assignment.match.course.course_code for assignment in result.assignments}
+    assert given == {"H1": "A2", "H2": "A1"}
+    assert result.objective > result.greedy_objective
+    assert result.objective == pytest.approx(brute_force(home, abroad, 1, False))
+
+
+def test_courses_in_different_semesters_are_never_paired():
+    home = [CourseData(name="Compilers", course_code="H1", semester="Semester 1", aims="compilers parsing", ilos="")]
+    abroad = [CourseData(name="Compilers", course_code="A1", semester="2025 Spring", aims="compilers parsing", ilos="")]
+    result = assign_courses(home, [Catalogue("abroad", abroad)])
+    assert result.assignments == []
+    assert result.unmatched[0].reason == "no candidates"
+    assert len(assign_courses(home, [Catalogue("abroad", abroad)], match_semesters=False).assignments) == 1
+
+
+def test_a_taken_candidate_is_reported_as_such():
+    abroad = [CourseData(name="Compilers", course_code="A1", semester="", aims="compilers", ilos="")]
+    home = [CourseData(name="Compilers", course_code=f"H{number}", semester="", aims="compilers", ilos="") for number in range(2)]
+    result = assign_courses(home, [Catalogue("abroad", abroad)])
+    assert len(result.assignments) == 1
+    assert result.unmatched[0].reason == "candidates taken"
+    assert result.unmatched[0].best_candidate.course.course_code == "A1"
+    assert len(assign_courses(home, [Catalogue("abroad", abroad)], capacity=2).assignments) == 2
+
+
+def test_capacity_has_to_be_positive():
+    with pytest.raises(ValueError):
+        assign_courses([], [], capacity=0)
+
+
+@pytest.mark.parametrize("semester, terms", [
+    ("Typically Offered: Semester 1", AUTUMN),
+    ("Semester 1 and 2", AUTUMN | SPRING),
+    ("2025 Spring/Fall", AUTUMN | SPRING),
+    ("Summer school", SUMMER),
+    ("通年", AUTUMN | SPRING),
+    ("N/A", 0),
+])
+def test_semester_terms(semester, terms):
+    assert semester_terms(semester) == terms
@@ -0,0 +1,15 @@
+from scraper import batch
+from scraper.batch import Job, run_provider_jobs
+
+
+def test_jobs_share_the_providers_whole_max_concurrency(limited_provider, limiter_probe, monkeypatch, tmp_path):
+    monkeypatch.setattr(batch, "ScraperEngine", limiter_probe.engine)
+    monkeypatch.setattr(batch, "ResponseCache", lambda: None)
+    jobs = [(index, Job(provider=limited_provider.university_name, method="keyword", value=f"job {index}")) for index in range(2)]
+
+    run_provider_jobs(limited_provider.university_name, jobs, jobs_per_provider=2, store_path=str(tmp_path / "courses.sqlite3"))
+
+    # Each job's provider keeps the whole limit, the host limiter is what stops the two of them going over it together
+    assert [provider.max_concurrency for provider in limiter_probe.providers] == [4, 4]
+    assert limiter_probe.providers[0]._limiter(limited_provider.base_url).max_concurrency == 4
+    assert limiter_probe.peak_in_flight == 4
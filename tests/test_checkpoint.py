@@ -0,0 +1,118 @@
+from scraper.checkpoint import Manifest, hash_html
+from scraper.models import CourseData, CourseList
+import os
+import pytest
+
+
+def course(number: int) -> CourseList:
+    return CourseList(name=f"Course {number}", course_code=f"C{number}", url=f"/course/{number}")
+
+
+def course_data(number: int, aims: str = "") -> CourseData:
+    return CourseData(name=f"Course {number}", course_code=f"C{number}", semester="1", aims=aims, ilos="")
+
+
+def save(manifest: Manifest, number: int, html_content: str, parse_version: int = 1) -> str:
+    html_sha256 = hash_html(html_content)
+    manifest.save_html(html_content, html_sha256)
+    manifest.record(course(number), html_sha256, parse_version, course_data(number, aims=html_content))
+    return html_sha256
+
+
+@pytest.fixture
+def open_manifest(tmp_path):
+    manifests = []
+
+    def open_manifest(name: str = "search", max_age: float | None = 60.0) -> Manifest:
+        manifest = Manifest(str(tmp_path / f"{name}.manifest.ndjson"), html_dir=str(tmp_path / "html"), max_age=max_age)
+        manifests.append(manifest)
+        return manifest
+
+    yield open_manifest
+    for manifest in manifests:
+        manifest.close()
+
+
+def test_reopening_keeps_the_latest_line_per_url(open_manifest):
+    manifest = open_manifest()
+    save(manifest, 1, "first")
+    save(manifest, 2, "other")
+    save(manifest, 1, "second", parse_version=2)
+    manifest.close()
+
+    manifest = open_manifest()
+    entry = manifest.get("/course/1")
+    assert entry is not None
+    assert (entry.html_sha256, entry.parse_version) == (hash_html("second"), 2)
+    assert manifest.load_record(entry)["aims"] == "second"
+
+
+def test_compact_drops_old_lines_and_the_records_still_load(open_manifest):
+    manifest = open_manifest()
+    save(manifest, 1, "first")
+    save(manifest, 2, "other")
+    save(manifest, 1, "second")
+    manifest.compact()
+
+    with open(manifest.path, "rb") as fh:
+        assert len(fh.readlines()) == 2
+    assert manifest.load_record(manifest.get("/course/1"))["aims"] == "second"
+    assert manifest.load_record(manifest.get("/course/2"))["aims"] == "other"
+
+    # Lines written after a compaction land after the rewritten ones
+    save(manifest, 3, "third")
+    assert manifest.load_record(manifest.get("/course/3"))["aims"] == "third"
+    manifest.close()
+    assert set(open_manifest().entries) == {"/course/1", "/course/2", "/course/3"}
+
+
+def test_a_line_cut_short_is_skipped(open_manifest):
+    manifest = open_manifest()
+    save(manifest, 1, "first")
+    manifest.close()
+    with open(manifest.path, "ab") as fh:
+        fh.write(b'{"url": "/course/2", "html_sha')
+
+    manifest = open_manifest()
+    assert set(manifest.entries) == {"/course/1"}
+    save(manifest, 3, "third")
+    assert manifest.load_record(manifest.get("/course/3"))["aims"] == "third"
+
+
+def test_entries_older_than_max_age_are_not_fresh(open_manifest):
+    manifest = open_manifest(max_age=60.0)
+    save(manifest, 1, "first")
+    entry = manifest.get("/course/1")
+    assert manifest.is_fresh(entry)
+    assert not manifest.is_fresh(entry._replace(fetched_at=entry.fetched_at - 120.0))
+    assert open_manifest("forever", max_age=None).is_fresh(entry._replace(fetched_at=0.0))
+
+
+def test_compact_deletes_pages_nothing_refers_to_any_more(open_manifest):
+    manifest = open_manifest()
+    first = save(manifest, 1, "first")
+    shared = save(manifest, 2, "shared")
+    save(manifest, 1, "second")
+    save(manifest, 2, "changed")
+    # Another search still has the shared page
+    other = open_manifest("other")
+    save(other, 5, "shared")
+
+    manifest.compact()
+
+    assert manifest.load_html(first) is None
+    assert manifest.load_html(shared) == "shared"
+    assert manifest.load_html(hash_html("second")) == "second"
+    assert manifest.load_html(hash_html("changed")) == "changed"
+
+
+def test_pages_superseded_before_a_crash_are_deleted_on_the_next_compaction(open_manifest):
+    manifest = open_manifest()
+    first = save(manifest, 1, "first")
+    save(manifest, 1, "second")
+    manifest.close()
+
+    manifest = open_manifest()
+    manifest.compact()
+    assert manifest.load_html(first) is None
+    assert os.path.exists(manifest._html_path(hash_html("second")))
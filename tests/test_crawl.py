@@ -0,0 +1,96 @@
+from scraper import crawl as crawl_module
+from scraper.crawl import WorkQueue, crawl
+import pytest
+import time
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def test_take_hands_out_every_shard_once(queue):
+    assert queue.enqueue({"a": "A", "b": "B"}) == 2
+    # Shards already queued aren't added again
+    assert queue.enqueue({"a": "A", "c": "C"}) == 1
+
+    taken = [queue.take(), queue.take(), queue.take()]
+    assert sorted(key for key, _, _ in taken) == ["a", "b", "c"]
+    assert all(attempt == 1 for _, _, attempt in taken)
+    assert queue.take() is None
+    assert queue.counts()["running"] == 3
+
+
+def test_finish_marks_a_shard_done(queue):
+    queue.enqueue({"a": "A"})
+    key, _, _ = queue.take()
+    queue.finish(key, found=10, written=9)
+    assert queue.counts()["done"] == 1
+    assert queue.shards("done")[0]["written"] == 9
+    assert queue.take() is None
+
+
+def test_fail_requeues_until_out_of_attempts(queue):
+    queue.enqueue({"a": "A"})
+    for attempt in (1, 2):
+        key, _, taken_attempt = queue.take()
+        assert taken_attempt == attempt
+        assert queue.fail(key, "boom", max_attempts=3) == "pending"
+    key, _, _ = queue.take()
+    assert queue.fail(key, "boom", max_attempts=3) == "failed"
+    assert queue.take() is None
+
+    failed = queue.shards("failed")[0]
+    assert (failed["attempts"], failed["error"]) == (3, "boom")
+    assert queue.requeue_failed() == 1
+    assert queue.take() is not None
+
+
+def test_recover_puts_shards_a_dead_crawl_was_running_back(queue):
+    queue.enqueue({"a": "A", "b": "B"})
+    queue.take()
+    queue.take()
+    assert queue.recover() == 2
+    assert queue.counts()["pending"] == 2
+    assert queue.take() is not None
+
+
+def test_claim_only_lets_a_course_be_fetched_by_one_shard(queue):
+    assert queue.claim("/course/1", "a") is True
+    assert queue.claim("/course/1", "a") is True
+    assert queue.claim("/course/1", "b") is False
+
+
+def test_state_survives_reopening(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    queue = WorkQueue(path)
+    queue.set_state("listed_at", str(time.time()))
+    queue.enqueue({"a": "A"})
+    queue.close()
+
+    queue = WorkQueue(path)
+    assert queue.get_state("listed_at") is not None
+    assert queue.counts()["pending"] == 1
+    queue.close()
+
+
+@pytest.mark.parametrize("listed_already", [False, True], ids=["fresh", "resumed"])
+def test_workers_share_the_providers_whole_max_concurrency(listed_already, limited_provider, limiter_probe, monkeypatch, tmp_path):
+    monkeypatch.setattr(crawl_module, "ScraperEngine", limiter_probe.engine)
+    monkeypatch.setattr(crawl_module, "ResponseCache", lambda: None)
+    queue_path = str(tmp_path / "queue.sqlite3")
+    if listed_already:
+        queue = WorkQueue(queue_path)
+        queue.enqueue(limited_provider().list_shards())
+        queue.set_state("listed_at", str(time.time()))
+        queue.close()
+
+    report = crawl(limited_provider.university_name, workers=2, store_path=str(tmp_path / "courses.sqlite3"), queue_path=queue_path)
+
+    assert report.counts["done"] == 4
+    # A resumed crawl never builds the listing provider, it has to end up with the same limit as a fresh one
+    assert {provider.max_concurrency for provider in limiter_probe.providers} == {4}
+    assert limiter_probe.providers[0]._limiter(limited_provider.base_url).max_concurrency == 4
+    assert limiter_probe.peak_in_flight == 4
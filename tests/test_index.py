@@ -0,0 +1,70 @@
+from scraper import index as index_module
+from scraper.index import CourseIndex, Segment
+from scraper.models import CourseData
+import pytest
+
+
+def course(code: str, name: str, aims: str = "") -> CourseData:
+    return CourseData(name=name, course_code=code, semester="", aims=aims, ilos="")
+
+
+@pytest.fixture
+def course_index(tmp_path) -> CourseIndex:
+    return CourseIndex("test_university", directory=str(tmp_path))
+
+
+def test_search_needs_every_term_and_ranks_names_first(course_index):
+    course_index.add([
+        course("PHYS1001", "Quantum Physics"),
+        course("CHEM1001", "Chemistry", aims="a little quantum chemistry"),
+        course("MATH1001", "Linear Algebra"),
+    ])
+    assert [found.course_code for found in course_index.search("quantum")] == ["PHYS1001", "CHEM1001"]
+    assert [found.course_code for found in course_index.search("quantum physics")] == ["PHYS1001"]
+    assert course_index.search("quantum biology") == []
+    assert course_index.search("   ") == []
+
+
+def test_segment_with_an_empty_postings_list_matches_nothing(tmp_path):
+    segment = Segment(str(tmp_path / "empty.segment.json"), 0.0, [], {"quantum": []}, {})
+    assert segment.search(["quantum"]) == {}
+
+
+def test_only_the_newest_copy_of_a_course_is_returned(course_index):
+    course_index.add([course("PHYS1001", "Quantum Physics"), course("CHEM1001", "Chemistry")])
+    course_index.add([course("PHYS1001", "Quantum Mechanics")])
+
+    assert [found.name for found in course_index.lookup_code("phys1001")] == ["Quantum Mechanics"]
+    assert [found.name for found in course_index.search("quantum")] == ["Quantum Mechanics"]
+    # The old name only matches the older copy, which is out of date
+    assert course_index.search("physics") == []
+    assert [found.name for found in course_index.search("chemistry")] == ["Chemistry"]
+
+
+def test_compact_merges_segments_and_keeps_the_newest_copies(course_index):
+    course_index.add([course("PHYS1001", "Quantum Physics"), course("CHEM1001", "Chemistry")])
+    newest = course_index.add([course("PHYS1001", "Quantum Mechanics")])
+    course_index.compact()
+
+    segments = course_index.segments()
+    assert len(segments) == 1
+    assert sorted(doc["name"] for doc in segments[0].docs) == ["Chemistry", "Quantum Mechanics"]
+    assert segments[0].created_at == newest.created_at
+    assert course_index.search("physics") == []
+
+
+def test_too_many_segments_get_compacted(course_index, monkeypatch):
+    monkeypatch.setattr(index_module, "MAX_SEGMENTS", 3)
+    for number in range(4):
+        course_index.add([course(f"CODE{number}", f"Course {number}")])
+    assert len(course_index.segments()) == 1
+    assert len(course_index.search("course")) == 4
+
+
+def test_stale_once_the_newest_segment_is_too_old(tmp_path):
+    course_index = CourseIndex("test_university", directory=str(tmp_path), max_age=60)
+    assert course_index.is_stale()
+    course_index.add([course("PHYS1001", "Quantum Physics")])
+    assert not course_index.is_stale()
+    course_index.max_age = 0
+    assert course_index.is_stale()
@@ -0,0 +1,22 @@
+from benchmarks.parsers import load_fixtures
+from benchmarks.replay_server import replayable_providers
+from scraper.parsing import parse_html, select
+from scraper.providers import get_provider_class
+from lxml import etree
+import pytest
+
+
+@pytest.mark.parametrize("university_name", replayable_providers())
+def test_lxml_fast_path_matches_beautifulsoup(university_name):
+    provider_class = get_provider_class(university_name)
+    soup, fast = provider_class(), provider_class(fast_parse=True)
+    for filename, html_content, course_info in load_fixtures(university_name):
+        assert fast.parse_courses(html_content, course_info) == soup.parse_courses(html_content, course_info), filename
+
+
+def test_select_only_returns_elements():
+    root = parse_html("<html><body><p class='a'>one</p><p>two</p></body></html>")
+    assert [element.text for element in select(etree.XPath("//p"), root)] == ["one", "two"]
+    assert select(etree.XPath("//p/text()"), root) == []
+    assert select(etree.XPath("count(//p)"), root) == []
+    assert select(etree.XPath("//p"), None) == []
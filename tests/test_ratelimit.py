@@ -0,0 +1,132 @@
+from scraper.errors import CircuitOpenError, DeadlineExceededError
+from scraper.ratelimit import HostLimiter, get_limiter, _limiters, _limiters_lock
+import pytest
+import time
+
+
+def succeed(limiter: HostLimiter, times: int = 1, latency: float = 0.01) -> None:
+    for _ in range(times):
+        limiter.acquire()
+        limiter.release(200, latency)
+
+
+def fail(limiter: HostLimiter, times: int = 1, status_code: int | None = 503) -> None:
+    for _ in range(times):
+        limiter.acquire()
+        limiter.release(status_code, 0.01)
+        # Throttles closer together than this only halve the limits once
+        limiter._last_decrease = 0.0
+
+
+def test_starts_at_half_the_caps_and_increases_additively_up_to_them():
+    limiter = HostLimiter("aimd.test", max_concurrency=8, max_rate=1000.0)
+    assert limiter.concurrency_limit == 4.0
+    assert limiter.rate == 500.0
+
+    succeed(limiter)
+    assert limiter.concurrency_limit == pytest.approx(4.25)
+    succeed(limiter, 200)
+    assert limiter.concurrency_limit == 8.0
+    assert limiter.rate == 1000.0
+
+
+def test_throttling_halves_the_limits_but_not_below_the_floor():
+    limiter = HostLimiter("aimd.test", max_concurrency=8, max_rate=1000.0, min_rate=100.0, failure_threshold=100)
+    succeed(limiter, 200)
+
+    fail(limiter)
+    assert limiter.concurrency_limit == 4.0
+    assert limiter.rate == 500.0
+    fail(limiter, 10)
+    assert limiter.concurrency_limit == 1.0
+    assert limiter.rate == 100.0
+
+
+def test_throttles_at_the_same_moment_only_halve_once():
+    limiter = HostLimiter("aimd.test", max_concurrency=8, max_rate=1000.0, failure_threshold=100)
+    succeed(limiter, 200)
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(503, 0.01)
+    assert limiter.concurrency_limit == 4.0
+
+
+def test_a_much_slower_site_counts_as_throttling():
+    limiter = HostLimiter("aimd.test", max_concurrency=8, max_rate=1000.0)
+    succeed(limiter, 200, latency=0.1)
+    succeed(limiter, 20, latency=2.0)
+    assert limiter.concurrency_limit < 8.0
+
+
+def test_retry_after_holds_every_request_back():
+    limiter = HostLimiter("retry.test", max_rate=1000.0, failure_threshold=100)
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_breaker_opens_after_the_threshold_and_fails_fast():
+    limiter = HostLimiter("breaker.test", max_rate=1000.0, failure_threshold=3, cooldown=60.0)
+    fail(limiter, 2)
+    assert limiter.snapshot()["circuit_open"] is False
+    fail(limiter)
+    assert limiter.snapshot()["circuit_open"] is True
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire()
+
+
+def test_half_open_lets_one_probe_through_and_closes_when_it_succeeds():
+    limiter = HostLimiter("breaker.test", max_rate=1000.0, failure_threshold=1, cooldown=0.05)
+    fail(limiter)
+    time.sleep(0.06)
+
+    limiter.acquire()
+    # Everyone else waits on the probe
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire()
+    limiter.release(200, 0.01)
+
+    assert limiter.snapshot()["circuit_open"] is False
+    assert limiter.consecutive_failures == 0
+    succeed(limiter)
+
+
+def test_half_open_probe_failing_opens_the_breaker_again():
+    limiter = HostLimiter("breaker.test", max_rate=1000.0, failure_threshold=5, cooldown=0.05)
+    fail(limiter, 5)
+    time.sleep(0.06)
+
+    limiter.acquire()
+    limiter.release(None, 0.01)
+    assert limiter.snapshot()["circuit_open"] is True
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire()
+
+
+def test_deadline_stops_the_wait_for_a_slot():
+    limiter = HostLimiter("deadline.test", max_concurrency=1, max_rate=1000.0)
+    limiter.acquire()
+    with pytest.raises(DeadlineExceededError):
+        limiter.acquire(deadline=time.monotonic() + 0.05)
+
+
+def test_configure_pulls_the_limits_under_lower_caps():
+    limiter = HostLimiter("configure.test", max_concurrency=8, max_rate=1000.0)
+    succeed(limiter, 200)
+    limiter.configure(2, 10.0)
+    assert (limiter.concurrency_limit, limiter.rate) == (2.0, 10.0)
+    limiter.configure(4, 20.0)
+    assert limiter.concurrency_limit == 2.0
+    succeed(limiter, 50)
+    assert (limiter.concurrency_limit, limiter.rate) == (4.0, 20.0)
+
+
+def test_get_limiter_follows_the_caps_it_is_asked_for():
+    with _limiters_lock:
+        _limiters.pop("shared.test", None)
+    limiter = get_limiter("shared.test", max_concurrency=2, max_rate=5.0)
+    assert get_limiter("shared.test", max_concurrency=6, max_rate=50.0) is limiter
+    assert (limiter.max_concurrency, limiter.max_rate) == (6, 50.0)